@@ -0,0 +1,83 @@
+# Script to compare the speed of the Fenwick-tree Gillespie dynamics and the
+#  approximate tau-leaping dynamics with epydemic's StochasticDynamics on
+#  Erdos-Renyi networks of increasing size.
+#
+# Usage:
+#   python -m lib.experiments.utils.benchmark_dynamics [MAX_TIME]
+#
+# The SEIVR epidemic runs until MAX_TIME (default 50). epydemic is skipped
+#  for the largest networks, where a single run takes very long. With
+#  VACCINE_RRR < 1 the dynamics differ in the infection of vaccinated nodes
+#  (see GillespieDynamics), so only the event rates are comparable, not the
+#  results.
+
+import sys
+import time
+
+from epydemic import Dynamics, ERNetwork, StochasticDynamics
+
+from lib.model.compartmental_model.seivr import SEIVR
+from lib.model.dynamics.gillespie import GillespieDynamics
+from lib.model.dynamics.tau_leaping import TauLeapingDynamics
+
+# Network sizes
+SIZES = [10 ** 4, 10 ** 5, 10 ** 6]
+
+# Largest network simulated with epydemic
+MAX_EPYDEMIC_SIZE = 10 ** 5
+
+PARAMS = {
+    SEIVR.P_EXPOSED: 0.001,
+    SEIVR.P_INFECT_ASYMPTOMATIC: 0.05,
+    SEIVR.P_INFECT_SYMPTOMATIC: 0.1,
+    SEIVR.P_SYMPTOMS: 0.2,
+    SEIVR.P_REMOVE: 0.1,
+    SEIVR.P_VACCINATED_INITIAL: 0.0,
+    SEIVR.P_VACCINATED: 0.001,
+    SEIVR.VACCINE_RRR: 0.75,
+    ERNetwork.KMEAN: 5
+}
+
+
+def run(name, e, params):
+    """
+    Run an experiment and print its speed.
+    :param name: Name of the dynamics.
+    :param e: Experiment.
+    :param params: experiment parameters
+    """
+    e.set(params=params)
+
+    start = time.perf_counter()
+    rc = e.run(fatal=True)
+    elapsed = time.perf_counter() - start
+
+    events = rc[e.METADATA][Dynamics.EVENTS]
+    print(f'{name:>10} N={params[ERNetwork.N]:>8}: {elapsed:8.2f}s, '
+          f'{events:>9} events, {events / elapsed:10.0f} events/s')
+
+
+def main(max_time=50):
+    """
+    Run the benchmark.
+    :param max_time: Maximum simulation time.
+    """
+    for n in SIZES:
+        params = {**PARAMS, ERNetwork.N: n}
+
+        run('gillespie', GillespieDynamics(
+            SEIVR(), ERNetwork(), max_time=max_time
+        ), params)
+
+        run('tau-leap', TauLeapingDynamics(
+            SEIVR(), ERNetwork(), max_time=max_time
+        ), params)
+
+        if n <= MAX_EPYDEMIC_SIZE:
+            e = StochasticDynamics(SEIVR(), ERNetwork())
+            e.process().setMaximumTime(max_time)
+            run('epydemic', e, params)
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
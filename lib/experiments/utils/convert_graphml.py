@@ -0,0 +1,28 @@
+# Script to convert networks saved as GraphML files to the binary format that
+#  is loaded by MNGeneratorFromBinary.
+#
+# Usage:
+#   python -m lib.experiments.utils.convert_graphml FILE [FILE ...]
+#
+# Each FILE (e.g. network.graphml) is converted to a file of the same name
+#  with the extension .npz (e.g. network.npz) in the same directory.
+
+import os
+import sys
+
+from lib.model.network.compact_graph import convert_graphml
+
+
+def main(files):
+    """
+    Run the process.
+    :param files: GraphML file names.
+    """
+    for src in files:
+        dst = os.path.splitext(src)[0] + '.npz'
+        print(f'{src} -> {dst}')
+        convert_graphml(src, dst)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -103,10 +103,43 @@ def make_network_data(demographics, comb_pre, comb_post, trip_pre, trip_post):
     # perform required calculations
     network_data_post.calc_trip_count_change(network_data_pre)
 
-    network_data_pre.create_adjacency_list()
-    network_data_post.create_adjacency_list()
+    network_data_pre.create_transition_matrix()
+    network_data_post.create_transition_matrix()
 
-    network_data_pre.create_cum_prob()
-    network_data_post.create_cum_prob()
+    # the dense adjacency list and cumulative probabilities are only built
+    #  when first accessed (e.g. by `draw_cbg`)
+    network_data_pre.create_alias_table()
+    network_data_post.create_alias_table()
 
     return dict(pre=network_data_pre, post=network_data_post)
+
+
+def save_network_data(network_data: Dict[str, NetworkData],
+                      dirname: str = '') -> None:
+    """
+    Save NetworkData instances (e.g. as returned by `make_network_data`) in
+    the binary format of `NetworkData.save`, one `<key>.npz` file per
+    instance.
+    :param network_data: dictionary with network data
+    :param dirname: (optional) directory of the files.
+    """
+    for key, data in network_data.items():
+        data.save(os.path.join(dirname, f'{key}.npz'))
+
+
+def load_network_data_from_binary(dirname: str = '',
+                                  keys: Tuple[str, ...] = ('pre', 'post'),
+                                  mmap: bool = True) -> Dict[str, NetworkData]:
+    """
+    Load NetworkData instances saved with `save_network_data`. Unlike
+    `load_network_data_from_files`, the transition matrices and alias tables
+    are loaded as stored instead of being created again.
+    :param dirname: (optional) directory of the files.
+    :param keys: (optional) keys of the network data to load.
+    :param mmap: (optional) memory-map the arrays.
+    :return: dictionary with network data
+    """
+    return {
+        key: NetworkData.load(os.path.join(dirname, f'{key}.npz'), mmap)
+        for key in keys
+    }
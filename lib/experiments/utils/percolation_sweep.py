@@ -0,0 +1,72 @@
+# Fast estimate of the final epidemic sizes of SEIR parameter sweeps.
+#
+# Instead of simulating the full SEIR trajectory of every replica, the final
+#  sizes are sampled by bond percolation (see
+#  lib.model.dynamics.percolation), with one pass over the network per
+#  replica for all values of the swept parameter. The result has the same
+#  structure as SimulationData.epidemic_size_per_param of the app: one row
+#  per replica and parameter value with the columns `param` and
+#  'epidemic_size' (the fraction of exposed and removed nodes at the end).
+
+import sys
+
+if sys.version_info >= (3, 8):
+    from typing import Final
+else:
+    from typing_extensions import Final
+
+from typing import Any, Dict, Optional, Sequence, Union
+
+from epydemic import CompartmentedModel, SEIR
+from networkx import Graph
+import pandas as pd
+
+from lib.model.dynamics.common import Rates
+from lib.model.dynamics.percolation import BondPercolation
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.types import RANDOM_SEED
+
+# Column names
+EXPERIMENT_ID: Final[str] = 'experiment_id'
+EPIDEMIC_SIZE: Final[str] = 'epidemic_size'
+
+
+def epidemic_size_per_param(g: Union[Graph, CompactGraph],
+                            params: Dict[str, Any], param: str,
+                            values: Sequence[float], repetitions: int = 1,
+                            column: Optional[str] = None,
+                            model: Optional[CompartmentedModel] = None,
+                            seed: Optional[RANDOM_SEED] = None) \
+        -> pd.DataFrame:
+    """
+    Sample the final epidemic size of each replica for each value of the
+    parameter `param`.
+    :param g: Network.
+    :param params: Experiment parameters (the value of `param` is replaced).
+    :param param: Swept parameter, e.g. `SEIR.P_INFECT_SYMPTOMATIC`.
+    :param values: Values of the swept parameter.
+    :param repetitions: (optional) Number of replicas per value.
+    :param column: (optional) Column name of the parameter in the result,
+        defaults to `param`.
+    :param model: (optional) Model defining the parameter keys, defaults to
+        `SEIR()`.
+    :param seed: (optional) Random seed.
+    :return: data frame with the columns `column` and 'epidemic_size'
+    """
+    model = SEIR() if model is None else model
+    column = param if column is None else column
+
+    rates = [Rates.from_params(model, {**params, param: value})
+             for value in values]
+    sizes = BondPercolation(model, g, seed).final_sizes(rates, repetitions)
+
+    df = pd.DataFrame({
+        EXPERIMENT_ID: [i for i in range(repetitions) for _ in values],
+        column: list(values) * repetitions,
+        EPIDEMIC_SIZE: sizes.ravel()
+    })
+
+    # same order as grouping by experiment and parameter
+    df = df.sort_values([EXPERIMENT_ID, column], kind='stable')
+
+    return df[[column, EPIDEMIC_SIZE]].reset_index(drop=True)
@@ -1,5 +1,6 @@
+from functools import lru_cache
 import numpy as np
-from typing import Optional, Callable
+from typing import Optional, Callable, Union, Tuple
 
 from lib.model.utils import binary_search_lowest_idx
 from lib.model.network.network_data import NetworkData
@@ -39,16 +40,16 @@ class PowerLawCutoffDist:
         return self._kappa
 
     @property
-    def p(self) -> Callable[[int], mpf]:
+    def p(self) -> Callable[[int], float]:
         """
         Probability distribution function of the power law with cutoff
         distribution. The distribution is discrete and only defined for whole
-        numbers greater or equal one.
+        numbers greater or equal one. See `pmf` for a vectorised version.
         :return: Probability distribution function.
         """
 
-        # calculate normalisation constant
-        C = 1 / polylog(self._tau, np.exp(-1. / self._kappa))
+        # normalisation constant, computed once per (tau, kappa)
+        C = float(_plc_moments(self._tau, self._kappa)[0])
 
         # define the probability distribution function
         def p(k):
@@ -61,28 +62,106 @@ class PowerLawCutoffDist:
         # return the callable
         return p
 
+    def pmf(self, k: Union[int, np.ndarray]) -> np.ndarray:
+        """
+        Vectorised probability distribution function. Values outside the
+        support (not a whole number greater or equal one) have probability 0.
+        :param k: Value or array of values.
+        :return: Array of probabilities (float64).
+        """
+        k = np.asarray(k, dtype=np.float64)
+        C = float(_plc_moments(self._tau, self._kappa)[0])
+
+        valid = (k >= 1) & (k % 1 == 0)
+        safe = np.where(valid, k, 1.)
+        p = C * np.power(safe, -self._tau) * np.exp(-safe / self._kappa)
+
+        return np.where(valid, p, 0.)
+
     @property
     def mean(self) -> mpf:
         """
-        Mean of the distribution.
+        Mean of the distribution, computed once per (tau, kappa).
         :return: mean.
         """
-        n = polylog(self._tau - 1, np.exp(-1 / self._kappa))
-        m = polylog(self._tau, np.exp(-1 / self._kappa))
-        return n / m
+        return _plc_moments(self._tau, self._kappa)[1]
 
     @property
     def var(self) -> mpf:
         """
-        Variance of the distribution.
+        Variance of the distribution, computed once per (tau, kappa).
         :return: variance.
         """
-        x = np.exp(-1 / self._kappa)
-        n = polylog(self._tau - 2, x) - polylog(self._tau - 1, x)
-        m = polylog(self._tau, x)
-        g = n / m
+        return _plc_moments(self._tau, self._kappa)[2]
+
+    def sample(self, size: Union[int, Tuple[int, ...]],
+               seed: Optional[RANDOM_SEED] = None,
+               max_deg: int = 100) -> np.ndarray:
+        """
+        Draw random integers from the distribution truncated in the range
+        [1; max_deg]. The values are drawn by inverting the cumulative
+        distribution, which is tabulated once per (tau, kappa, max_deg).
+        :param size: Output shape.
+        :param seed: (optional) Random seed.
+        :param max_deg: (optional) Largest value that can be drawn.
+        :return: Array of random integers.
+        """
+        rng = np.random.default_rng(seed=seed)
+        cdf = self.cdf(max_deg)
+        return np.searchsorted(cdf, rng.random(size), side='right') + 1
+
+    def cdf(self, max_deg: int = 100) -> np.ndarray:
+        """
+        Cumulative distribution function of the distribution truncated in the
+        range [1; max_deg], tabulated once per (tau, kappa, max_deg).
+        :param max_deg: (optional) Largest value.
+        :return: Read-only array with the cumulative probabilities of
+            1, ..., max_deg.
+        """
+        return _plc_cdf(self._tau, self._kappa, max_deg)
+
 
-        return g + self.mean - self.mean * self.mean
+@lru_cache(maxsize=None)
+def _plc_moments(tau: float, kappa: int) -> Tuple[mpf, mpf, mpf]:
+    """
+    Normalisation constant, mean and variance of the power law with cutoff
+    distribution. The polylogarithms are expensive, so each is evaluated only
+    once.
+    :param tau: Exponent.
+    :param kappa: Cutoff.
+    :return: Normalisation constant, mean and variance.
+    """
+    x = np.exp(-1 / kappa)
+    li0 = polylog(tau, x)
+    li1 = polylog(tau - 1, x)
+    li2 = polylog(tau - 2, x)
+
+    mean = li1 / li0
+    g = (li2 - li1) / li0
+
+    return 1 / li0, mean, g + mean - mean * mean
+
+
+@lru_cache(maxsize=None)
+def _plc_cdf(tau: float, kappa: int, max_deg: int) -> np.ndarray:
+    """
+    Cumulative distribution function of the power law with cutoff
+    distribution truncated in the range [1; max_deg].
+    :param tau: Exponent.
+    :param kappa: Cutoff.
+    :param max_deg: Largest value.
+    :return: Array with the cumulative probabilities of 1, ..., max_deg.
+    """
+    k = np.arange(1, max_deg + 1, dtype=np.float64)
+
+    # the normalisation constant cancels out in the truncated distribution
+    cdf = np.cumsum(np.power(k, -tau) * np.exp(-k / kappa))
+    cdf /= cdf[-1]
+
+    # shared between calls, so make sure it isn't changed
+    cdf.setflags(write=False)
+
+    return cdf
 
 
 def discrete_trunc_normal(mu: float, std: Optional[float] = None,
@@ -113,6 +192,49 @@ def discrete_trunc_exponential(exponent: float,
     return max(int(rng.exponential(exponent)), 1)
 
 
+def discrete_trunc_normal_batch(mu: Union[float, np.ndarray],
+                                std: Optional[Union[float, np.ndarray]] = None,
+                                size: Optional[Union[int, Tuple[int, ...]]]
+                                = None,
+                                seed: Optional[RANDOM_SEED] = None) \
+        -> np.ndarray:
+    """
+    Draw integers from a discrete normal distribution truncated in the range
+    [1; infinity). Batched version of `discrete_trunc_normal`: pass a shared
+    Generator as seed to avoid creating one per call.
+    :param mu: Mean (or array of means) of the distribution.
+    :param std: Standard deviation (or array of standard deviations) of the
+        distribution; defaults to mu / 2.
+    :param size: (optional) Output shape; defaults to the broadcast shape of
+        `mu` and `std`.
+    :param seed: (optional) Random seed.
+    :returns: Array of random integers.
+    """
+    rng = np.random.default_rng(seed=seed)
+    mu = np.asarray(mu, dtype=float)
+    std = mu / 2 if std is None else std
+    return np.maximum(rng.normal(mu, std, size).astype(np.int64), 1)
+
+
+def discrete_trunc_exponential_batch(exponent: Union[float, np.ndarray],
+                                     size: Optional[Union[int,
+                                                          Tuple[int, ...]]]
+                                     = None,
+                                     seed: Optional[RANDOM_SEED] = None) \
+        -> np.ndarray:
+    """
+    Draw integers from a discrete exponential distribution truncated in the
+    range [1, infinity). Batched version of `discrete_trunc_exponential`.
+    :param exponent: Exponent (or array of exponents) of the exponential
+        distribution.
+    :param size: (optional) Output shape; defaults to the shape of `exponent`.
+    :param seed: (optional) Random seed.
+    :returns: Array of random integers.
+    """
+    rng = np.random.default_rng(seed=seed)
+    return np.maximum(rng.exponential(exponent, size).astype(np.int64), 1)
+
+
 def draw_cbg(network_data: NetworkData, cbg: str,
              seed: Optional[RANDOM_SEED] = None) -> str:
     """
@@ -131,6 +253,105 @@ def draw_cbg(network_data: NetworkData, cbg: str,
     return network_data.ordered_cbgs[idx]
 
 
+def draw_cbgs(network_data: NetworkData, origins,
+              size: Optional[Union[int, Tuple[int, ...]]] = None,
+              seed: Optional[RANDOM_SEED] = None) -> np.ndarray:
+    """
+    Draw random target CBGs for a batch of origin CBGs using the alias table
+    of the network data (see `NetworkData.create_alias_table`). Each draw
+    takes constant time.
+    :param network_data: NetworkData
+    :param origins: Code (index in `ordered_cbgs`) or array of codes of the
+        origin CBGs.
+    :param size: (optional) Output shape; `origins` is broadcast to it.
+    :param seed: (optional) Random seed.
+    :return: Array of target CBG codes.
+    """
+    rng = np.random.default_rng(seed=seed)
+
+    origins = np.asarray(origins)
+    if size is not None:
+        origins = np.broadcast_to(origins, size)
+
+    targets, empty = _draw_alias_rows(
+        network_data.transition.indptr, network_data.transition.indices,
+        network_data.alias_prob, network_data.alias_idx, origins, rng
+    )
+
+    # CBGs without trips stay where they are
+    return np.where(empty, origins, targets)
+
+
+def draw_cbgs_hierarchical(network_data: NetworkData, origins,
+                           size: Optional[Union[int, Tuple[int, ...]]] = None,
+                           seed: Optional[RANDOM_SEED] = None) -> np.ndarray:
+    """
+    Draw random target CBGs for a batch of origin CBGs in two steps: first
+    the group (e.g. county) of the target from the trips of the origin CBG
+    aggregated per group, then the CBG within the group (see
+    `NetworkData.create_group_alias_table`). Each draw takes constant time.
+    The CBG within the group doesn't depend on the origin, so this only
+    approximates the exact per-origin distribution of `draw_cbgs`.
+    :param network_data: NetworkData
+    :param origins: Code (index in `ordered_cbgs`) or array of codes of the
+        origin CBGs.
+    :param size: (optional) Output shape; `origins` is broadcast to it.
+    :param seed: (optional) Random seed.
+    :return: Array of target CBG codes.
+    """
+    rng = np.random.default_rng(seed=seed)
+
+    origins = np.asarray(origins)
+    if size is not None:
+        origins = np.broadcast_to(origins, size)
+
+    groups, empty = _draw_alias_rows(
+        network_data.group_transition.indptr,
+        network_data.group_transition.indices,
+        network_data.group_alias_prob, network_data.group_alias_idx,
+        origins, rng
+    )
+
+    targets, _ = _draw_alias_rows(
+        network_data.group_indptr, network_data.group_members,
+        network_data.member_alias_prob, network_data.member_alias_idx,
+        np.where(empty, network_data.cbg_groups[origins], groups), rng
+    )
+
+    # CBGs without trips stay where they are
+    return np.where(empty, origins, targets)
+
+
+def _draw_alias_rows(indptr: np.ndarray, indices: np.ndarray,
+                     alias_prob: np.ndarray, alias_idx: np.ndarray,
+                     rows: np.ndarray, rng: np.random.Generator) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draw a column for each row from the per-row alias tables of a sparse
+    matrix in CSR format.
+    :param indptr: Row pointers.
+    :param indices: Column indices.
+    :param alias_prob: Acceptance probabilities, aligned with `indices`.
+    :param alias_idx: Alias column indices, aligned with `indices`.
+    :param rows: Array of rows.
+    :param rng: Random generator.
+    :return: Array of drawn columns (undefined for empty rows); mask of the
+        empty rows.
+    """
+    start = indptr[rows]
+    n = indptr[rows + 1] - start
+
+    if len(alias_prob) == 0:
+        return np.zeros(rows.shape, dtype=np.int64), np.ones(rows.shape, bool)
+
+    # pick an entry of the row uniformly, then keep it or take its alias
+    k = start + (rng.random(rows.shape) * n).astype(np.int64)
+    k = np.minimum(k, len(alias_prob) - 1)
+    accept = rng.random(rows.shape) < alias_prob[k]
+
+    return np.where(accept, indices[k], alias_idx[k]), n == 0
+
+
 def num_contact_dist(size: int, std: float = 1,
                      seed: Optional[RANDOM_SEED] = None) -> int:
     """
@@ -142,3 +363,17 @@ def num_contact_dist(size: int, std: float = 1,
     """
     mu = min(size / 2, 2)
     return discrete_trunc_normal(mu, std, seed=seed)
+
+
+def num_contact_dist_batch(sizes: np.ndarray, std: float = 1,
+                           seed: Optional[RANDOM_SEED] = None) -> np.ndarray:
+    """
+    Draw random numbers of contacts for a batch of households. Batched version
+    of `num_contact_dist`.
+    :param sizes: array of household sizes
+    :param std: standard deviation. defaults to 1.
+    :param seed: random seed
+    :return: array with the number of intra household contacts per household
+    """
+    mu = np.minimum(np.asarray(sizes) / 2, 2)
+    return discrete_trunc_normal_batch(mu, std, seed=seed)
@@ -0,0 +1,266 @@
+from typing import Any, Dict, List, Optional, Union
+
+from epydemic import CompartmentedModel, Dynamics, Monitor, \
+    NetworkGenerator, Process
+from epyc import Experiment, RepeatedExperiment, ResultsDict
+from networkx import Graph
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from lib.model.dynamics.common import Rates, SUSCEPTIBLE, EXPOSED, \
+    INFECTED, VACCINATED, REMOVED, STATES, compartments, csr_adjacency, \
+    bernoulli_positions, initial_states
+from lib.model.dynamics.synchronous import VectorisedSynchronousDynamics
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.types import RANDOM_SEED
+
+# Transitions with a lower probability select the changing nodes with
+#  `bernoulli_positions` instead of scanning all nodes
+SPARSE_P = 0.1
+
+
+def batched_step(states: np.ndarray, adjacency: csr_matrix, rates: Rates,
+                 rng: np.random.Generator) -> np.ndarray:
+    """
+    Perform one time step of the discrete-time SEIVR dynamics for several
+    replicas at once, in place. Same dynamics as `synchronous_step`: the
+    number of exposed and infected neighbours of all nodes in all replicas
+    is aggregated with one sparse matrix product, and a susceptible node with
+    `k_e` exposed and `k_i` infected neighbours escapes infection with
+    probability (1 - p_infect_a)^k_e * (1 - p_infect_s)^k_i, which is the
+    same as one trial per edge.
+    :param states: (N, R) int8 node states of R replicas (changed in place).
+    :param adjacency: (N, N) adjacency matrix of the network.
+    :param rates: Rates
+    :param rng: Random generator.
+    :return: Number of state changes per replica.
+    """
+    replicas = states.shape[1]
+    flat = states.reshape(-1)
+    changed = []
+
+    # infections, from the states at the start of the step
+    k_e = (adjacency @ (states == EXPOSED).astype(np.float32)).reshape(-1)
+    k_i = (adjacency @ (states == INFECTED).astype(np.float32)).reshape(-1)
+
+    # random numbers are only drawn for nodes that can change their state
+    at_risk = np.flatnonzero((flat == SUSCEPTIBLE) | (flat == VACCINATED))
+    at_risk = at_risk[(k_e[at_risk] + k_i[at_risk]) > 0]
+
+    scale = np.where(flat[at_risk] == VACCINATED, 1 - rates.vac_rrr, 1.)
+    escape = np.power(1 - scale * rates.p_infect_a, k_e[at_risk]) * \
+        np.power(1 - scale * rates.p_infect_s, k_i[at_risk])
+
+    infected = at_risk[rng.random(len(at_risk)) >= escape]
+    flat[infected] = EXPOSED
+    changed.append(infected)
+
+    # symptoms, removal and vaccination
+    for state, p, new_state in [(EXPOSED, rates.p_symptoms, INFECTED),
+                                (INFECTED, rates.p_remove, REMOVED),
+                                (SUSCEPTIBLE, rates.p_vac, VACCINATED)]:
+        if p <= 0:
+            continue
+
+        if p < SPARSE_P:
+            # select entries of any state first, much fewer than all entries
+            nodes = bernoulli_positions(flat.size, p, rng)
+            nodes = nodes[flat[nodes] == state]
+        else:
+            nodes = np.flatnonzero(flat == state)
+            nodes = nodes[rng.random(len(nodes)) < p]
+
+        flat[nodes] = new_state
+        changed.append(nodes)
+
+    # replica of each change
+    return np.bincount(np.concatenate(changed) % replicas, minlength=replicas)
+
+
+class BatchedSynchronousDynamics(VectorisedSynchronousDynamics):
+    """
+    Discrete-time SEIR / SEIVR dynamics of several replicas on one network.
+    The states of all replicas are held in an (N x R) int8 matrix and all
+    replicas are advanced together, so that each time step traverses the
+    network once instead of once per replica.
+
+    Running the experiment returns a list with one results dict per replica,
+    each with the final compartment sizes and the
+    compartment time series in the structure of epydemic's `Monitor` (every
+    `Monitor.DELTA` time units, which must be set in the parameters).
+    """
+
+    def __init__(self, model: CompartmentedModel,
+                 g: Union[Graph, CompactGraph, NetworkGenerator] = None,
+                 replicas: int = 1,
+                 max_time: float = Process.DEFAULT_MAX_TIME,
+                 seed: Optional[RANDOM_SEED] = None):
+        """
+        Create a BatchedSynchronousDynamics experiment.
+        :param model: Model defining the parameter keys and compartments,
+            e.g. `SEIVR()` or `SEIR()`.
+        :param g: (optional) Network or network generator.
+        :param replicas: (optional) Number of replicas.
+        :param max_time: (optional) Maximum simulation time.
+        :param seed: (optional) Random seed. The random generator is shared
+            by all runs of the experiment.
+        """
+        super(BatchedSynchronousDynamics, self).__init__(
+            model, g, max_time, seed
+        )
+        self._replicas = replicas
+
+    @property
+    def replicas(self) -> int:
+        """
+        Number of replicas.
+        :return: number of replicas.
+        """
+        return self._replicas
+
+    def do(self, params: Dict[str, Any]) -> List[ResultsDict]:
+        """
+        Run the replicas until no exposed or infected nodes are left in any
+        replica or the maximum simulation time is reached.
+        :param params: experiment parameters
+        :return: List of results dicts, one per replica.
+        """
+        if Monitor.DELTA not in params:
+            raise ValueError(f'The parameter {Monitor.DELTA} (the time '
+                             f'between observations) must be set.')
+
+        rates = Rates.from_params(self._model, params)
+        delta = params[Monitor.DELTA]
+
+        indptr, indices = csr_adjacency(self.network())
+        n = len(indptr) - 1
+        adjacency = csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(n, n)
+        )
+
+        states = initial_states(rates, n * self._replicas, self._rng) \
+            .reshape(n, self._replicas)
+
+        # observations at 0, delta, 2 delta, ... (as epydemic's Monitor)
+        observations = np.arange(0, self._max_time, delta)
+        series = np.zeros((len(observations), len(STATES), self._replicas),
+                          dtype=np.int64)
+
+        t = 1.0
+        events = np.zeros(self._replicas, dtype=np.int64)
+        for i, observation in enumerate(observations):
+            t = self._advance(states, adjacency, rates, t,
+                              np.floor(observation) + 1, events)
+            series[i] = self._count(states)
+
+        t = self._advance(states, adjacency, rates, t, self._max_time, events)
+
+        self.parameters()[NetworkGenerator.TOPOLOGY] = \
+            self.networkGenerator().topology()
+
+        final = self._count(states)
+        names = compartments(self._model)
+
+        rcs = []
+        for r in range(self._replicas):
+            results = {Monitor.OBSERVATIONS: observations.tolist()}
+            for state, name in names.items():
+                results[Monitor.timeSeriesForLocus(name)] = \
+                    series[:, state, r].tolist()
+            for state, name in names.items():
+                results[name] = int(final[state, r])
+
+            metadata = {
+                Dynamics.TIME: t,
+                Dynamics.EVENTS: int(events[r]),
+                RepeatedExperiment.I: r,
+                RepeatedExperiment.REPETITIONS: self._replicas
+            }
+
+            rc = Experiment.resultsdict()
+            rc[Experiment.PARAMETERS] = params.copy()
+            rc[Experiment.METADATA] = metadata
+            rc[Experiment.RESULTS] = results
+            rcs.append(rc)
+
+        return rcs
+
+    def report(self, params: Dict[str, Any], meta: Dict[str, Any],
+               res: Union[Dict[str, Any], List[ResultsDict]]) \
+            -> Union[ResultsDict, List[ResultsDict]]:
+        """
+        Return the results dicts of the replicas, with the metadata of the
+        run added to each. Returning a list (instead of one results dict
+        holding the list) lets `RepeatedExperiment` flatten the replicas of
+        repeated runs.
+        :param params: experiment parameters
+        :param meta: metadata of the run
+        :param res: results of `do`
+        :return: List of results dicts, one per replica.
+        """
+        if not isinstance(res, list):
+            # the run failed
+            return super(BatchedSynchronousDynamics, self).report(
+                params, meta, res
+            )
+
+        for rc in res:
+            rc[Experiment.METADATA] = {**meta, **rc[Experiment.METADATA]}
+
+        return res
+
+    def _advance(self, states: np.ndarray, adjacency: csr_matrix,
+                 rates: Rates, t: float, end: float,
+                 events: np.ndarray) -> float:
+        """
+        Perform the time steps from `t` up to (excluding) `end`. Once no
+        exposed or infected nodes are left, only vaccinations can happen, so
+        the remaining steps are done at once.
+        :param states: (N, R) node states (changed in place).
+        :param adjacency: Adjacency matrix of the network.
+        :param rates: Rates
+        :param t: Time of the next step.
+        :param end: Time at which to stop.
+        :param events: Number of state changes per replica (updated in
+            place).
+        :return: Time of the next step.
+        """
+        while t < end:
+            if not np.any((states == EXPOSED) | (states == INFECTED)):
+                events += self._vaccinate_batch(states, rates, end - t)
+                return end
+
+            events += batched_step(states, adjacency, rates, self._rng)
+            t += 1.0
+
+        return t
+
+    @staticmethod
+    def _count(states: np.ndarray) -> np.ndarray:
+        """
+        Count the nodes in each state per replica.
+        :param states: (N, R) node states.
+        :return: (number of states, R) array of counts.
+        """
+        return np.stack([(states == state).sum(axis=0) for state in STATES])
+
+    def _vaccinate_batch(self, states: np.ndarray, rates: Rates,
+                         steps: float) -> np.ndarray:
+        """
+        Vaccinate the susceptible nodes of all replicas as if `steps` time
+        steps without infections were performed.
+        :param states: (N, R) node states (changed in place).
+        :param rates: Rates
+        :param steps: Number of time steps.
+        :return: Number of vaccinations per replica.
+        """
+        if rates.p_vac <= 0 or steps <= 0:
+            return np.zeros(states.shape[1], dtype=np.int64)
+
+        p = 1 - (1 - rates.p_vac) ** steps
+        vaccinated = (states == SUSCEPTIBLE) & \
+            (self._rng.random(states.shape) < p)
+        states[vaccinated] = VACCINATED
+
+        return vaccinated.sum(axis=0)
@@ -0,0 +1,205 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from epydemic import CompartmentedModel
+import networkx as nx
+import numpy as np
+
+from lib.model.network.compact_graph import CompactGraph
+
+# Node states of the array based dynamics (stored as int8)
+SUSCEPTIBLE = 0
+EXPOSED = 1
+INFECTED = 2
+VACCINATED = 3
+REMOVED = 4
+
+STATES = (SUSCEPTIBLE, EXPOSED, INFECTED, VACCINATED, REMOVED)
+
+
+@dataclass
+class Rates:
+    """
+    Parameters of the SEIR / SEIVR model, read from the experiment parameters
+    with the parameter keys of the model (`SEIR` or `SEIVR`). SEIR is the
+    special case without vaccination.
+    """
+
+    # Being initially exposed
+    p_exposed: float
+    # Infection from asymptomatic (exposed) contact
+    p_infect_a: float
+    # Infection from symptomatic (infected) contact
+    p_infect_s: float
+    # Becoming symptomatic after exposure
+    p_symptoms: float
+    # Recovering from an infection
+    p_remove: float
+    # Being initially vaccinated
+    p_vac_init: float = 0.
+    # Being vaccinated
+    p_vac: float = 0.
+    # Relative Risk Reduction of vaccine
+    vac_rrr: float = 0.
+    # Being initially removed
+    p_removed_init: float = 0.
+    # Being initially infected
+    p_infected_init: float = 0.
+
+    @classmethod
+    def from_params(cls, model: CompartmentedModel,
+                    params: Dict[str, Any]) -> 'Rates':
+        """
+        Read the rates from the experiment parameters.
+        :param model: Model (instance or class) defining the parameter keys,
+            e.g. `SEIR` or `SEIVR`.
+        :param params: experiment parameters
+        :return: Rates
+        """
+
+        def get(key: str, default: Optional[float] = None) -> float:
+            name = getattr(model, key, None)
+            if name is None or (default is not None and name not in params):
+                return default
+            return params[name]
+
+        rates = cls(
+            p_exposed=get('P_EXPOSED'),
+            p_infect_a=get('P_INFECT_ASYMPTOMATIC'),
+            p_infect_s=get('P_INFECT_SYMPTOMATIC'),
+            p_symptoms=get('P_SYMPTOMS'),
+            p_remove=get('P_REMOVE'),
+            p_vac_init=get('P_VACCINATED_INITIAL', 0.),
+            p_vac=get('P_VACCINATED', 0.),
+            vac_rrr=get('VACCINE_RRR', 0.),
+            p_removed_init=get('P_REMOVED_INITIAL', 0.),
+            p_infected_init=get('P_INFECTED_INITIAL', 0.)
+        )
+
+        # make sure initial occupancy doesn't exceed one
+        if sum(rates.initial_distribution[1:]) > 1.0:
+            raise ValueError('Initial occupancy parameters must not exceed 1.')
+
+        return rates
+
+    @property
+    def initial_distribution(self) -> List[float]:
+        """
+        Initial distribution of the nodes to the states, indexed by state.
+        :return: list of probabilities.
+        """
+        dist = [0.] * len(STATES)
+        dist[EXPOSED] = self.p_exposed
+        dist[INFECTED] = self.p_infected_init
+        dist[VACCINATED] = self.p_vac_init
+        dist[REMOVED] = self.p_removed_init
+        dist[SUSCEPTIBLE] = max(1. - sum(dist), 0.)
+        return dist
+
+
+def compartments(model: CompartmentedModel) -> Dict[int, str]:
+    """
+    Return the compartment names of the model by state. The vaccinated state
+    is only included if the model has a `VACCINATED` compartment.
+    :param model: Model (instance or class), e.g. `SEIR` or `SEIVR`.
+    :return: dictionary of compartment names.
+    """
+    names = {
+        SUSCEPTIBLE: model.SUSCEPTIBLE,
+        EXPOSED: model.EXPOSED,
+        INFECTED: model.INFECTED,
+        VACCINATED: getattr(model, 'VACCINATED', None),
+        REMOVED: model.REMOVED
+    }
+    return {state: name for state, name in names.items() if name is not None}
+
+
+def csr_adjacency(g: Union[nx.Graph, CompactGraph]) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the CSR adjacency of a network. Nodes of NetworkX graphs are
+    labelled 0 ... n-1 in the order of `g.nodes`.
+    :param g: Graph or CompactGraph
+    :return: Row pointers and column indices.
+    """
+    if isinstance(g, CompactGraph):
+        return g.indptr, g.indices
+
+    a = nx.to_scipy_sparse_array(g, nodelist=list(g.nodes), format='csr')
+    return a.indptr.astype(np.int64), a.indices.astype(np.int32)
+
+
+def initial_states(rates: Rates, n: int,
+                   rng: np.random.Generator) -> np.ndarray:
+    """
+    Place each node independently into its initial state according to the
+    initial distribution of the rates.
+    :param rates: Rates
+    :param n: Number of nodes.
+    :param rng: Random generator.
+    :return: int8 array of node states.
+    """
+    return rng.choice(
+        len(STATES), size=n, p=rates.initial_distribution
+    ).astype(np.int8)
+
+
+def neighbours(indptr: np.ndarray, indices: np.ndarray,
+               nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return all (node, neighbour) pairs of the given nodes.
+    :param indptr: Row pointers of the CSR adjacency.
+    :param indices: Column indices of the CSR adjacency.
+    :param nodes: Node IDs.
+    :return: Node and neighbour of each pair.
+    """
+    starts = indptr[nodes]
+    degree = indptr[nodes + 1] - starts
+
+    # position of each pair in `indices`
+    offsets = np.repeat(starts - (np.cumsum(degree) - degree), degree)
+    positions = offsets + np.arange(offsets.size)
+
+    return np.repeat(nodes, degree), indices[positions]
+
+
+def count_states(states: np.ndarray) -> np.ndarray:
+    """
+    Count the nodes in each state.
+    :param states: Node states.
+    :return: array of counts, indexed by state.
+    """
+    return np.bincount(states.ravel(), minlength=len(STATES))
+
+
+def bernoulli_positions(size: int, p: float,
+                        rng: np.random.Generator) -> np.ndarray:
+    """
+    Select each of the positions 0 ... size-1 independently with probability
+    `p`. The gaps between selected positions are geometrically distributed,
+    so only about size * p random numbers are drawn.
+    :param size: Number of positions.
+    :param p: Selection probability.
+    :param rng: Random generator.
+    :return: Sorted array of the selected positions.
+    """
+    if p <= 0 or size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(size)
+
+    chunks = []
+    start = -1
+    while True:
+        # expected number of the remaining selections plus some slack
+        batch = int((size - start) * p * 1.1) + 16
+        positions = start + np.cumsum(rng.geometric(p, size=batch))
+
+        if positions[-1] >= size:
+            chunks.append(positions[positions < size])
+            break
+
+        chunks.append(positions)
+        start = positions[-1]
+
+    return np.concatenate(chunks)
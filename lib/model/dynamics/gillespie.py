@@ -0,0 +1,421 @@
+import math
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from epydemic import CompartmentedModel, Dynamics, Monitor, \
+    NetworkExperiment, NetworkGenerator, Process
+from networkx import Graph
+import numpy as np
+
+from lib.model.compartmental_model.mixins import QuarantineMixin
+from lib.model.dynamics.common import Rates, SUSCEPTIBLE, EXPOSED, \
+    INFECTED, VACCINATED, REMOVED, compartments, count_states, \
+    csr_adjacency, initial_states
+from lib.model.dynamics.synchronous import FixedCompactNetwork
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.types import RANDOM_SEED
+
+
+class FenwickTree:
+    """
+    Fenwick tree (binary indexed tree) of non-negative integer weights.
+    Changing a weight and finding the element at a cumulative weight (to
+    draw an element proportional to its weight) are O(log n).
+    """
+
+    def __init__(self, weights: np.ndarray):
+        """
+        Create a FenwickTree in O(n).
+        :param weights: Initial integer weights.
+        """
+        weights = np.asarray(weights, dtype=np.int64)
+        n = len(weights)
+
+        # node i (1-based) holds the sum of the weights i - lowbit(i) ... i-1
+        i = np.arange(1, n + 1)
+        cumulative = np.concatenate([[0], np.cumsum(weights)])
+        tree = cumulative[i] - cumulative[i - (i & -i)]
+
+        self._n = n
+        self._tree: List[int] = [0] + tree.tolist()
+        self._weights: List[int] = weights.tolist()
+        self._total = int(cumulative[-1])
+
+        # largest power of two not exceeding n
+        self._top = 1 << (n.bit_length() - 1) if n else 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i: int) -> int:
+        return self._weights[i]
+
+    @property
+    def total(self) -> int:
+        """
+        Sum of all weights.
+        :return: total weight.
+        """
+        return self._total
+
+    def add(self, i: int, delta: int) -> None:
+        """
+        Add to the weight of an element.
+        :param i: Index of the element.
+        :param delta: Change of the weight.
+        """
+        self._weights[i] += delta
+        self._total += delta
+
+        tree = self._tree
+        i += 1
+        while i <= self._n:
+            tree[i] += delta
+            i += i & -i
+
+    def find(self, x: int) -> int:
+        """
+        Return the element at cumulative weight `x`, i.e. the smallest index i
+        with weights[0] + ... + weights[i] > x.
+        :param x: Cumulative weight in [0; total).
+        :return: Index of the element.
+        """
+        tree = self._tree
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self._n and tree[nxt] <= x:
+                pos = nxt
+                x -= tree[nxt]
+            step >>= 1
+        return pos
+
+    def draw(self, rng: np.random.Generator) -> int:
+        """
+        Draw an element with probability proportional to its weight.
+        :param rng: Random generator.
+        :return: Index of the element.
+        """
+        return self.find(int(rng.random() * self._total))
+
+
+class DynamicAdjacency:
+    """
+    Adjacency of a network that is mostly static: the neighbours are read
+    from the CSR arrays until a node's edges change for the first time.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray):
+        """
+        Create a DynamicAdjacency.
+        :param indptr: Row pointers of the CSR adjacency.
+        :param indices: Column indices of the CSR adjacency.
+        """
+        self._indptr = indptr
+        self._indices = indices
+        self._changed: Dict[int, set] = {}
+
+    def neighbours(self, v: int) -> Iterable[int]:
+        """
+        Neighbours of a node.
+        :param v: Node ID.
+        :return: Node IDs.
+        """
+        if v in self._changed:
+            return list(self._changed[v])
+        return self._indices[self._indptr[v]:self._indptr[v + 1]].tolist()
+
+    def _set(self, v: int) -> set:
+        if v not in self._changed:
+            self._changed[v] = set(self.neighbours(v))
+        return self._changed[v]
+
+    def add_edge(self, u: int, v: int) -> None:
+        """
+        Add an edge.
+        :param u: Node ID.
+        :param v: Node ID.
+        """
+        self._set(u).add(v)
+        self._set(v).add(u)
+
+    def remove_edge(self, u: int, v: int) -> None:
+        """
+        Remove an edge.
+        :param u: Node ID.
+        :param v: Node ID.
+        """
+        self._set(u).discard(v)
+        self._set(v).discard(u)
+
+
+class GillespieDynamics(NetworkExperiment):
+    """
+    Exact continuous-time SEIR / SEIVR dynamics (Gillespie's direct method):
+    infections along the SE, SI, EV and IV edges, and symptoms, removal and
+    vaccination of the E, I and S nodes, at the rates of `SEIVR.build`. The
+    rates of each event type are kept per node in a Fenwick tree (e.g. the
+    number of exposed neighbours of each susceptible node for SE), so
+    drawing an event and updating the rates after a change of compartment
+    are O(log n) instead of the locus bookkeeping of epydemic's
+    `StochasticDynamics`.
+
+    The model (`SEIR`, `SEIVR` or their quarantine variants) defines the
+    parameters and compartments. Quarantine models rewire the edges of
+    newly symptomatic nodes as `QuarantineMixin` does, and `Monitor` models
+    get the compartment time series every `Monitor.DELTA` time units.
+
+    The results are only interchangeable with epydemic's dynamics of the
+    model if `VACCINE_RRR` is 1 (or nothing is vaccinated). Here infections
+    along EV and IV edges expose the vaccinated node, with the infection
+    rates reduced by `VACCINE_RRR`. `SEIVR.infect` acts on the first node of
+    the edge, the exposed or infected one, so there an EV event changes
+    nothing, an IV event sets the infected node back to exposed, and
+    vaccinated nodes are never infected.
+    """
+
+    # Event types, in the order of the trees
+    _SE, _SI, _EV, _IV, _E, _I, _S = range(7)
+
+    def __init__(self, model: CompartmentedModel,
+                 g: Union[Graph, CompactGraph, NetworkGenerator] = None,
+                 max_time: float = Process.DEFAULT_MAX_TIME,
+                 seed: Optional[RANDOM_SEED] = None):
+        """
+        Create a GillespieDynamics experiment.
+        :param model: Model defining the parameter keys and compartments,
+            e.g. `SEIVR()`, `SEIR()` or `MonitoredSEIVRWithQuarantine()`.
+        :param g: (optional) Network or network generator.
+        :param max_time: (optional) Maximum simulation time.
+        :param seed: (optional) Random seed. The random generator is shared
+            by all runs of the experiment.
+        """
+        if isinstance(g, CompactGraph):
+            g = FixedCompactNetwork(g)
+
+        super(GillespieDynamics, self).__init__(g)
+
+        self._model = model
+        self._max_time = max_time
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def model(self) -> CompartmentedModel:
+        """
+        Model defining the parameter keys and compartments.
+        :return: model.
+        """
+        return self._model
+
+    @property
+    def max_time(self) -> float:
+        """
+        Maximum simulation time.
+        :return: maximum simulation time.
+        """
+        return self._max_time
+
+    def _build(self, params: Dict[str, Any]) -> None:
+        """
+        Set up the states, neighbour counts and event trees of a run.
+        :param params: experiment parameters
+        """
+        rates = Rates.from_params(self._model, params)
+
+        p_quarantine = 0.
+        if isinstance(self._model, QuarantineMixin):
+            p_quarantine = params[self._model.P_QUARANTINE]
+
+        indptr, indices = csr_adjacency(self.network())
+        n = len(indptr) - 1
+
+        states = initial_states(rates, n, self._rng)
+
+        # number of exposed and infected neighbours of each node
+        src = np.repeat(np.arange(n), np.diff(indptr))
+        k_e = np.bincount(src, weights=states[indices] == EXPOSED,
+                          minlength=n).astype(np.int64)
+        k_i = np.bincount(src, weights=states[indices] == INFECTED,
+                          minlength=n).astype(np.int64)
+
+        s, v = states == SUSCEPTIBLE, states == VACCINATED
+        self._trees = [
+            FenwickTree(np.where(s, k_e, 0)), FenwickTree(np.where(s, k_i, 0)),
+            FenwickTree(np.where(v, k_e, 0)), FenwickTree(np.where(v, k_i, 0)),
+            FenwickTree(states == EXPOSED), FenwickTree(states == INFECTED),
+            FenwickTree(s)
+        ]
+
+        scale = 1 - rates.vac_rrr
+        self._rates = [rates.p_infect_a, rates.p_infect_s,
+                       scale * rates.p_infect_a, scale * rates.p_infect_s,
+                       rates.p_symptoms, rates.p_remove, rates.p_vac]
+
+        self._states: List[int] = states.tolist()
+        self._k_e: List[int] = k_e.tolist()
+        self._k_i: List[int] = k_i.tolist()
+        self._counts: List[int] = count_states(states).tolist()
+        self._adjacency = DynamicAdjacency(indptr, indices)
+        self._p_quarantine = p_quarantine
+
+    def do(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run the dynamics until no more events can happen or the maximum
+        simulation time is reached.
+        :param params: experiment parameters
+        :return: Number of nodes per compartment (and the time series of
+            `Monitor` models).
+        """
+        self._build(params)
+
+        monitor = isinstance(self._model, Monitor)
+        delta = params[Monitor.DELTA] if monitor else math.inf
+        observations, series = [], []
+
+        rng = self._rng
+        trees, rates = self._trees, self._rates
+        t = 0.0
+        events = 0
+        while t < self._max_time:
+            weights = [r * tree.total for r, tree in zip(rates, trees)]
+            a = sum(weights)
+            if a <= 0:
+                break
+
+            dt = rng.exponential(1 / a)
+
+            # observe at the times passed by this step (before the event)
+            next_observation = len(observations) * delta
+            while next_observation <= min(t + dt, self._max_time):
+                observations.append(next_observation)
+                series.append(list(self._counts))
+                next_observation = len(observations) * delta
+
+            t += dt
+            if t >= self._max_time:
+                t = self._max_time
+                break
+
+            # draw the event type and the node it happens at
+            x = rng.random() * a
+            event = 0
+            while event < len(weights) - 1 and x >= weights[event]:
+                x -= weights[event]
+                event += 1
+
+            self._fire(event, trees[event].draw(rng))
+            events += 1
+
+        self.parameters()[NetworkGenerator.TOPOLOGY] = \
+            self.networkGenerator().topology()
+        self.metadata()[Dynamics.TIME] = t
+        self.metadata()[Dynamics.EVENTS] = events
+
+        names = compartments(self._model)
+        results = {name: self._counts[state] for state, name in names.items()}
+
+        if monitor:
+            results[Monitor.OBSERVATIONS] = observations
+            for state, name in names.items():
+                results[Monitor.timeSeriesForLocus(name)] = \
+                    [counts[state] for counts in series]
+
+        return results
+
+    def _fire(self, event: int, v: int) -> None:
+        """
+        Perform an event at a node.
+        :param event: Event type.
+        :param v: Node ID.
+        """
+        if event <= self._IV:
+            self._change(v, EXPOSED)
+        elif event == self._E:
+            self._change(v, INFECTED)
+            if self._p_quarantine > 0:
+                self._quarantine(v)
+        elif event == self._I:
+            self._change(v, REMOVED)
+        else:
+            self._change(v, VACCINATED)
+
+    def _change(self, v: int, state: int) -> None:
+        """
+        Move a node to another compartment and update the rates of the node
+        and its neighbours.
+        :param v: Node ID.
+        :param state: New state.
+        """
+        old = self._states[v]
+        self._states[v] = state
+        self._counts[old] -= 1
+        self._counts[state] += 1
+
+        trees = self._trees
+        self._set_node_weights(v, old, -1)
+        self._set_node_weights(v, state, 1)
+
+        # the neighbours' number of exposed / infected neighbours changes
+        for s, sign in [(old, -1), (state, 1)]:
+            if s == EXPOSED:
+                k, se, ve = self._k_e, trees[self._SE], trees[self._EV]
+            elif s == INFECTED:
+                k, se, ve = self._k_i, trees[self._SI], trees[self._IV]
+            else:
+                continue
+
+            states = self._states
+            for w in self._adjacency.neighbours(v):
+                k[w] += sign
+                if states[w] == SUSCEPTIBLE:
+                    se.add(w, sign)
+                elif states[w] == VACCINATED:
+                    ve.add(w, sign)
+
+    def _set_node_weights(self, v: int, state: int, sign: int) -> None:
+        """
+        Add (sign 1) or remove (sign -1) the weights of a node in a state.
+        :param v: Node ID.
+        :param state: State of the node.
+        :param sign: 1 or -1.
+        """
+        trees = self._trees
+        if state == SUSCEPTIBLE:
+            trees[self._SE].add(v, sign * self._k_e[v])
+            trees[self._SI].add(v, sign * self._k_i[v])
+            trees[self._S].add(v, sign)
+        elif state == VACCINATED:
+            trees[self._EV].add(v, sign * self._k_e[v])
+            trees[self._IV].add(v, sign * self._k_i[v])
+        elif state == EXPOSED:
+            trees[self._E].add(v, sign)
+        elif state == INFECTED:
+            trees[self._I].add(v, sign)
+
+    def _quarantine(self, v: int) -> None:
+        """
+        Quarantine the neighbours of a newly symptomatic node as
+        `QuarantineMixin.quarantine` does: each susceptible neighbour is,
+        with probability `p_quarantine`, disconnected from the node and
+        connected to a random susceptible node instead.
+        :param v: Node ID.
+        """
+        rng = self._rng
+        adjacency = self._adjacency
+        susceptible = self._trees[self._S]
+
+        for w in adjacency.neighbours(v):
+            if rng.random() > self._p_quarantine:
+                continue
+
+            if self._states[w] != SUSCEPTIBLE:
+                continue
+
+            adjacency.remove_edge(v, w)
+            self._k_i[w] -= 1
+            self._trees[self._SI].add(w, -1)
+
+            # both ends of the new edge are susceptible, so no rates change
+            w_prime = susceptible.draw(rng)
+            if w_prime != w:
+                adjacency.add_edge(w, w_prime)
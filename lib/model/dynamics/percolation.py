@@ -0,0 +1,178 @@
+from typing import Optional, Sequence, Union
+
+from epydemic import CompartmentedModel
+from networkx import Graph
+import numpy as np
+
+from lib.model.compartmental_model.mixins import QuarantineMixin
+from lib.model.dynamics.common import Rates, csr_adjacency
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.types import RANDOM_SEED
+
+
+def transmissibility(rates: Rates) -> float:
+    """
+    Probability that an infection is transmitted along an edge before the
+    infecting node is removed. The edge escapes infection while the node is
+    exposed (the node becomes symptomatic first) and while it is infected
+    (the node is removed first):
+    T = 1 - p_symptoms / (p_symptoms + p_infect_a) *
+        p_remove / (p_remove + p_infect_s)
+    :param rates: Rates
+    :return: Transmissibility.
+    """
+    escape_a = rates.p_symptoms / (rates.p_symptoms + rates.p_infect_a)
+    escape_s = rates.p_remove / (rates.p_remove + rates.p_infect_s)
+    return 1. - escape_a * escape_s
+
+
+def percolation_final_sizes(indptr: np.ndarray, indices: np.ndarray,
+                            transmissibilities: Sequence[float],
+                            seeds: np.ndarray,
+                            rng: np.random.Generator) -> np.ndarray:
+    """
+    Final epidemic sizes of one replica for several transmissibilities, by
+    bond percolation (Newman and Ziff, 2000). Each edge gets a uniform random
+    number and is open for all transmissibilities above it, so adding the
+    edges in the order of their numbers (merging the components with a
+    union-find) passes through the percolated networks of all
+    transmissibilities in one pass. The final size is the number of nodes in
+    components with a seed.
+    :param indptr: Row pointers of the CSR adjacency.
+    :param indices: Column indices of the CSR adjacency.
+    :param transmissibilities: Transmissibilities (any order).
+    :param seeds: Boolean array of the initially infected nodes.
+    :param rng: Random generator.
+    :return: Final size for each transmissibility.
+    """
+    transmissibilities = np.asarray(transmissibilities, dtype=np.float64)
+    order = np.argsort(transmissibilities)
+    n = len(indptr) - 1
+
+    if len(order) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # each undirected edge once
+    src = np.repeat(np.arange(n), np.diff(indptr))
+    keep = src < indices
+    src, dst = src[keep], indices[keep]
+
+    # only edges open at the largest transmissibility are ever added
+    thresholds = rng.random(len(src))
+    open_edges = np.flatnonzero(thresholds < transmissibilities[order[-1]])
+    open_edges = open_edges[np.argsort(thresholds[open_edges])]
+    stops = np.searchsorted(thresholds[open_edges],
+                            transmissibilities[order])
+    src = src[open_edges].tolist()
+    dst = dst[open_edges].tolist()
+
+    parent = list(range(n))
+    size = [1] * n
+    seeded = seeds.astype(bool).tolist()
+    infected = int(np.count_nonzero(seeds))
+
+    def find(v: int) -> int:
+        while parent[v] != v:
+            # path halving
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    sizes = np.zeros(len(order), dtype=np.int64)
+    start = 0
+    for i, stop in zip(order, stops):
+        for e in range(start, stop):
+            a, b = find(src[e]), find(dst[e])
+            if a == b:
+                continue
+
+            # a component with a seed infects the other component
+            if seeded[a] != seeded[b]:
+                infected += size[b] if seeded[a] else size[a]
+
+            # union by size
+            if size[a] < size[b]:
+                a, b = b, a
+            parent[b] = a
+            size[a] += size[b]
+            seeded[a] = seeded[a] or seeded[b]
+
+        start = stop
+        sizes[i] = infected
+
+    return sizes
+
+
+class BondPercolation:
+    """
+    Final epidemic sizes of the SEIR model without quarantine by bond
+    percolation. The final size of SEIR (exposed and removed nodes at the
+    end) is the number of nodes connected to an initially exposed node by
+    edges that transmit the infection, each with probability
+    `transmissibility(rates)`. One union-find pass over the edges gives the
+    final sizes of a replica for all parameter values at once, instead of
+    simulating the full trajectory for each.
+
+    Vaccination (whose outcome depends on the timing of the infections) and
+    quarantine (which rewires the network) are not supported.
+    """
+
+    def __init__(self, model: CompartmentedModel,
+                 g: Union[Graph, CompactGraph],
+                 seed: Optional[RANDOM_SEED] = None):
+        """
+        Create a BondPercolation.
+        :param model: Model defining the parameter keys, e.g. `SEIR()`.
+        :param g: Network.
+        :param seed: (optional) Random seed.
+        """
+        if isinstance(model, QuarantineMixin) or \
+                hasattr(model, 'VACCINATED'):
+            raise ValueError('Only SEIR models without quarantine are '
+                             'supported.')
+
+        self._model = model
+        self._indptr, self._indices = csr_adjacency(g)
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def model(self) -> CompartmentedModel:
+        """
+        Model defining the parameter keys.
+        :return: model.
+        """
+        return self._model
+
+    @property
+    def n(self) -> int:
+        """
+        Number of nodes of the network.
+        :return: number of nodes.
+        """
+        return len(self._indptr) - 1
+
+    def final_sizes(self, rates: Sequence[Rates],
+                    repetitions: int = 1) -> np.ndarray:
+        """
+        Sample the final epidemic sizes for several parameter settings.
+        Settings with the same initial exposure share one pass (and the same
+        initially exposed nodes) per repetition.
+        :param rates: Rates of each setting.
+        :param repetitions: (optional) Number of replicas per setting.
+        :return: (repetitions, number of settings) array of final sizes as
+            fractions of the nodes.
+        """
+        sizes = np.zeros((repetitions, len(rates)))
+        t = np.array([transmissibility(r) for r in rates])
+        p_exposed = np.array([r.p_exposed for r in rates])
+
+        for p in np.unique(p_exposed):
+            settings = np.flatnonzero(p_exposed == p)
+            for i in range(repetitions):
+                seeds = self._rng.random(self.n) < p
+                sizes[i, settings] = percolation_final_sizes(
+                    self._indptr, self._indices, t[settings], seeds,
+                    self._rng
+                )
+
+        return sizes / self.n
@@ -0,0 +1,197 @@
+from typing import Any, Dict, Optional, Union
+
+from epydemic import CompartmentedModel, Dynamics, NetworkExperiment, \
+    NetworkGenerator, Process
+from networkx import Graph
+import numpy as np
+
+from lib.model.dynamics.common import Rates, SUSCEPTIBLE, EXPOSED, \
+    INFECTED, VACCINATED, REMOVED, compartments, count_states, \
+    csr_adjacency, initial_states, neighbours
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.types import RANDOM_SEED
+
+
+class FixedCompactNetwork(NetworkGenerator):
+    """
+    Network generator that always returns the same CompactGraph. The array
+    based dynamics don't change the network, so no copy is made.
+    """
+
+    def __init__(self, g: CompactGraph):
+        super(FixedCompactNetwork, self).__init__()
+        self._graph_prototype = g
+
+    def topology(self) -> str:
+        return 'unknown'
+
+    def _generate(self, params: Dict[str, Any]) -> CompactGraph:
+        return self._graph_prototype
+
+
+def synchronous_step(states: np.ndarray, indptr: np.ndarray,
+                     indices: np.ndarray, rates: Rates,
+                     rng: np.random.Generator) -> int:
+    """
+    Perform one time step of the discrete-time SEIVR dynamics in place.
+
+    First all infections are drawn from the states at the start of the step:
+    each edge between an exposed (infected) and a susceptible node transmits
+    with probability `p_infect_a` (`p_infect_s`), edges to vaccinated nodes
+    with the probability reduced by the relative risk reduction of the
+    vaccine. Then symptoms, removal and vaccination follow in this order,
+    each on the states after the preceding transitions, so a node exposed in
+    the step may become symptomatic in the same step.
+
+    For SE and SI edges this is the outcome of epydemic's
+    `SynchronousDynamics`, which fires the events locus by locus: nodes
+    exposed in the step only have new SE edges, which are taken from the
+    start of the step. It differs for vaccinated nodes. epydemic takes the
+    EV and IV loci after the SE and SI events have fired (so nodes exposed in
+    the step already infect along them), and `SEIVR.infect` acts on the
+    exposed or infected end of these edges, so vaccinated nodes are never
+    infected there.
+    :param states: int8 node states (changed in place).
+    :param indptr: Row pointers of the CSR adjacency.
+    :param indices: Column indices of the CSR adjacency.
+    :param rates: Rates
+    :param rng: Random generator.
+    :return: Number of state changes.
+    """
+    events = 0
+
+    # infections
+    infectious = np.flatnonzero((states == EXPOSED) | (states == INFECTED))
+    src, dst = neighbours(indptr, indices, infectious)
+
+    target = states[dst]
+    at_risk = (target == SUSCEPTIBLE) | (target == VACCINATED)
+    src, dst, target = src[at_risk], dst[at_risk], target[at_risk]
+
+    p = np.where(states[src] == EXPOSED, rates.p_infect_a, rates.p_infect_s)
+    p = np.where(target == VACCINATED, (1 - rates.vac_rrr) * p, p)
+
+    infected = np.unique(dst[rng.random(len(p)) < p])
+    states[infected] = EXPOSED
+    events += len(infected)
+
+    # symptoms, removal and vaccination
+    for state, p, new_state in [(EXPOSED, rates.p_symptoms, INFECTED),
+                                (INFECTED, rates.p_remove, REMOVED),
+                                (SUSCEPTIBLE, rates.p_vac, VACCINATED)]:
+        if p <= 0:
+            continue
+
+        nodes = np.flatnonzero(states == state)
+        nodes = nodes[rng.random(len(nodes)) < p]
+        states[nodes] = new_state
+        events += len(nodes)
+
+    return events
+
+
+class VectorisedSynchronousDynamics(NetworkExperiment):
+    """
+    Discrete-time SEIR / SEIVR dynamics on arrays. The node states are held
+    in an int8 array and all transitions of a time step are performed as
+    NumPy operations over the CSR adjacency of the network, instead of one
+    event at a time as in epydemic's dynamics.
+
+    The experiment takes the same parameters as the model (`SEIR` or
+    `SEIVR`, only used for its parameter keys and compartment names) and
+    returns the number of nodes per compartment, like epydemic's dynamics.
+    """
+
+    def __init__(self, model: CompartmentedModel,
+                 g: Union[Graph, CompactGraph, NetworkGenerator] = None,
+                 max_time: float = Process.DEFAULT_MAX_TIME,
+                 seed: Optional[RANDOM_SEED] = None):
+        """
+        Create a VectorisedSynchronousDynamics experiment.
+        :param model: Model defining the parameter keys and compartments,
+            e.g. `SEIVR()` or `SEIR()`.
+        :param g: (optional) Network or network generator. Generators may
+            return CompactGraphs (e.g. with `MNGenerator.COMPACT` set).
+        :param max_time: (optional) Maximum simulation time.
+        :param seed: (optional) Random seed. The random generator is shared
+            by all runs of the experiment.
+        """
+        if isinstance(g, CompactGraph):
+            g = FixedCompactNetwork(g)
+
+        super(VectorisedSynchronousDynamics, self).__init__(g)
+
+        self._model = model
+        self._max_time = max_time
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def model(self) -> CompartmentedModel:
+        """
+        Model defining the parameter keys and compartments.
+        :return: model.
+        """
+        return self._model
+
+    @property
+    def max_time(self) -> float:
+        """
+        Maximum simulation time.
+        :return: maximum simulation time.
+        """
+        return self._max_time
+
+    def do(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run the dynamics until no exposed or infected nodes are left or the
+        maximum simulation time is reached.
+        :param params: experiment parameters
+        :return: Number of nodes per compartment.
+        """
+        rates = Rates.from_params(self._model, params)
+        indptr, indices = csr_adjacency(self.network())
+
+        states = initial_states(rates, len(indptr) - 1, self._rng)
+
+        t = 1.0
+        events = 0
+        while t < self._max_time:
+            if not np.any((states == EXPOSED) | (states == INFECTED)):
+                # only vaccinations can happen until the maximum time, so
+                #  do the remaining steps at once
+                events += self._vaccinate(states, rates, self._max_time - t)
+                t = self._max_time
+                break
+
+            events += synchronous_step(states, indptr, indices, rates,
+                                       self._rng)
+            t += 1.0
+
+        self.parameters()[NetworkGenerator.TOPOLOGY] = \
+            self.networkGenerator().topology()
+        self.metadata()[Dynamics.TIME] = t
+        self.metadata()[Dynamics.EVENTS] = events
+
+        counts = count_states(states)
+        return {name: int(counts[state])
+                for state, name in compartments(self._model).items()}
+
+    def _vaccinate(self, states: np.ndarray, rates: Rates,
+                   steps: float) -> int:
+        """
+        Vaccinate the susceptible nodes as if `steps` time steps without
+        infections were performed.
+        :param states: Node states (changed in place).
+        :param rates: Rates
+        :param steps: Number of time steps.
+        :return: Number of vaccinations.
+        """
+        if rates.p_vac <= 0 or steps <= 0:
+            return 0
+
+        susceptible = np.flatnonzero(states == SUSCEPTIBLE)
+        p = 1 - (1 - rates.p_vac) ** steps
+        vaccinated = susceptible[self._rng.random(len(susceptible)) < p]
+        states[vaccinated] = VACCINATED
+
+        return len(vaccinated)
@@ -0,0 +1,328 @@
+import math
+from typing import Any, Dict, Optional, Tuple, Union
+import sys
+if sys.version_info >= (3, 8):
+    from typing import Final
+else:
+    from typing_extensions import Final
+
+from epydemic import CompartmentedModel, Dynamics, Monitor, \
+    NetworkExperiment, NetworkGenerator, Process
+from networkx import Graph
+import numpy as np
+
+from lib.model.compartmental_model.mixins import QuarantineMixin
+from lib.model.dynamics.common import Rates, SUSCEPTIBLE, EXPOSED, \
+    INFECTED, VACCINATED, REMOVED, STATES, compartments, count_states, \
+    csr_adjacency, initial_states, neighbours
+from lib.model.dynamics.synchronous import FixedCompactNetwork
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.types import RANDOM_SEED
+
+
+def leap_size(counts: np.ndarray, drift: np.ndarray, variance: np.ndarray,
+              epsilon: float) -> float:
+    """
+    Select the largest leap for which the expected change and the standard
+    deviation of the change of each compartment stay below a fraction
+    `epsilon` of its size (at least one node), following Cao, Gillespie and
+    Petzold (2006).
+    :param counts: Number of nodes per compartment.
+    :param drift: Expected change per time unit of each compartment.
+    :param variance: Variance of the change per time unit of each
+        compartment.
+    :param epsilon: Error tolerance.
+    :return: Leap size (infinite if nothing changes).
+    """
+    bound = np.maximum(epsilon * counts, 1.)
+    drift = np.abs(drift)
+
+    tau = math.inf
+    changing = drift > 0
+    if np.any(changing):
+        tau = min(tau, np.min(bound[changing] / drift[changing]))
+    changing = variance > 0
+    if np.any(changing):
+        tau = min(tau, np.min(bound[changing] ** 2 / variance[changing]))
+
+    return float(tau)
+
+
+class TauLeapingDynamics(NetworkExperiment):
+    """
+    Approximate continuous-time SEIR / SEIVR dynamics (adaptive tau-leaping)
+    with the same events and rates as `GillespieDynamics` (including its
+    infection of vaccinated nodes, unlike `SEIVR`). Instead of performing
+    the events one by one, each leap of length tau performs all transitions
+    with the rates at the start of the leap. Nodes with the same
+    transition rate (the exposed, the infected and the susceptible nodes
+    without exposed or infected neighbours) are a class, of which a binomial
+    number of nodes changes; the other nodes change independently.
+
+    The leap size is chosen so that the expected change of each compartment
+    stays below the error tolerance `EPSILON` (a fraction of its size), so
+    smaller tolerances give more accurate but slower runs. The results are
+    marked as `APPROXIMATE` in the metadata.
+
+    Quarantine models are not supported, since the rewiring of the network
+    depends on the order of the events.
+    """
+
+    # Experiment parameters
+    EPSILON: Final[str] = 'lib.dynamics.TauLeaping.epsilon'
+
+    # Metadata
+    APPROXIMATE: Final[str] = 'lib.dynamics.TauLeaping.approximate'
+    LEAPS: Final[str] = 'lib.dynamics.TauLeaping.leaps'
+
+    # Error tolerance if no EPSILON parameter is given
+    DEFAULT_EPSILON = 0.03
+
+    def __init__(self, model: CompartmentedModel,
+                 g: Union[Graph, CompactGraph, NetworkGenerator] = None,
+                 max_time: float = Process.DEFAULT_MAX_TIME,
+                 seed: Optional[RANDOM_SEED] = None):
+        """
+        Create a TauLeapingDynamics experiment.
+        :param model: Model defining the parameter keys and compartments,
+            e.g. `SEIVR()`, `SEIR()` or `MonitoredSEIVR()`.
+        :param g: (optional) Network or network generator.
+        :param max_time: (optional) Maximum simulation time.
+        :param seed: (optional) Random seed. The random generator is shared
+            by all runs of the experiment.
+        """
+        if isinstance(model, QuarantineMixin):
+            raise ValueError('Quarantine models are not supported.')
+
+        if isinstance(g, CompactGraph):
+            g = FixedCompactNetwork(g)
+
+        super(TauLeapingDynamics, self).__init__(g)
+
+        self._model = model
+        self._max_time = max_time
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def model(self) -> CompartmentedModel:
+        """
+        Model defining the parameter keys and compartments.
+        :return: model.
+        """
+        return self._model
+
+    @property
+    def max_time(self) -> float:
+        """
+        Maximum simulation time.
+        :return: maximum simulation time.
+        """
+        return self._max_time
+
+    def do(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run the dynamics until no more events can happen or the maximum
+        simulation time is reached.
+        :param params: experiment parameters
+        :return: Number of nodes per compartment (and the time series of
+            `Monitor` models).
+        """
+        rates = Rates.from_params(self._model, params)
+
+        epsilon = params.get(self.EPSILON, self.DEFAULT_EPSILON)
+        if not 0 < epsilon < 1:
+            raise ValueError('The error tolerance must be in (0; 1).')
+
+        indptr, indices = csr_adjacency(self.network())
+        n = len(indptr) - 1
+
+        states = initial_states(rates, n, self._rng)
+
+        # number of exposed and infected neighbours of each node
+        src = np.repeat(np.arange(n), np.diff(indptr))
+        k_e = np.bincount(src, weights=states[indices] == EXPOSED,
+                          minlength=n).astype(np.int32)
+        k_i = np.bincount(src, weights=states[indices] == INFECTED,
+                          minlength=n).astype(np.int32)
+        del src
+
+        monitor = isinstance(self._model, Monitor)
+        delta = params[Monitor.DELTA] if monitor else None
+        observations, series = [], []
+
+        t = 0.0
+        events = 0
+        leaps = 0
+        while True:
+            counts = count_states(states)
+
+            # observe at the times passed by the last leap
+            while monitor and len(observations) * delta <= t:
+                observations.append(len(observations) * delta)
+                series.append(counts.tolist())
+
+            if t >= self._max_time:
+                break
+
+            infection = self._infection_rates(states, k_e, k_i, rates)
+            tau = self._leap_size(states, counts, infection, rates, epsilon)
+            if tau == 0:
+                # no more events can happen
+                break
+
+            # end the leap at the next observation or the maximum time
+            end = self._max_time
+            if monitor:
+                end = min(end, len(observations) * delta)
+            tau = min(tau, end - t)
+
+            nodes, old = self._leap(states, infection, rates, tau)
+            self._update_neighbour_counts(indptr, indices, states, nodes,
+                                          old, k_e, k_i)
+            events += len(nodes)
+            leaps += 1
+            t = end if t + tau >= end else t + tau
+
+        self.parameters()[NetworkGenerator.TOPOLOGY] = \
+            self.networkGenerator().topology()
+        self.metadata()[Dynamics.TIME] = t
+        self.metadata()[Dynamics.EVENTS] = events
+        self.metadata()[self.APPROXIMATE] = True
+        self.metadata()[self.EPSILON] = epsilon
+        self.metadata()[self.LEAPS] = leaps
+
+        counts = count_states(states)
+        names = compartments(self._model)
+        results = {name: int(counts[state]) for state, name in names.items()}
+
+        if monitor:
+            results[Monitor.OBSERVATIONS] = observations
+            for state, name in names.items():
+                results[Monitor.timeSeriesForLocus(name)] = \
+                    [counts[state] for counts in series]
+
+        return results
+
+    @staticmethod
+    def _infection_rates(states: np.ndarray, k_e: np.ndarray,
+                         k_i: np.ndarray, rates: Rates) -> np.ndarray:
+        """
+        Return the rate at which each node is infected.
+        :param states: Node states.
+        :param k_e: Number of exposed neighbours of each node.
+        :param k_i: Number of infected neighbours of each node.
+        :param rates: Rates
+        :return: Infection rates (zero for all but susceptible and
+            vaccinated nodes).
+        """
+        scale = np.select(
+            [states == SUSCEPTIBLE, states == VACCINATED],
+            [1., 1. - rates.vac_rrr], 0.
+        )
+        return scale * (rates.p_infect_a * k_e + rates.p_infect_s * k_i)
+
+    @staticmethod
+    def _leap_size(states: np.ndarray, counts: np.ndarray,
+                   infection: np.ndarray, rates: Rates,
+                   epsilon: float) -> float:
+        """
+        Select the size of the next leap.
+        :param states: Node states.
+        :param counts: Number of nodes per compartment.
+        :param infection: Infection rate of each node.
+        :param rates: Rates
+        :param epsilon: Error tolerance.
+        :return: Leap size, zero if no events can happen and infinite if only
+            independent events (vaccinations) can happen, which the leap
+            performs exactly.
+        """
+        infect_s = float(infection[states == SUSCEPTIBLE].sum())
+        infect_v = float(infection[states == VACCINATED].sum())
+        symptoms = rates.p_symptoms * counts[EXPOSED]
+        remove = rates.p_remove * counts[INFECTED]
+        vaccinate = rates.p_vac * counts[SUSCEPTIBLE]
+
+        if infect_s + infect_v + symptoms + remove == 0:
+            return math.inf if vaccinate > 0 else 0.
+
+        drift = np.zeros(len(STATES))
+        variance = np.zeros(len(STATES))
+        for rate, src, dst in [(infect_s, SUSCEPTIBLE, EXPOSED),
+                               (infect_v, VACCINATED, EXPOSED),
+                               (symptoms, EXPOSED, INFECTED),
+                               (remove, INFECTED, REMOVED),
+                               (vaccinate, SUSCEPTIBLE, VACCINATED)]:
+            drift[src] -= rate
+            drift[dst] += rate
+            variance[src] += rate
+            variance[dst] += rate
+
+        return leap_size(counts, drift, variance, epsilon)
+
+    def _leap(self, states: np.ndarray, infection: np.ndarray,
+              rates: Rates, tau: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Perform all transitions of a leap in place, with the rates at the
+        start of the leap.
+        :param states: Node states (changed in place).
+        :param infection: Infection rate of each node.
+        :param rates: Rates
+        :param tau: Leap size.
+        :return: Changed nodes and their previous states.
+        """
+        rng = self._rng
+        changes = []
+
+        # classes of nodes with the same rate: binomial number of changes
+        at_risk = infection > 0
+        for nodes, rate, new_state in [
+            (np.flatnonzero(states == EXPOSED), rates.p_symptoms, INFECTED),
+            (np.flatnonzero(states == INFECTED), rates.p_remove, REMOVED),
+            (np.flatnonzero((states == SUSCEPTIBLE) & ~at_risk),
+             rates.p_vac, VACCINATED)
+        ]:
+            count = rng.binomial(len(nodes), -math.expm1(-rate * tau))
+            changes.append((rng.choice(nodes, count, replace=False),
+                            new_state))
+
+        # nodes at risk of infection: independent changes
+        nodes = np.flatnonzero(at_risk)
+        vaccinate = np.where(states[nodes] == SUSCEPTIBLE, rates.p_vac, 0.)
+        total = infection[nodes] + vaccinate
+        nodes_changed = rng.random(len(nodes)) < -np.expm1(-total * tau)
+
+        # each changing node is infected or vaccinated by rate
+        infected = rng.random(len(nodes)) * total < infection[nodes]
+        changes.append((nodes[nodes_changed & infected], EXPOSED))
+        changes.append((nodes[nodes_changed & ~infected], VACCINATED))
+
+        nodes = np.concatenate([nodes for nodes, _ in changes])
+        old = states[nodes]
+        for nodes_changed, new_state in changes:
+            states[nodes_changed] = new_state
+
+        return nodes, old
+
+    @staticmethod
+    def _update_neighbour_counts(indptr: np.ndarray, indices: np.ndarray,
+                                 states: np.ndarray, nodes: np.ndarray,
+                                 old: np.ndarray, k_e: np.ndarray,
+                                 k_i: np.ndarray) -> None:
+        """
+        Update the number of exposed and infected neighbours after a leap.
+        Only the edges of the changed nodes are visited.
+        :param indptr: Row pointers of the CSR adjacency.
+        :param indices: Column indices of the CSR adjacency.
+        :param states: Node states (after the leap).
+        :param nodes: Changed nodes.
+        :param old: Previous states of the changed nodes.
+        :param k_e: Number of exposed neighbours (updated in place).
+        :param k_i: Number of infected neighbours (updated in place).
+        """
+        new = states[nodes]
+        degree = indptr[nodes + 1] - indptr[nodes]
+        _, dst = neighbours(indptr, indices, nodes)
+
+        for k, state in [(k_e, EXPOSED), (k_i, INFECTED)]:
+            delta = (new == state).astype(np.int32) - (old == state)
+            np.add.at(k, dst, np.repeat(delta, degree))
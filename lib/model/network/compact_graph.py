@@ -0,0 +1,222 @@
+from dataclasses import dataclass, field
+from typing import BinaryIO, Optional, Union
+
+import networkx as nx
+from networkx import read_graphml
+import numpy as np
+
+from lib.model.utils import load_npz
+
+
+@dataclass
+class CompactGraph:
+    """
+    Memory efficient representation of a household network. The adjacency is
+    stored in compressed sparse row (CSR) format and the node attributes as
+    arrays. Nodes are labelled 0 ... n-1.
+
+    Edge attributes are not stored: an edge between two nodes of the same
+    household is a household edge, all other edges are inter-household edges
+    (household 0 of size 0).
+    """
+
+    # Row pointers of the CSR adjacency (length n + 1)
+    indptr: np.ndarray
+    # Column indices of the CSR adjacency (both directions of each edge)
+    indices: np.ndarray
+    # Household ID of each node
+    household: np.ndarray
+    # Household size of each node
+    household_size: np.ndarray
+    # CBG code of each node (only for networks built from mobility data)
+    cbg: Optional[np.ndarray] = None
+    # CBG labels, indexed by the CBG codes
+    cbg_labels: Optional[np.ndarray] = None
+
+    # NetworkX graph, built on demand
+    _g: Optional[nx.Graph] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_edges(cls, edges: np.ndarray, household: np.ndarray,
+                   household_size: np.ndarray,
+                   cbg: Optional[np.ndarray] = None,
+                   cbg_labels: Optional[np.ndarray] = None) -> 'CompactGraph':
+        """
+        Create a CompactGraph from an edge list. Self-loops and duplicate
+        edges are removed.
+        :param edges: (E, 2) array of node IDs.
+        :param household: Household ID of each node.
+        :param household_size: Household size of each node.
+        :param cbg: (optional) CBG code of each node.
+        :param cbg_labels: (optional) CBG labels, indexed by the CBG codes.
+        :return: CompactGraph
+        """
+        n = len(household)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        edges = edges[edges[:, 0] != edges[:, 1]]
+
+        # both directions, encoded as one integer per directed edge so that
+        #  sorting and removing duplicates is a flat sort (np.unique is much
+        #  slower on large arrays)
+        keys = np.sort(np.concatenate([
+            edges[:, 0] * n + edges[:, 1], edges[:, 1] * n + edges[:, 0]
+        ]))
+        keys = keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+        src, dst = np.divmod(keys, max(n, 1))
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        return cls(
+            indptr=indptr,
+            indices=dst.astype(np.int32),
+            household=np.asarray(household, dtype=np.int32),
+            household_size=np.asarray(household_size, dtype=np.int16),
+            cbg=None if cbg is None else np.asarray(cbg, dtype=np.int32),
+            cbg_labels=None if cbg_labels is None else np.asarray(cbg_labels)
+        )
+
+    @classmethod
+    def from_networkx(cls, g: nx.Graph) -> 'CompactGraph':
+        """
+        Create a CompactGraph from a NetworkX graph with `household`,
+        `household_size` and (optional) `cbg` node attributes. The nodes are
+        relabelled 0 ... n-1 in the order of `g.nodes`.
+        :param g: Graph
+        :return: CompactGraph
+        """
+        label = {v: i for i, v in enumerate(g.nodes)}
+
+        household = [h for _, h in g.nodes(data='household')]
+        household_size = [s for _, s in g.nodes(data='household_size')]
+
+        cbg = cbg_labels = None
+        cbgs = [c for _, c in g.nodes(data='cbg')]
+        if g.order() and all(c is not None for c in cbgs):
+            cbg_labels, cbg = np.unique(cbgs, return_inverse=True)
+
+        edges = np.array(
+            [(label[u], label[v]) for u, v in g.edges], dtype=np.int64
+        )
+
+        return cls.from_edges(edges, household, household_size, cbg,
+                              cbg_labels)
+
+    @property
+    def order(self) -> int:
+        """
+        Number of nodes.
+        :return: number of nodes.
+        """
+        return len(self.indptr) - 1
+
+    @property
+    def size(self) -> int:
+        """
+        Number of edges.
+        :return: number of edges.
+        """
+        return len(self.indices) // 2
+
+    @property
+    def degree(self) -> np.ndarray:
+        """
+        Degree of each node.
+        :return: array of degrees.
+        """
+        return np.diff(self.indptr)
+
+    @property
+    def edges(self) -> np.ndarray:
+        """
+        Edges of the graph, each edge once with the smaller node first.
+        :return: (E, 2) array of node IDs.
+        """
+        src = np.repeat(np.arange(self.order), self.degree)
+        mask = src < self.indices
+        return np.stack([src[mask], self.indices[mask]], axis=1)
+
+    def neighbors(self, v: int) -> np.ndarray:
+        """
+        Neighbours of a node.
+        :param v: Node ID.
+        :return: array of node IDs.
+        """
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    def save(self, file: Union[str, BinaryIO]) -> None:
+        """
+        Save the graph as uncompressed NumPy `.npz` archive.
+        :param file: File name (`.npz` is appended if missing) or file object.
+        """
+        arrays = dict(
+            indptr=self.indptr, indices=self.indices,
+            household=self.household, household_size=self.household_size
+        )
+
+        if self.cbg is not None:
+            arrays.update(cbg=self.cbg, cbg_labels=self.cbg_labels)
+
+        np.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, file: str, mmap: bool = False) -> 'CompactGraph':
+        """
+        Load a graph saved with `save`.
+        :param file: File name.
+        :param mmap: (optional) Memory-map the arrays instead of reading them
+            into memory.
+        :return: CompactGraph
+        """
+        return cls(**load_npz(file, mmap))
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        Return the network as a NetworkX graph with the same node and edge
+        attributes as the graphs built by the network generators. The graph
+        is built on the first call and cached.
+        :return: Graph
+        """
+        if self._g is not None:
+            return self._g
+
+        household = self.household.tolist()
+        size = self.household_size.tolist()
+
+        if self.cbg is not None:
+            cbg = self.cbg_labels[self.cbg].tolist()
+            attrs = [dict(household=h, household_size=s, cbg=c)
+                     for h, s, c in zip(household, size, cbg)]
+        else:
+            attrs = [dict(household=h, household_size=s)
+                     for h, s in zip(household, size)]
+
+        g = nx.Graph()
+        g.add_nodes_from(zip(range(self.order), attrs))
+
+        # household edges carry the attributes of their household, all other
+        #  edges are labelled as household 0 of size 0
+        outside = dict(household=0, household_size=0)
+        g.add_edges_from(
+            (u, v, attrs[u] if household[u] == household[v] else outside)
+            for u, v in self.edges.tolist()
+        )
+
+        self._g = g
+        return g
+
+
+def convert_graphml(src: str, dst: str) -> CompactGraph:
+    """
+    Convert a network saved as GraphML file (e.g. with `write_graphml`) to the
+    binary format of CompactGraph.
+    :param src: GraphML file name.
+    :param dst: File name of the binary file (`.npz` is appended if missing).
+    :return: CompactGraph
+    """
+    g = CompactGraph.from_networkx(read_graphml(src))
+    g.save(dst)
+    return g
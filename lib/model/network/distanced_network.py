@@ -1,5 +1,5 @@
 import sys
-from typing import Callable, Any, Dict, List
+from typing import Callable, Any, Dict, Optional, Union
 
 if sys.version_info >= (3, 8):
     from typing import Final
@@ -10,9 +10,13 @@ import networkx as nx
 import numpy as np
 from epydemic import NetworkGenerator
 
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.network.households import Households
+from lib.model.network.stubs import break_up_pairs
+from lib.model.types import RANDOM_SEED
+
 # special types for convenience...
-HOUSEHOLDS = List[nx.Graph]
-STUBS = List[int]
+STUBS = np.ndarray
 
 
 class DistancedNetwork:
@@ -22,12 +26,17 @@ class DistancedNetwork:
 
     A network that imitates social bubbles (households) with some dedicated
     nodes per household with connections to the outside.
+
+    The network is built on arrays (household layer, stubs) and stored as
+    CompactGraph; the NetworkX graph is only built on access of `g`.
     """
 
     def __init__(self, N: int,
                  household_size_dist: Callable,
                  num_contact_dist: Callable,
-                 num_outside_edge_dist: Callable):
+                 num_outside_edge_dist: Callable,
+                 batched: bool = False,
+                 seed: Optional[RANDOM_SEED] = None):
         """
         Create a DistancedNetwork.
         :param N: Order of the network.
@@ -36,18 +45,49 @@ class DistancedNetwork:
             members with outside edges.
         :param num_outside_edge_dist: Distribution func. of number of outside
             edges for single member with outside edges
+        :param batched: (optional) True if the distribution functions are
+            batched, i.e. called once per stage with a shared random generator
+            and return arrays:
+            - `household_size_dist(size=..., seed=rng)`
+            - `num_contact_dist(household_sizes, seed=rng)`
+            - `num_outside_edge_dist(size=..., seed=rng)`
+            (e.g. `discrete_trunc_normal_batch`, `num_contact_dist_batch` and
+            `discrete_trunc_exponential_batch`).
+        :param seed: (optional) Random seed of the stub order and the break up
+            of pairs (and of the batched distribution functions).
         """
         self.N = N
         self.household_size_dist = household_size_dist
         self.num_contact_dist = num_contact_dist
         self.num_outside_edge_dist = num_outside_edge_dist
+        self.batched = batched
 
-        self._rng = np.random.default_rng()
-        self._g: nx.Graph = nx.Graph()
+        self._rng = np.random.default_rng(seed=seed)
+        self._compact: Optional[CompactGraph] = None
+        self._households: Optional[Households] = None
+        self._break_up_iterations: int = 0
 
     @property
-    def g(self):
-        return self._g
+    def g(self) -> nx.Graph:
+        """
+        The network as NetworkX graph (built on first access).
+        :return: Graph
+        """
+        if self._compact is None:
+            return nx.Graph()
+        return self._compact.to_networkx()
+
+    @property
+    def compact(self) -> Optional[CompactGraph]:
+        return self._compact
+
+    @property
+    def households(self) -> Optional[Households]:
+        return self._households
+
+    @property
+    def break_up_iterations(self) -> int:
+        return self._break_up_iterations
 
     def create(self):
         households = self._create_households()
@@ -55,128 +95,131 @@ class DistancedNetwork:
         stubs = self._break_up_pairs(stubs)
         self._connect_stubs(stubs)
 
-    def _create_households(self) -> HOUSEHOLDS:
+    def _create_households(self) -> Households:
         """
-        Create the households as complete graphs.
-        :return: List of graphs
+        Create the household layer. The households are kept as arrays; the
+        graph is only built in `_connect_stubs`.
+        :return: Household layer.
         """
 
-        # initialise some values
-        household_id = 1
-        households = []
-        n = 0
-
-        while n < self.N:
-
-            # draw the household size and build a graph of that size
-            size = self.household_size_dist()
-            house = nx.complete_graph(size)
+        if self.batched:
+            sizes = self._draw_household_sizes()
+        else:
+            sizes = []
+            n = 0
+            while n < self.N:
+                # draw the household size
+                size = self.household_size_dist()
+                sizes.append(size)
+                n += size
+
+            sizes = np.array(sizes, dtype=np.int64)
+
+        # household IDs start at 1 since 0 marks inter-household edges
+        household_ids = np.arange(1, len(sizes) + 1)
+
+        self._households = Households(
+            household=np.repeat(household_ids, sizes),
+            household_size=np.repeat(sizes, sizes)
+        )
 
-            # add a unique label to each node
-            nx.relabel_nodes(house, lambda l: n + l, copy=False)
+        return self._households
 
-            # add nodes and edges to the main graph
-            self.g.add_nodes_from(
-                house.nodes, household=household_id, household_size=size
-            )
+    def _draw_household_sizes(self) -> np.ndarray:
+        """
+        Draw household sizes in batches from the batched household size
+        distribution until the households contain at least N nodes.
+        :return: Array of household sizes.
+        """
+        sizes = np.zeros(0, dtype=np.int64)
 
-            self.g.add_edges_from(
-                house.edges, household=household_id, household_size=size
-            )
+        while sizes.sum() < self.N:
+            # expected number of missing households plus some slack
+            missing = self.N - sizes.sum()
+            mean = sizes.mean() if len(sizes) else 1
+            batch = int(missing / mean) + 10
 
-            # store the household in a list
-            households.append(house)
+            new = self.household_size_dist(size=batch, seed=self._rng)
+            sizes = np.concatenate([sizes, np.asarray(new, dtype=np.int64)])
 
-            n += size
-            household_id += 1
+        # cut off after the first household that reaches N
+        if self.N > 0:
+            sizes = sizes[:np.searchsorted(np.cumsum(sizes), self.N) + 1]
 
-        return households
+        return sizes
 
-    def _create_stubs(self, households: HOUSEHOLDS) -> STUBS:
+    def _create_stubs(self, households: Households) -> STUBS:
         """
         Create stubs as the nodes in each household that has outside
-        connections.
-        :param households: list of households
-        :return: Stubs
+        connections. The first `num_contact_dist` nodes of each household are
+        copied once per outside connection.
+        :param households: Household layer.
+        :return: Array of stubs (node IDs) in random order.
         """
+        sizes = households.sizes
+        starts = np.cumsum(sizes) - sizes
 
-        contacts = []
+        # draw the number of nodes connected to the outside...
+        if self.batched:
+            contacts = self.num_contact_dist(sizes, seed=self._rng)
+        else:
+            contacts = [self.num_contact_dist(size) for size in sizes.tolist()]
 
-        for house in households:
+        contacts = np.minimum(np.asarray(contacts, dtype=np.int64), sizes)
 
-            # draw the number of nodes connected to the outside...
-            size = house.order()
-            n_contacts = self.num_contact_dist(size)
-            contacts.append(n_contacts)
-
-        stubs = []
-
-        for i in range(len(households)):
-
-            house = households[i]
+        offsets = np.arange(contacts.sum()) - np.repeat(
+            np.cumsum(contacts) - contacts, contacts
+        )
+        outside_nodes = np.repeat(starts, contacts) + offsets
 
-            # get the nodes with outside connections
-            outside_nodes = list(house.nodes())[:contacts[i]]
+        # ... and the number of connections of each of them
+        if self.batched:
+            num_copies = self.num_outside_edge_dist(
+                size=len(outside_nodes), seed=self._rng
+            )
+        else:
+            num_copies = [self.num_outside_edge_dist()
+                          for _ in range(len(outside_nodes))]
 
-            for node in outside_nodes:
-                # draw number of connections...
-                num_copies = self.num_outside_edge_dist()
-                # ... and copy the node as many times
-                stubs.extend([node] * num_copies)
+        stubs = np.repeat(outside_nodes, np.asarray(num_copies, dtype=np.int64))
 
         # append one more random stub if the number of stubs is uneven
         if len(stubs) % 2 > 0:
-            unique_stubs = list(set(stubs))
+            unique_stubs = np.unique(stubs)
             j = self._rng.integers(len(unique_stubs))
-            stubs.append(unique_stubs[j])
+            stubs = np.append(stubs, unique_stubs[j])
 
         # randomise order of stubs
-        self._rng.shuffle(stubs)
-
-        return stubs
+        return self._rng.permutation(stubs)
 
     def _break_up_pairs(self, stubs: STUBS) -> STUBS:
         """
-        Break up adjacent stubs if they are of the same household
-        :param stubs: list of stubs
+        Break up adjacent stubs if they are of the same household. The number
+        of swap attempts is stored in `break_up_iterations`.
+        :param stubs: Array of stubs.
         :return: stubs without intra-household paris
         """
-        swaps = 1
-
-        # do until all pairs are broken up
-        while swaps != 0:
-
-            swaps = 0
-
-            # iterate in pairs
-            for i in range(0, len(stubs), 2):
-
-                # get the two households
-                h1 = self.g.nodes[stubs[i]]['household']
-                h2 = self.g.nodes[stubs[i + 1]]['household']
-
-                # if they are the same, break them up
-                if h1 == h2:
-                    j = self._rng.integers(len(stubs))
-                    stubs[i + 1], stubs[j] = stubs[j], stubs[i + 1]
-
-                    swaps += 1
+        stubs, self._break_up_iterations = break_up_pairs(
+            stubs, self._households.household, self._rng
+        )
 
         return stubs
 
     def _connect_stubs(self, stubs: STUBS) -> None:
         """
-        Connect the stub pairs.
-        :param stubs: List of stubs
+        Build the graph from the household layer and connect the stub pairs.
+        :param stubs: Array of stubs.
         """
+        households = self._households
 
-        # iterate in pairs
-        for i in range(0, len(stubs), 2):
+        # household edges and pairs of stubs
+        edges = np.concatenate([
+            households.edges, np.reshape(stubs, (-1, 2)).astype(np.int64)
+        ])
 
-            # label inter-household edges as household 0 of size 0
-            self.g.add_edge(
-                stubs[i], stubs[i + 1], household=0, household_size=0
-            )
+        self._compact = CompactGraph.from_edges(
+            edges, households.household, households.household_size
+        )
 
 
 class DNGenerator(NetworkGenerator):
@@ -187,6 +230,12 @@ class DNGenerator(NetworkGenerator):
     HOUSEHOLD_SIZE_DIST: Final[str] = 'DN.household_size_dist'
     NUM_CONTACT_DIST: Final[str] = 'DN.num_contact_dist'
     NUM_OUTSIDE_EDGE_DIST: Final[str] = 'DN.num_outside_edge_dist'
+    # Return a CompactGraph instead of a networkx Graph
+    COMPACT: Final[str] = 'DN.compact'
+    # The distribution functions are batched (see DistancedNetwork)
+    BATCHED: Final[str] = 'DN.batched'
+    # Random seed of the generated networks
+    SEED: Final[str] = 'DN.seed'
 
     def __init__(self, params=None, limit=None, **kwargs):
         """
@@ -198,13 +247,14 @@ class DNGenerator(NetworkGenerator):
             - `num_contact_dist`
             - `num_outside_edge_dist`
             which otherwise have to be included in the `params` when generating
-            the network. =
+            the network, and `batched` (see `BATCHED`).
         """
         super(DNGenerator, self).__init__(params, limit)
 
         self._household_size_dist = kwargs.get('household_size_dist')
         self._num_contact_dist = kwargs.get('num_contact_dist')
         self._num_outside_edge_dist = kwargs.get('num_outside_edge_dist')
+        self._batched = kwargs.get('batched', False)
 
     def topology(self) -> str:
         """
@@ -213,7 +263,8 @@ class DNGenerator(NetworkGenerator):
         """
         return 'DN'
 
-    def _generate(self, params: Dict[str, Any]) -> nx.Graph:
+    def _generate(self, params: Dict[str, Any]) -> \
+            Union[nx.Graph, CompactGraph]:
         # Set the distribution functions (could also have been set at
         #  initialisation).
         self._household_size_dist = params.get(
@@ -240,9 +291,14 @@ class DNGenerator(NetworkGenerator):
             N,
             self._household_size_dist,
             self._num_contact_dist,
-            self._num_outside_edge_dist
+            self._num_outside_edge_dist,
+            batched=params.get(self.BATCHED, self._batched),
+            seed=params.get(self.SEED)
         )
 
         network.create()
 
+        if params.get(self.COMPACT, False):
+            return network.compact
+
         return network.g
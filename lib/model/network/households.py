@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+from lib.model.distributions import discrete_trunc_normal_batch
+
+
+@dataclass
+class Households:
+    """
+    Array representation of the household layer of a network. Nodes are
+    labelled 0 ... n-1 and the nodes of one household are contiguous.
+    """
+
+    # Household ID of each node (IDs start at 1, 0 marks inter-household edges)
+    household: np.ndarray
+    # Size of the household of each node
+    household_size: np.ndarray
+    # CBG code of each node (only for networks built from mobility data)
+    cbg: Optional[np.ndarray] = None
+    # CBG labels, indexed by the CBG codes
+    cbg_labels: Optional[np.ndarray] = None
+
+    @property
+    def order(self) -> int:
+        """
+        Number of nodes in the household layer.
+        :return: number of nodes.
+        """
+        return len(self.household)
+
+    @property
+    def nodes(self) -> np.ndarray:
+        """
+        Node IDs of the household layer.
+        :return: array of node IDs.
+        """
+        return np.arange(self.order)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """
+        Size of each household, in order of the household IDs.
+        :return: array of household sizes.
+        """
+        starts = household_starts(self.household)
+        return self.household_size[starts]
+
+    @property
+    def edges(self) -> np.ndarray:
+        """
+        Intra-household edges (complete graph per household).
+        :return: (E, 2) array of node IDs.
+        """
+        return household_edges(self.sizes)
+
+
+def household_starts(household: np.ndarray) -> np.ndarray:
+    """
+    Return the index of the first node of each household.
+    :param household: Household ID of each node, households contiguous.
+    :return: array of indices.
+    """
+    if len(household) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, household[1:] != household[:-1]])
+
+
+def household_edges(sizes: np.ndarray) -> np.ndarray:
+    """
+    Create the edges of complete graphs for contiguous households of the given
+    sizes. All households of the same size are handled in one step.
+    :param sizes: Household sizes in node order.
+    :return: (E, 2) array of node IDs.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    offsets = np.cumsum(sizes) - sizes
+
+    edges = [np.zeros((0, 2), dtype=np.int64)]
+
+    for size in np.unique(sizes[sizes > 1]):
+        # edges of a complete graph of this size, shifted to each household
+        row, col = np.triu_indices(size, 1)
+        start = offsets[sizes == size][:, None]
+        edges.append(np.stack(
+            [(start + row).ravel(), (start + col).ravel()], axis=1
+        ))
+
+    return np.concatenate(edges)
+
+
+def draw_household_sizes(mu: float, n: int,
+                         rng: np.random.Generator,
+                         dist: Optional[Callable] = None) -> np.ndarray:
+    """
+    Draw household sizes until the households contain at least `n` nodes.
+    The sizes are drawn in batches; the result has the same distribution as
+    drawing one household after the other.
+    :param mu: Mean household size.
+    :param n: Target number of nodes.
+    :param rng: Random generator.
+    :param dist: (optional) Batched household size distribution, called as
+        `dist(mu, size=..., seed=rng)`. Defaults to a discrete normal
+        distribution truncated in the range [1; infinity) with standard
+        deviation mu / 2 (`discrete_trunc_normal_batch`).
+    :return: array of household sizes.
+    """
+    dist = dist or discrete_trunc_normal_batch
+    sizes = np.zeros(0, dtype=np.int64)
+
+    while sizes.sum() < n:
+        # expected number of missing households plus some slack
+        missing = n - sizes.sum()
+        batch = int(missing / max(mu, 1)) + 10
+
+        new = np.asarray(dist(mu, size=batch, seed=rng), dtype=np.int64)
+        sizes = np.concatenate([sizes, new])
+
+    # cut off after the first household that reaches the target
+    if n > 0:
+        sizes = sizes[:np.searchsorted(np.cumsum(sizes), n) + 1]
+
+    return sizes
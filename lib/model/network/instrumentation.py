@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator
+
+from epyc import Experiment
+
+# special types for convenience...
+STATS = Dict[str, Dict[str, Any]]
+
+
+class StageStats:
+    """
+    Opt-in recorder of statistics of the stages of a creation process. For
+    each stage, the wall time (`time`, in seconds), the peak memory allocated
+    on top of the memory in use at the start of the stage (`peak_memory`, in
+    bytes, measured with tracemalloc) and any values added by the stage are
+    recorded.
+
+    Before Python 3.9, tracemalloc's peak can't be reset. The peak of a
+    stage is still exact if tracing starts with the stage (the default) or
+    if the stage exceeds the peak reached before it. If tracing was already
+    active and the stage stays below the earlier peak, only the memory in
+    use at the end of the stage is recorded, a lower bound of its peak.
+    """
+
+    TIME = 'time'
+    PEAK_MEMORY = 'peak_memory'
+
+    def __init__(self, enabled: bool = True):
+        """
+        Create a StageStats recorder.
+        :param enabled: (optional) Record statistics. If False, the stages
+            run without any overhead and nothing is recorded.
+        """
+        self.enabled = enabled
+        self.stats: STATS = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """
+        Record the statistics of a stage.
+        :param name: Name of the stage.
+        :return: Dictionary to which the stage can add values (e.g. counts).
+        """
+        values = {}
+
+        if not self.enabled:
+            yield values
+            return
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+
+        start_memory, start_peak = tracemalloc.get_traced_memory()
+        reset = hasattr(tracemalloc, 'reset_peak')
+        if reset:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+
+        try:
+            yield values
+        finally:
+            elapsed = time.perf_counter() - start
+            end_memory, peak = tracemalloc.get_traced_memory()
+
+            # without reset, a peak that wasn't exceeded is from before the
+            #  stage
+            if not reset and peak <= start_peak:
+                peak = end_memory
+
+            if not tracing:
+                tracemalloc.stop()
+
+            self.stats[name] = {
+                self.TIME: elapsed,
+                self.PEAK_MEMORY: max(peak - start_memory, 0),
+                **values
+            }
+
+
+def flatten_stats(stats: STATS, prefix: str) -> Dict[str, Any]:
+    """
+    Flatten stage statistics into a single dictionary with keys of the form
+    `<prefix>.<stage>.<statistic>`.
+    :param stats: Statistics per stage.
+    :param prefix: Prefix of the keys.
+    :return: Flat dictionary.
+    """
+    return {
+        f'{prefix}.{stage}.{key}': value
+        for stage, values in stats.items()
+        for key, value in values.items()
+    }
+
+
+def add_stats_to_metadata(experiment: Experiment, stats: STATS,
+                          prefix: str = 'MN.stats') -> None:
+    """
+    Add stage statistics to the metadata of an epyc experiment. Must be
+    called while the experiment runs (e.g. from `setUp` or `do`), so that the
+    statistics end up in the metadata of the results dict.
+    :param experiment: Experiment
+    :param stats: Statistics per stage.
+    :param prefix: (optional) Prefix of the metadata keys.
+    """
+    experiment.metadata().update(flatten_stats(stats, prefix))
@@ -1,5 +1,8 @@
+import os
 import sys
-from typing import Any, Callable, Optional, Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Optional, Dict, List, Tuple, Union
 if sys.version_info >= (3, 8):
     from typing import Final
 else:
@@ -10,15 +13,22 @@ import networkx as nx
 from epydemic import NetworkGenerator
 from networkx import Graph, read_graphml
 
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.network.households import Households, draw_household_sizes, \
+    household_edges, household_starts
+from lib.model.network.instrumentation import StageStats, STATS
+from lib.model.network.network_cache import NetworkCache
 from lib.model.network.network_data import NetworkData
-from lib.model.distributions import discrete_trunc_normal, draw_cbg, \
+from lib.model.network.out_of_core import ArrayFile, write_csr
+from lib.model.network.stubs import pair_stubs, break_up_pairs
+from lib.model.distributions import draw_cbgs, draw_cbgs_hierarchical, \
     PowerLawCutoffDist
-from lib.model.utils import discrete_rejection_sample
+from lib.model.types import RANDOM_SEED
+from lib.model.utils import seed_sequence, tabulate_cdf
 
 # special types for convenience...
-HOUSEHOLDS = List[nx.Graph]
-STUBS = List[int]
-CBG_DEGREE_MAP = Dict[str, List[int]]
+STUBS = np.ndarray
+STUB_CBGS = np.ndarray
 
 
 class MobilityNetwork:
@@ -26,27 +36,59 @@ class MobilityNetwork:
     Mobility Network created from mobility data.
     """
 
+    # Number of CBGs above which target CBGs are drawn hierarchically
+    HIERARCHICAL_THRESHOLD: int = 10000
+
     def __init__(self, network_data: NetworkData,
-                 degree_dist: Callable,
+                 degree_dist: Union[PowerLawCutoffDist, Callable],
                  N: int = 10000,
                  multiplier: bool = False,
-                 max_deg: int = 100):
+                 max_deg: int = 100,
+                 seed: Optional[RANDOM_SEED] = None,
+                 workers: int = 1,
+                 household_size_dist: Optional[Callable] = None,
+                 hierarchical: Optional[bool] = None,
+                 instrument: bool = False):
         """
         :param network_data: NetworkData containing mobility data from which to
             create the network.
-        :param degree_dist: Probability function of degree distribution.
+        :param degree_dist: Degree distribution; either a PowerLawCutoffDist
+            or a probability function.
         :param N: Number of nodes (approximate) in the network.
         :param multiplier: True the trip_count_change multiplier should
             be applied to the exponent of the exponential distribution for the
             node degrees.
         :param max_deg: Maximum allowed node degree.
+        :param seed: (optional) Random seed.
+        :param workers: (optional) Number of processes for the per-CBG parts
+            of the creation process. The network only depends on the seed, not
+            on the number of workers.
+        :param household_size_dist: (optional) Batched household size
+            distribution, called once per CBG as
+            `household_size_dist(mu, size=..., seed=rng)` with the mean
+            household size `mu` of the CBG. Must be picklable if
+            `workers` > 1. Defaults to `discrete_trunc_normal_batch`.
+        :param hierarchical: (optional) Draw target CBGs in two steps, first
+            the group (county) and then the CBG within the group (see
+            `draw_cbgs_hierarchical`). The CBG within the group is drawn
+            proportional to all trips into it, independently of the origin,
+            so the targets only approximate the exact per-origin
+            distribution. By default used if the network data
+            has more than `HIERARCHICAL_THRESHOLD` CBGs. To group CBGs by
+            something else (e.g. tracts), run `create_group_alias_table` on
+            the network data first.
+        :param instrument: (optional) Record the wall time, peak memory and
+            counts of each stage of `create` in `stats`.
         """
 
         self.network_data: NetworkData = network_data
-        self.degree_dist: Callable[[int], float] = degree_dist
+        self.degree_dist: Union[PowerLawCutoffDist, Callable[[int], float]] \
+            = degree_dist
         self.N: int = N
         self.max_deg: int = max_deg
         self.multiplier: bool = multiplier
+        self.workers: int = workers
+        self.household_size_dist: Optional[Callable] = household_size_dist
 
         if self.multiplier:
             try:
@@ -57,199 +99,625 @@ class MobilityNetwork:
                                  'be set. Hint: Run the calc_trip_count_change '
                                  'method on the network_data instance first.')
 
-        self._rng = np.random.default_rng()
-        self._g: nx.Graph = nx.Graph()
+        if hierarchical is None:
+            hierarchical = \
+                len(network_data.ordered_cbgs) > self.HIERARCHICAL_THRESHOLD
+        self.hierarchical: bool = hierarchical
+
+        # alias tables for drawing target CBGs
+        if self.hierarchical:
+            if not hasattr(self.network_data, 'group_alias_prob'):
+                self.network_data.create_group_alias_table()
+        elif not hasattr(self.network_data, 'alias_prob'):
+            if not hasattr(self.network_data, 'transition'):
+                self.network_data.create_transition_matrix()
+            self.network_data.create_alias_table()
+
+        # the per-CBG random streams are spawned from the same seed sequence
+        self._seed_seq = seed_sequence(seed)
+        self._rng = np.random.default_rng(seed=self._seed_seq)
+        self._compact: Optional[CompactGraph] = None
+        self._households: Optional[Households] = None
+        self._break_up_iterations: int = 0
+        self._pairing_retries: int = 0
+        self._stats = StageStats(instrument)
+
+    @property
+    def g(self) -> nx.Graph:
+        """
+        The network as NetworkX graph (built on first access).
+        :return: Graph
+        """
+        if self._compact is None:
+            return nx.Graph()
+        return self._compact.to_networkx()
+
+    @property
+    def compact(self) -> Optional[CompactGraph]:
+        return self._compact
+
+    @property
+    def households(self) -> Optional[Households]:
+        return self._households
+
+    @property
+    def break_up_iterations(self) -> int:
+        return self._break_up_iterations
 
     @property
-    def g(self):
-        return self._g
+    def pairing_retries(self) -> int:
+        return self._pairing_retries
+
+    @property
+    def stats(self) -> STATS:
+        """
+        Statistics of the stages of the last `create` (only recorded with
+        `instrument=True`): per stage the wall time (`time`) and peak memory
+        (`peak_memory`) plus stage specific counts.
+        :return: Statistics per stage.
+        """
+        return self._stats.stats
 
-    def create(self):
+    def create(self, households: Optional[Households] = None):
         """
         Create the network. This executes all steps of the creation process in
         order. The algorithm is adapted from
             Dobson (2020). Epidemic Modelling. (pp. 157)
         but adapted to base the network on mobility data.
+        :param households: (optional) Household layer to build the network on,
+            e.g. of another network of the same demographics (see
+            `create_mobility_network_pair`). Created if not provided.
         """
 
-        households = self._create_households()
-        stubs, cbg_degree_map = self._create_stubs(households)
-        stubs = self._create_stub_pairs(stubs, cbg_degree_map)
-        stubs = self._break_up_pairs(stubs)
-        self._connect_stubs(stubs)
+        stage = self._stats.stage
+
+        with stage('households') as stats:
+            if households is None:
+                households = self._create_households()
+            else:
+                self._use_households(households)
+            stats.update(nodes=households.order,
+                         households=len(households.sizes))
+
+        with stage('stubs') as stats:
+            stubs, stub_cbgs = self._create_stubs(households)
+            stats.update(stubs=len(stubs))
+
+        with stage('stub_pairs') as stats:
+            stubs = self._create_stub_pairs(stubs, stub_cbgs)
+            stats.update(retries=self._pairing_retries)
 
-    def _create_households(self) -> HOUSEHOLDS:
+        with stage('break_up_pairs') as stats:
+            n_stubs = len(stubs)
+            stubs = self._break_up_pairs(stubs)
+            stats.update(iterations=self._break_up_iterations,
+                         dropped_stubs=n_stubs - len(stubs))
+
+        with stage('connect') as stats:
+            self._connect_stubs(stubs)
+            stats.update(edges=self._compact.size)
+
+    def _create_households(self) -> Households:
         """
         Part of the creation process to built household clusters for each CBG.
         The number of nodes per CBG is proportional to the population of
         the CBG. The household size is drawn from a distribution parametrised
-        with the (real world) mean household size.
-        :return: List of household graphs.
+        with the (real world) mean household size. All household sizes of a CBG
+        are drawn at once (in parallel across CBGs with `workers` > 1) and the
+        household layer is kept as arrays; the graph is only built in
+        `_connect_stubs`.
+        :return: Household layer.
         """
 
-        household_id = 1
-        households = []
+        seeds = self._cbg_seeds()
+        n_cbg, mu = self._cbg_targets()
 
-        total_node_ct = 0
+        jobs = [
+            (m, n, self.household_size_dist, seed)
+            for m, n, seed in zip(mu.tolist(), n_cbg.tolist(), seeds)
+        ]
 
-        # add the nodes and create the household connections
-        for cbg, demographic in self.network_data.demographics.items():
+        sizes = self._map(_draw_cbg_household_sizes, jobs)
 
-            # target number of nodes for current CBG
-            N_cbg = int(demographic['population_prop'] * self.N)
+        # CBG code of each node
+        cbg = np.repeat(
+            np.arange(len(sizes), dtype=np.int32), [s.sum() for s in sizes]
+        )
 
-            # current number of nodes of this CBG
-            n = 0
+        sizes = np.concatenate(sizes)
 
-            # add households
-            while n < N_cbg:
-                # create household network
-                mu = self.network_data.demographics[cbg]['household_size']
-                size = discrete_trunc_normal(mu=mu)
-                house_net = nx.complete_graph(size)
+        # household IDs start at 1 since 0 marks inter-household edges
+        household_ids = np.arange(1, len(sizes) + 1)
 
-                # add unique labels
-                nx.relabel_nodes(
-                    house_net, lambda l: total_node_ct + l, copy=False
-                )
+        self._households = Households(
+            household=np.repeat(household_ids, sizes),
+            household_size=np.repeat(sizes, sizes),
+            cbg=cbg,
+            cbg_labels=np.array(self.network_data.ordered_cbgs)
+        )
+
+        return self._households
+
+    def create_to_file(self, file: str, chunk_size: int = 2 ** 20,
+                       tmp_dir: Optional[str] = None) -> CompactGraph:
+        """
+        Create the network out-of-core and save it in the binary format of
+        `CompactGraph.save`, e.g. for networks that don't fit in memory. The
+        household layer and the edges are written to disk in chunks and the
+        CSR adjacency is built from the edge file, so that peak memory depends
+        on `chunk_size` (plus memory-mapped pages) rather than the size of the
+        network. No NetworkX graph is built.
+
+        Households and degrees are the same as with `create`. The stubs are
+        distributed to random buckets of about `chunk_size` stubs and each
+        bucket is paired (and broken up) on its own, so partners are drawn
+        from a random sample of all stubs rather than from all stubs.
+        :param file: File name of the network (`.npz` is appended if
+            missing).
+        :param chunk_size: (optional) Number of nodes, stubs or edges
+            processed at once.
+        :param tmp_dir: (optional) Directory for temporary files; defaults to
+            the system default.
+        :return: The network as CompactGraph memory-mapped from `file`.
+        """
+        file = file if file.endswith('.npz') else file + '.npz'
 
-                # add nodes and edges of the household to the main network
-                self.g.add_nodes_from(
-                    house_net.nodes, household=household_id,
-                    household_size=size, cbg=cbg
+        n_cbg, mu = self._cbg_targets()
+        household_seeds = self._cbg_seeds()
+        degree_seeds = self._cbg_seeds()
+        cdf = self._degree_cdf()
+
+        m = [None] * len(n_cbg)
+        if self.multiplier:
+            m = self.network_data.trip_count_change_array().tolist()
+
+        # number of buckets from the expected number of stubs
+        pmf = np.diff(cdf, prepend=0)
+        mean_degree = np.dot(np.arange(1, len(cdf) + 1), pmf)
+        scale = np.array(m, dtype=float) if self.multiplier else 1
+        expected = np.sum(n_cbg * np.maximum(scale * mean_degree, 1))
+        n_buckets = max(1, int(np.ceil(expected / chunk_size)))
+
+        with TemporaryDirectory(dir=tmp_dir) as tmp:
+            household = ArrayFile(os.path.join(tmp, 'household'), np.int32)
+            household_size = ArrayFile(
+                os.path.join(tmp, 'household_size'), np.int16
+            )
+            cbg = ArrayFile(os.path.join(tmp, 'cbg'), np.int32)
+            edges = ArrayFile(os.path.join(tmp, 'edges'), np.int32, (2,))
+            buckets = [ArrayFile(os.path.join(tmp, f'stubs{k}'), np.int32)
+                       for k in range(n_buckets)]
+
+            n = 0
+            n_households = 0
+
+            # blocks of consecutive CBGs with about `chunk_size` nodes
+            block_ids = np.cumsum(n_cbg) // max(chunk_size, 1)
+            blocks = np.split(np.arange(len(n_cbg)),
+                              np.flatnonzero(np.diff(block_ids)) + 1)
+
+            for block in blocks:
+                block = block.tolist()
+
+                sizes = self._map(_draw_cbg_household_sizes, [
+                    (float(mu[c]), int(n_cbg[c]), self.household_size_dist,
+                     household_seeds[c]) for c in block
+                ])
+                counts = [int(s.sum()) for s in sizes]
+                sizes = np.concatenate([np.zeros(0, dtype=np.int64)] + sizes)
+
+                ids = np.arange(n_households + 1,
+                                n_households + len(sizes) + 1)
+                household.append(np.repeat(ids, sizes))
+                household_size.append(np.repeat(sizes, sizes))
+                cbg.append(np.repeat(block, counts))
+                edges.append(household_edges(sizes) + n)
+
+                # degrees of the CBGs with nodes (as in `_create_stubs`)
+                degrees = self._map(_draw_cbg_degrees, [
+                    (cdf, k, m[c], degree_seeds[c])
+                    for c, k in zip(block, counts) if k > 0
+                ])
+                degrees = np.concatenate(
+                    [np.zeros(0, dtype=np.int64)] + degrees
                 )
+                stubs = np.repeat(np.arange(n, n + len(degrees)), degrees)
+
+                # distribute the stubs to random buckets
+                bucket = self._rng.integers(n_buckets, size=len(stubs))
+                stubs = stubs[np.argsort(bucket, kind='stable')]
+                splits = np.cumsum(np.bincount(bucket, minlength=n_buckets))
+                for k, part in enumerate(np.split(stubs, splits[:-1])):
+                    if len(part):
+                        buckets[k].append(part)
+
+                n += len(degrees)
+                n_households += len(sizes)
+
+            household_arr = household.array()
+            cbg_arr = cbg.array()
+
+            # pair the stubs of each bucket, carrying over an odd stub
+            self._break_up_iterations = 0
+            carry = np.zeros(0, dtype=np.int64)
+
+            for k, bucket in enumerate(buckets):
+                stubs = np.concatenate([carry, bucket.array()])
+                carry = np.zeros(0, dtype=np.int64)
+
+                if len(stubs) % 2:
+                    if k < n_buckets - 1:
+                        carry, stubs = stubs[-1:], stubs[:-1]
+                    else:
+                        unique_stubs = np.unique(stubs)
+                        j = self._rng.integers(len(unique_stubs))
+                        stubs = np.append(stubs, unique_stubs[j])
+
+                if len(stubs) == 0:
+                    continue
 
-                self.g.add_edges_from(
-                    house_net.edges, household=household_id,
-                    household_size=size, cbg=cbg
+                pairs = self._create_stub_pairs(stubs, cbg_arr[stubs])
+                pairs, iterations = break_up_pairs(
+                    pairs, household_arr, self._rng
                 )
+                self._break_up_iterations += iterations
+
+                edges.append(np.reshape(pairs, (-1, 2)))
+
+            indptr, indices = write_csr(edges, n, tmp, chunk_size)
+
+            np.savez(
+                file, indptr=indptr, indices=indices,
+                household=household_arr,
+                household_size=household_size.array(),
+                cbg=cbg_arr,
+                cbg_labels=np.array(self.network_data.ordered_cbgs)
+            )
 
-                households.append(house_net)
+            del indptr, indices, household_arr, cbg_arr
 
-                # update iteration values
-                n += size
-                household_id += 1
-                total_node_ct += size
+        self._compact = CompactGraph.load(file, mmap=True)
+        self._households = Households(
+            household=self._compact.household,
+            household_size=self._compact.household_size,
+            cbg=self._compact.cbg,
+            cbg_labels=self._compact.cbg_labels
+        )
 
-        return households
+        return self._compact
 
-    def _create_stubs(self, households: HOUSEHOLDS) -> \
-            Tuple[STUBS, CBG_DEGREE_MAP]:
+    def _cbg_targets(self) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Part of the creation process to create (still) unconnected nodes as
-        extra-household connections.
-        :param households: List of household graphs.
-        :return: List of stubs containing copies of existing nodes; A map
-            with the stubs per CBG.
+        Return the target number of nodes of each CBG (proportional to its
+        population) and its mean household size.
+        :return: Arrays indexed by the CBG codes.
+        """
+        n_cbg = (self.network_data.demographics_array('population_prop')
+                 * self.N).astype(np.int64)
+        mu = self.network_data.demographics_array('household_size')
+        return n_cbg, mu
+
+    def rewire(self, network_data: NetworkData,
+               trip_count_change: Optional[Dict[str, float]] = None,
+               seed: Optional[RANDOM_SEED] = None) -> 'MobilityNetwork':
+        """
+        Derive a network with changed mobility (e.g. post lockdown) from this
+        network instead of creating it from scratch. Each node keeps
+        max(int(m * d), 1) of its d inter-household edges, where m is the trip
+        count change of its CBG. Inter-household edges of nodes that lose
+        edges are removed at random; the other ends of the removed edges (and
+        extra stubs of nodes with m > 1) are paired again with the transition
+        probabilities of `network_data`. All other edges are kept as they are.
+        :param network_data: NetworkData of the changed mobility.
+        :param trip_count_change: (optional) Trip count change per CBG;
+            defaults to `network_data.trip_count_change`.
+        :param seed: (optional) Random seed.
+        :return: New MobilityNetwork on the same household layer.
         """
+        if self._compact is None:
+            raise ValueError('The network must be created before it can be '
+                             'rewired.')
+
+        if trip_count_change is None:
+            if not hasattr(network_data, 'trip_count_change'):
+                raise ValueError('The trip_count_change attribute of the '
+                                 'network_data object must be set. Hint: Run '
+                                 'the calc_trip_count_change method on the '
+                                 'network_data instance first.')
+            trip_count_change = network_data.trip_count_change
+
+        network = MobilityNetwork(
+            network_data, self.degree_dist, self.N, False, self.max_deg, seed,
+            self.workers, self.household_size_dist, self.hierarchical
+        )
+        network._use_households(self._households)
+        network._rewire(self._compact, trip_count_change)
 
-        cbg_degree_map = {k: [] for k in self.network_data.demographics.keys()}
+        return network
 
-        # create stubs for connections to outside of household
-        stubs = []
-        for i in range(len(households)):
+    def _rewire(self, compact: CompactGraph,
+                trip_count_change: Dict[str, float]) -> None:
+        """
+        Rewire the inter-household edges of a network on the same household
+        layer (see `rewire`).
+        :param compact: Network to rewire.
+        :param trip_count_change: Trip count change per CBG.
+        """
+        households = self._households
+        cbg = households.cbg
+
+        edges = compact.edges
+        household = households.household
+        inter = household[edges[:, 0]] != household[edges[:, 1]]
+        intra, inter = edges[~inter], edges[inter]
+
+        # current and target number of inter-household edges of each node
+        m = self.network_data.cbg_array(trip_count_change, 1)
+        ends = inter.ravel()
+        degree = np.bincount(ends, minlength=households.order)
+        target = np.where(
+            degree > 0,
+            np.maximum((m[cbg] * degree).astype(np.int64), 1),
+            0
+        )
 
-            nodes = list(households[i].nodes)
+        # remove `degree - target` random edge ends of each node
+        order = np.lexsort((self._rng.random(len(ends)), ends))
+        rank = np.empty(len(ends), dtype=np.int64)
+        offsets = np.cumsum(degree) - degree
+        rank[order] = np.arange(len(ends)) - offsets[ends[order]]
 
-            cbg = self.g.nodes[nodes[0]]['cbg']
+        removed_end = (rank < (degree - target)[ends]).reshape(-1, 2)
+        removed = removed_end.any(axis=1)
 
-            for node in nodes:
-                # draw random degree
-                degree = discrete_rejection_sample(
-                    p=self.degree_dist, a=1, b=self.max_deg
-                )
+        # orphaned ends of removed edges and extra stubs become new stubs
+        stubs = np.concatenate([
+            inter[removed[:, None] & ~removed_end],
+            np.repeat(households.nodes, np.maximum(target - degree, 0))
+        ])
 
-                if self.multiplier:
-                    m = self.network_data.trip_count_change[cbg]
-                    degree = max(int(m * degree), 1)
+        if len(stubs) % 2:
+            unique_stubs = np.unique(stubs)
+            j = self._rng.integers(len(unique_stubs))
+            stubs = np.append(stubs, unique_stubs[j])
+
+        stubs = self._create_stub_pairs(stubs, cbg[stubs])
+        stubs = self._break_up_pairs(stubs)
+
+        edges = np.concatenate([
+            intra, inter[~removed], np.reshape(stubs, (-1, 2))
+        ]).astype(np.int64)
+
+        self._compact = CompactGraph.from_edges(
+            edges,
+            households.household,
+            households.household_size,
+            cbg=households.cbg,
+            cbg_labels=households.cbg_labels
+        )
+
+    def _use_households(self, households: Households) -> None:
+        """
+        Use an existing household layer instead of creating one.
+        :param households: Household layer with the CBG code of each node.
+        """
+        if households.cbg is None or not np.array_equal(
+                households.cbg_labels, self.network_data.ordered_cbgs):
+            raise ValueError('The CBGs of the household layer must be the '
+                             'CBGs of the network data.')
 
-                # append `degree` number of copies of the current node
-                new_stubs = [node] * degree
-                stubs.extend(new_stubs)
-                cbg_degree_map[cbg].extend(new_stubs)
+        self._households = households
+
+    def _create_stubs(self, households: Households) -> \
+            Tuple[STUBS, STUB_CBGS]:
+        """
+        Part of the creation process to create (still) unconnected nodes as
+        extra-household connections. The degrees of the nodes of each CBG are
+        drawn at once (in parallel across CBGs with `workers` > 1).
+        :param households: Household layer.
+        :return: Array of stubs containing copies of existing nodes; The index
+            (in `ordered_cbgs`) of the CBG of each stub.
+        """
+
+        cdf = self._degree_cdf()
+        seeds = self._cbg_seeds()
+
+        # nodes of a CBG are contiguous
+        starts = household_starts(households.cbg)
+        counts = np.diff(np.append(starts, households.order))
+
+        m = [None] * len(seeds)
+        if self.multiplier:
+            m = self.network_data.trip_count_change_array().tolist()
+
+        jobs = [
+            (cdf, n, m[cbg], seeds[cbg])
+            for cbg, n in zip(households.cbg[starts].tolist(), counts.tolist())
+        ]
+
+        degrees = np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + self._map(_draw_cbg_degrees, jobs)
+        )
+
+        # `degree` number of copies of each node
+        stubs = np.repeat(households.nodes, degrees)
 
         # add one more if number of stubs is odd
         if len(stubs) % 2:
-            unique_stubs = list(set(stubs))
+            unique_stubs = np.unique(stubs)
             j = self._rng.integers(len(unique_stubs))
+            stubs = np.append(stubs, unique_stubs[j])
 
-            stubs.append(unique_stubs[j])
-            cbg_degree_map[self.g.nodes[unique_stubs[j]]['cbg']] \
-                .append(unique_stubs[j])
+        return stubs, households.cbg[stubs]
 
-        return stubs, cbg_degree_map
+    def _cbg_seeds(self) -> List[np.random.SeedSequence]:
+        """
+        Spawn an independent random stream per CBG, so that the per-CBG parts
+        of the creation process don't depend on how they are distributed
+        across workers.
+        :return: Seeds indexed by the CBG codes.
+        """
+        return self._seed_seq.spawn(len(self.network_data.ordered_cbgs))
 
-    def _create_stub_pairs(self, stubs: STUBS,
-                           cbg_degree_map: CBG_DEGREE_MAP):
+    def _degree_cdf(self) -> np.ndarray:
         """
-        Part of the creation process to pair the stubs in a way that favours
-        connections between CBGs that are favoured in the mobility data too.
-        :param stubs: List of stubs.
-        :param cbg_degree_map: Map of stub nodes to CBG
+        Tabulate the cumulative degree distribution in the range [1; max_deg].
+        :return: Array of cumulative probabilities.
         """
+        if isinstance(self.degree_dist, PowerLawCutoffDist):
+            return self.degree_dist.cdf(self.max_deg)
+        return tabulate_cdf(self.degree_dist, 1, self.max_deg + 1)
 
-        for i in range(0, len(stubs), 2):
+    def _map(self, func: Callable, jobs: List) -> List:
+        """
+        Apply `func` to all jobs, in a process pool if `workers` > 1.
+        :param func: Function (must be picklable).
+        :param jobs: List of arguments.
+        :return: List of results in order of the jobs.
+        """
+        if self.workers > 1 and len(jobs) > 1:
+            chunksize = max(1, len(jobs) // (4 * self.workers))
+            with ProcessPoolExecutor(self.workers) as executor:
+                return list(executor.map(func, jobs, chunksize=chunksize))
 
-            while True:
+        return [func(job) for job in jobs]
 
-                # draw a CBG from the CBG connection distribution
-                cbg = self.g.nodes[stubs[i]]['cbg']
-                target_cbg = draw_cbg(self.network_data, cbg)
+    def _create_stub_pairs(self, stubs: STUBS, stub_cbgs: STUB_CBGS) -> STUBS:
+        """
+        Part of the creation process to pair the stubs in a way that favours
+        connections between CBGs that are favoured in the mobility data too.
+        For each stub, a target CBG is drawn from the CBG connection
+        distribution and the stub is paired with a random unpaired stub of the
+        target CBG (preserving the degree distribution).
+        :param stubs: Array of stubs.
+        :param stub_cbgs: Index of the CBG of each stub.
+        :return: Stubs ordered such that successive stubs form a pair. The
+            number of redrawn target CBGs is stored in `pairing_retries`.
+        """
 
-                # make sure the drawn CBG has any available stubs at all
-                if len(cbg_degree_map[target_cbg]) == 0:
-                    continue
+        draw = draw_cbgs_hierarchical if self.hierarchical else draw_cbgs
 
-                # draw random stub from required CBG (preserving degree dist.)
-                target_node = self._rng.choice(cbg_degree_map[target_cbg])
-                j = stubs.index(target_node)
+        def draw_targets(origins):
+            return draw(self.network_data, origins, seed=self._rng)
 
-                # swap nodes
-                stubs[i + 1], stubs[j] = stubs[j], stubs[i + 1]
-                break
+        # targets are drawn from all CBGs, not only the CBGs of the stubs
+        stubs, self._pairing_retries = pair_stubs(
+            stubs, stub_cbgs, len(self.network_data.ordered_cbgs),
+            draw_targets, self._rng
+        )
 
         return stubs
 
     def _break_up_pairs(self, stubs: STUBS) -> STUBS:
         """
         Part of the creation process to break up any intra-household stub pairs
-        since stubs are supposed to connect between households.
-        :param stubs: List of stubs.
+        since stubs are supposed to connect between households. The number of
+        swap attempts is stored in `break_up_iterations`.
+        :param stubs: Array of stubs.
+        :return: Stubs without intra-household pairs.
         """
-        swaps = 1
-        while swaps != 0:
-
-            # iterate by two successive stubs at a time
-            swaps = 0
-            for i in range(0, len(stubs), 2):
-
-                # get the two households
-                h1 = self.g.nodes[stubs[i]]['household']
-                h2 = self.g.nodes[stubs[i + 1]]['household']
-
-                # break up if successive stubs are of same household
-                if h1 == h2:
-                    # swap with random other stub
-                    j = self._rng.integers(len(stubs))
-                    stubs[i + 1], stubs[j] = stubs[j], stubs[i + 1]
-
-                    swaps += 1
+        stubs, self._break_up_iterations = break_up_pairs(
+            stubs, self._households.household, self._rng
+        )
 
         return stubs
 
     def _connect_stubs(self, stubs: STUBS) -> None:
         """
-        Part of the creation process to connect the stubs.
-        :param stubs: List of stubs.
+        Part of the creation process to build the graph from the household
+        layer and connect the stubs.
+        :param stubs: Array of stubs.
         """
+        households = self._households
+
+        # household edges and pairs of stubs
+        edges = np.concatenate([
+            households.edges, np.reshape(stubs, (-1, 2)).astype(np.int64)
+        ])
+
+        self._compact = CompactGraph.from_edges(
+            edges,
+            households.household,
+            households.household_size,
+            cbg=households.cbg,
+            cbg_labels=households.cbg_labels
+        )
 
-        # connect pairs of stubs
-        for i in range(0, len(stubs), 2):
 
-            # label inter-household edges as household 0 of size 0
-            self.g.add_edge(
-                stubs[i], stubs[i + 1], household=0, household_size=0
-            )
+def _draw_cbg_household_sizes(job: Tuple) -> np.ndarray:
+    """
+    Draw the household sizes of one CBG (process pool job).
+    :param job: Mean household size, number of nodes, (optional) household
+        size distribution and seed.
+    :return: array of household sizes.
+    """
+    mu, n, dist, seed = job
+    return draw_household_sizes(mu, n, np.random.default_rng(seed), dist)
+
+
+def _draw_cbg_degrees(job: Tuple) -> np.ndarray:
+    """
+    Draw the node degrees of one CBG (process pool job).
+    :param job: Cumulative degree distribution, number of nodes, (optional)
+        trip count change multiplier and seed.
+    :return: array of degrees.
+    """
+    cdf, n, m, seed = job
+
+    rng = np.random.default_rng(seed)
+    degrees = np.searchsorted(cdf, rng.random(n), side='right') + 1
+
+    if m is not None:
+        degrees = np.maximum((m * degrees).astype(np.int64), 1)
+
+    return degrees
+
+
+def create_mobility_network_pair(
+        pre: NetworkData, post: NetworkData,
+        degree_dist: Union[PowerLawCutoffDist, Callable],
+        N: int = 10000,
+        max_deg: int = 100,
+        seed: Optional[RANDOM_SEED] = None,
+        workers: int = 1,
+        household_size_dist: Optional[Callable] = None) \
+        -> Tuple[MobilityNetwork, MobilityNetwork]:
+    """
+    Create a pre and a post MobilityNetwork on the same household layer. The
+    household layer is created once from the (shared) demographics, then the
+    stubs of the pre network are drawn from the pre data and the stubs of the
+    post network from the post data with the trip count change multiplier.
+    Both networks have the same nodes, which makes pre/post comparisons less
+    noisy.
+    :param pre: NetworkData before the change in mobility.
+    :param post: NetworkData after the change in mobility; the
+        trip_count_change must be set (see `calc_trip_count_change`).
+    :param degree_dist: Degree distribution; either a PowerLawCutoffDist
+        or a probability function.
+    :param N: Number of nodes (approximate) in the networks.
+    :param max_deg: Maximum allowed node degree.
+    :param seed: (optional) Random seed.
+    :param workers: (optional) Number of processes for the per-CBG parts of
+        the creation process.
+    :param household_size_dist: (optional) Batched household size
+        distribution (see `MobilityNetwork`).
+    :return: Pre and post MobilityNetwork.
+    """
+    seed_pre, seed_post = seed_sequence(seed).spawn(2)
+
+    networks = (
+        MobilityNetwork(pre, degree_dist, N, False, max_deg, seed_pre,
+                        workers, household_size_dist),
+        MobilityNetwork(post, degree_dist, N, True, max_deg, seed_post,
+                        workers, household_size_dist)
+    )
+
+    households = networks[0]._create_households()
+
+    for network in networks:
+        network.create(households)
+
+    return networks
 
 
 class MNGenerator(NetworkGenerator):
@@ -261,6 +729,8 @@ class MNGenerator(NetworkGenerator):
 
     EXPONENT: Final[str] = 'MN.exponent'
     CUTOFF: Final[str] = 'MN.cutoff'
+    # Return a CompactGraph instead of a networkx Graph
+    COMPACT: Final[str] = 'MN.compact'
 
     def __init__(self, params=None, limit=None, **kwargs):
         """
@@ -282,7 +752,8 @@ class MNGenerator(NetworkGenerator):
         """
         return 'MN'
 
-    def _generate(self, params: Dict[str, Any]) -> Graph:
+    def _generate(self, params: Dict[str, Any]) -> \
+            Union[Graph, CompactGraph]:
         raise NotImplementedError('MNGenerator._generate needs to be '
                                   'overridden by sub-classes')
 
@@ -302,27 +773,75 @@ class MNGeneratorFromFile(MNGenerator):
         """
         super(MNGeneratorFromFile, self).__init__(params, limit)
 
-    def _generate(self, params: Dict[str, Any]) -> Graph:
+    def _generate(self, params: Dict[str, Any]) -> Union[Graph, CompactGraph]:
         """
         Generate the graph of a mobility network from a GraphML file
         :param params: experiment parameters
-        :return: Graph
+        :return: Graph (or CompactGraph if `COMPACT` is set)
         """
         g = read_graphml(params[self.PATH])
+
+        if params.get(self.COMPACT, False):
+            return CompactGraph.from_networkx(g)
+
         return g
 
 
+class MNGeneratorFromBinary(MNGenerator):
+    """
+    NetworkGenerator to generate MobilityNetworks from a binary file saved
+    with `CompactGraph.save` (see `convert_graphml` to convert GraphML files).
+    The arrays are memory-mapped, so loading is almost free.
+    """
+
+    PATH: Final[str] = 'MN.path'
+
+    def __init__(self, params=None, limit=None):
+        """
+        Create an MNGeneratorFromBinary
+        :param params: (optional) experiment parameters
+        :param limit: (optional) maximum number of instances to generate
+        """
+        super(MNGeneratorFromBinary, self).__init__(params, limit)
+
+    def _generate(self, params: Dict[str, Any]) -> Union[Graph, CompactGraph]:
+        """
+        Generate the graph of a mobility network from a binary file.
+        :param params: experiment parameters
+        :return: Graph (or CompactGraph if `COMPACT` is set)
+        """
+        g = CompactGraph.load(params[self.PATH], mmap=True)
+
+        if params.get(self.COMPACT, False):
+            return g
+
+        return g.to_networkx()
+
+
 class MNGeneratorFromNetworkData(MNGenerator):
     """
     NetworkGenerator to generate MobilityNetworks from a NetworkData object.
+
+    Networks are only reproducible (and can therefore only be cached) if a
+    seed is set. With `ENSEMBLE` set to K, the generator cycles through K
+    networks with seeds derived from the `SEED` parameter (0 if not set).
     """
 
     N: Final[str] = 'MN.n'
     NETWORK_DATA: Final[str] = 'MN.network_data'
     MULTIPLIER: Final[str] = 'MN.multiplier'
+    # Random seed of the generated networks
+    SEED: Final[str] = 'MN.seed'
+    # Number of distinct networks to cycle through
+    ENSEMBLE: Final[str] = 'MN.ensemble'
+    # Number of processes used to create a network
+    WORKERS: Final[str] = 'MN.workers'
+    # Record statistics of the creation stages (see `stats`)
+    INSTRUMENT: Final[str] = 'MN.instrument'
 
     def __init__(self, params=None, limit=None,
-                 network_data: Optional[NetworkData] = None):
+                 network_data: Optional[NetworkData] = None,
+                 cache: Optional[NetworkCache] = None):
         """
         Create an MNGeneratorFromNetworkData.
         :param params: (optional) experiment parameters
@@ -330,15 +849,76 @@ class MNGeneratorFromNetworkData(MNGenerator):
         :param network_data: (optional) network data of the network. If not
             specified here, it must be provided in the `params` when generating
             the network,
+        :param cache: (optional) cache to serve seeded networks from.
         """
         super(MNGeneratorFromNetworkData, self).__init__(
             params, limit, network_data=network_data)
 
-    def _generate(self, params: Dict[str, Any]) -> nx.Graph:
+        self._cache = cache
+        self._instance = 0
+        self._digest: Optional[Tuple[NetworkData, str]] = None
+        self._stats: STATS = {}
+        self._degree_dist: Optional[PowerLawCutoffDist] = None
+
+    @property
+    def stats(self) -> STATS:
+        """
+        Statistics of the creation stages of the last generated network (only
+        recorded if `INSTRUMENT` is set and the network wasn't served from the
+        cache). Use `add_stats_to_metadata` to attach them to the metadata of
+        an experiment.
+        :return: Statistics per stage.
+        """
+        return self._stats
+
+    def _get_degree_dist(self, exponent: float,
+                         cutoff: float) -> PowerLawCutoffDist:
+        """
+        Return the degree distribution, reusing the one of the previous
+        network if the parameters didn't change.
+        :param exponent: Exponent of the degree distribution.
+        :param cutoff: Cutoff of the degree distribution.
+        :return: Degree distribution.
+        """
+        dist = self._degree_dist
+        if dist is None or (dist.tau, dist.kappa) != (exponent, cutoff):
+            self._degree_dist = PowerLawCutoffDist(exponent, cutoff)
+        return self._degree_dist
+
+    def _seed(self, params: Dict[str, Any]) -> Optional[np.random.SeedSequence]:
+        """
+        Return the seed of the next network.
+        :param params: experiment parameters
+        :return: seed or None if the network isn't seeded.
+        """
+        seed = params.get(self.SEED)
+        ensemble = params.get(self.ENSEMBLE)
+
+        if ensemble:
+            i = self._instance % ensemble
+            self._instance += 1
+            return np.random.SeedSequence(seed or 0, spawn_key=(i,))
+
+        if seed is not None:
+            return np.random.SeedSequence(seed)
+
+        return None
+
+    def _network_data_digest(self) -> str:
+        """
+        Return the digest of the network data, computed once per object.
+        :return: hex digest.
+        """
+        if self._digest is None or self._digest[0] is not self._network_data:
+            self._digest = (self._network_data, self._network_data.digest())
+        return self._digest[1]
+
+    def _generate(self, params: Dict[str, Any]) -> \
+            Union[nx.Graph, CompactGraph]:
         """
         Generate the graph of a mobility network from a NetworkData object.
         :param params: experiment parameters
-        :return: Graph
+        :return: Graph (or CompactGraph if `COMPACT` is set)
         """
 
         self._network_data = params.get(self.NETWORK_DATA) or self._network_data
@@ -350,15 +930,43 @@ class MNGeneratorFromNetworkData(MNGenerator):
         exponent = params[self.EXPONENT]
         cutoff = params[self.CUTOFF]
 
-        degree_dist = PowerLawCutoffDist(exponent, cutoff).p
+        seed = self._seed(params)
+
+        # serve the network from the cache if possible
+        g, key = None, None
+        if self._cache is not None and seed is not None:
+            key = NetworkCache.key(
+                self._network_data,
+                dict(n=int(n), exponent=float(exponent), cutoff=float(cutoff),
+                     multiplier=bool(multiplier)),
+                (seed.entropy, seed.spawn_key),
+                self._network_data_digest()
+            )
+            g = self._cache.get(key)
 
-        mobility_network = MobilityNetwork(
-            network_data=self._network_data,
-            degree_dist=degree_dist,
-            N=n,
-            multiplier=multiplier
-        )
+        self._stats = {}
+
+        if g is None:
+            degree_dist = self._get_degree_dist(exponent, cutoff)
+
+            mobility_network = MobilityNetwork(
+                network_data=self._network_data,
+                degree_dist=degree_dist,
+                N=n,
+                multiplier=multiplier,
+                seed=seed,
+                workers=params.get(self.WORKERS, 1),
+                instrument=params.get(self.INSTRUMENT, False)
+            )
+
+            mobility_network.create()
+            g = mobility_network.compact
+            self._stats = mobility_network.stats
+
+            if key is not None:
+                self._cache.put(key, g)
 
-        mobility_network.create()
+        if params.get(self.COMPACT, False):
+            return g
 
-        return mobility_network.g
+        return g.to_networkx()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+import uuid
+
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.network.network_data import NetworkData
+
+
+class NetworkCache:
+    """
+    On-disk cache of generated networks. Networks are stored as CompactGraph
+    `.npz` files named by a hash of the network data, the generator
+    parameters and the seed they were generated from. When the cache exceeds
+    its size limit, the least recently used networks are removed.
+    """
+
+    EXTENSION = '.npz'
+
+    def __init__(self, directory: str, max_bytes: int = 2 ** 30):
+        """
+        Create a NetworkCache.
+        :param directory: Directory of the cached networks. Created if it
+            doesn't exist.
+        :param max_bytes: (optional) Maximum total size of the cached networks
+            in bytes. Defaults to 1 GiB.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(network_data: NetworkData, params: Dict[str, Any],
+            seed: Any, digest: Optional[str] = None) -> str:
+        """
+        Return the cache key of a network.
+        :param network_data: Network data the network is generated from.
+        :param params: Generator parameters (must be representable as JSON).
+        :param seed: Seed the network is generated from.
+        :param digest: (optional) Precomputed `network_data.digest()`.
+        :return: cache key.
+        """
+        h = hashlib.sha256()
+        h.update((digest or network_data.digest()).encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        h.update(repr(seed).encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[CompactGraph]:
+        """
+        Load a network from the cache.
+        :param key: Cache key.
+        :return: CompactGraph or None if the network isn't cached.
+        """
+        path = self._path(key)
+
+        try:
+            g = CompactGraph.load(path)
+        except FileNotFoundError:
+            return None
+
+        # mark as recently used
+        os.utime(path)
+
+        return g
+
+    def put(self, key: str, g: CompactGraph) -> None:
+        """
+        Store a network in the cache and evict the least recently used
+        networks if the cache exceeds its size limit.
+        :param key: Cache key.
+        :param g: CompactGraph
+        """
+        path = self._path(key)
+
+        # write to a temporary file first so readers never see partial files
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as f:
+            g.save(f)
+        os.replace(tmp, path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used networks until the total size of the
+        cache is within `max_bytes`.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.EXTENSION):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in files)
+
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # already removed by another process
+                pass
+
+            total -= size
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the cached networks in bytes.
+        :return: size in bytes.
+        """
+        return sum(
+            os.path.getsize(os.path.join(self.directory, name))
+            for name in os.listdir(self.directory)
+            if name.endswith(self.EXTENSION)
+        )
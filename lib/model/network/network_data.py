@@ -1,20 +1,36 @@
-from typing import List, Dict
+from typing import BinaryIO, Callable, Iterable, List, Dict, Tuple, Union
+import hashlib
 from dataclasses import dataclass, field
 import numpy as np
+from scipy.sparse import csr_matrix
 
 from lib.model.types import TRIP_COUNT_CHANGE, COMB_COUNTS, TRIP_COUNTS,\
     ADJACENCY_LIST, CUM_PROB
+from lib.model.utils import alias_table, load_npz
 
 # special types for convenience...
 DEMOGRAPHICS = Dict[str, Dict[str, float]]
 
 
+def county(cbg: str) -> str:
+    """
+    Return the county of a CBG, i.e. the first five digits (state and county
+    FIPS code) of its GEOID.
+    :param cbg: CBG GEOID.
+    :return: County FIPS code.
+    """
+    return cbg[:5]
+
+
 @dataclass
 class NetworkData:
     """
     Collection of mobility data required for building a MobilityNetwork.
     """
 
+    # Version of the binary format written by `save`
+    FORMAT_VERSION = 1
+
     # Demographics data
     demographics: DEMOGRAPHICS
     # Count of trips between combinations of CBGs
@@ -25,46 +41,218 @@ class NetworkData:
     # not initialised in dataclass
     # CBGs in order
     ordered_cbgs: List[str] = field(init=False)
-    # Adjacency list of CBGs
+    # Adjacency list of CBGs (dense, built on first access)
     adjacency_list: ADJACENCY_LIST = field(init=False)
-    # Cumulative transition prob.
+    # Cumulative transition prob. (dense, built on first access)
     cum_prob: CUM_PROB = field(init=False)
+    # CBG codes (index in ordered_cbgs)
+    cbg_codes: Dict[str, int] = field(init=False)
+    # Sparse transition prob. between CBG codes
+    transition: csr_matrix = field(init=False)
+    # Cumulative transition prob. per row, aligned with transition.data
+    transition_cum: np.ndarray = field(init=False)
+    # Alias table of the transition prob. (acceptance prob. and alias CBGs)
+    alias_prob: np.ndarray = field(init=False)
+    alias_idx: np.ndarray = field(init=False)
+    # Groups of CBGs (e.g. counties) for hierarchical sampling
+    groups: np.ndarray = field(init=False)
+    # Group code of each CBG
+    cbg_groups: np.ndarray = field(init=False)
+    # Sparse transition prob. from CBG codes to group codes
+    group_transition: csr_matrix = field(init=False)
+    # Alias table of the group transition prob.
+    group_alias_prob: np.ndarray = field(init=False)
+    group_alias_idx: np.ndarray = field(init=False)
+    # CBG codes sorted by group with a start per group
+    group_members: np.ndarray = field(init=False)
+    group_indptr: np.ndarray = field(init=False)
+    # Alias table of the CBGs within each group, aligned with group_members
+    member_alias_prob: np.ndarray = field(init=False)
+    member_alias_idx: np.ndarray = field(init=False)
     # Trip ct change
     trip_count_change: TRIP_COUNT_CHANGE = field(init=False)
 
+    # Fields that instances created by `load` build from the stored arrays
+    #  on first access
+    LAZY_FIELDS = ('demographics', 'comb_counts', 'trip_counts',
+                   'trip_count_change')
+
+    # Dense views of the transition matrix (O(C^2) for C CBGs), built on
+    #  first access once the transition matrix has been created
+    DENSE_FIELDS = ('adjacency_list', 'cum_prob')
+
     def __post_init__(self):
         self.ordered_cbgs = sorted(self.demographics.keys())
+        self.cbg_codes = {cbg: i for i, cbg in enumerate(self.ordered_cbgs)}
 
-    def create_adjacency_list(self) -> None:
+    def __getattr__(self, name: str):
         """
-        Create the adjacency list of the CBGs. The keys are the CGBs and the
-        values are ordered lists of transition probabilities to other CBGs.
-        The probabilities are in the same order as `ordered_cbgs`.
+        Build the dictionaries of an instance created by `load` when they are
+        first accessed, so that loading only maps the arrays. The dense views
+        of the transition matrix are likewise only built when first accessed.
+        :param name: Attribute name.
+        :return: Attribute value.
+        """
+        if name in self.DENSE_FIELDS and 'transition' in self.__dict__:
+            if name == 'adjacency_list':
+                self.create_adjacency_list()
+            else:
+                self.create_cum_prob()
+            return self.__dict__[name]
+
+        if name not in self.LAZY_FIELDS or not self._stored(name):
+            raise AttributeError(f"'{type(self).__name__}' object has no "
+                                 f"attribute '{name}'")
+
+        value = self._build_field(name)
+        setattr(self, name, value)
+        return value
+
+    def _stored(self, name: str) -> bool:
+        """
+        Return whether a lazy field hasn't been built yet and can be built
+        from the arrays of `load`.
+        :param name: Field name.
+        :return: True if the field is stored and not built.
+        """
+        arrays = self.__dict__.get('_arrays')
+        return name not in self.__dict__ and arrays is not None and (
+            name != 'trip_count_change' or 'trip_count_change' in arrays
+        )
+
+    def _build_field(self, name: str):
+        """
+        Build a lazy field from the arrays of `load`.
+        :param name: Field name.
+        :return: Field value.
+        """
+        arrays = self._arrays
+        labels = arrays['labels'].tolist()
+
+        if name == 'demographics':
+            fields = arrays['demographics_fields'].tolist()
+            demographics = {cbg: {} for cbg in self.ordered_cbgs}
+            for i, f in enumerate(fields):
+                column = arrays[f'demographics_{i}'].tolist()
+                for cbg, v in zip(self.ordered_cbgs, column):
+                    if v == v:
+                        # skip missing values (NaN)
+                        demographics[cbg][f] = v
+            return demographics
+
+        if name == 'comb_counts':
+            return {
+                (labels[i], labels[j]): count for (i, j), count in zip(
+                    arrays['comb_codes'].tolist(),
+                    arrays['comb_counts'].tolist()
+                )
+            }
+
+        codes, values = {
+            'trip_counts': ('trip_codes', 'trip_counts'),
+            'trip_count_change': ('change_codes', 'trip_count_change')
+        }[name]
+        return {
+            labels[i]: v for i, v in zip(arrays[codes].tolist(),
+                                         arrays[values].tolist())
+        }
+
+    def _label_codes(self) -> np.ndarray:
+        """
+        Return the CBG code of each stored label of `load` (-1 for labels
+        without demographics).
+        :return: Array of CBG codes.
+        """
+        arrays = self._arrays
+        codes = np.full(len(arrays['labels']), -1)
+        codes[arrays['cbgs']] = np.arange(len(arrays['cbgs']))
+        return codes
+
+    def create_transition_matrix(self) -> None:
+        """
+        Create the sparse matrix of transition probabilities between the CBGs
+        in one vectorised pass over the trip counts. Rows and columns are in
+        the order of `ordered_cbgs` (i.e. indexed by the CBG codes).
         The transition probability from CBG i to CBG j is
         P(i, j) = count(trips between i and j) / count(all trips leaving CBG i).
+        Trips from or to CBGs without demographics data are ignored.
+        `transition_cum` holds the cumulative probabilities of each row,
+        aligned with `transition.data`.
         """
+        n = len(self.ordered_cbgs)
+        rows, cols, _, prob = self._trips()
 
-        self.adjacency_list = {}
+        self.transition = csr_matrix((prob, (rows, cols)), shape=(n, n))
+        self.transition.sum_duplicates()
+        self.transition.eliminate_zeros()
+        self.transition.sort_indices()
+
+        # cumulative sums restarting at every row
+        cum = np.cumsum(self.transition.data)
+        offset = np.concatenate([[0.], cum])[self.transition.indptr[:-1]]
+        self.transition_cum = cum - np.repeat(
+            offset, np.diff(self.transition.indptr)
+        )
+
+    def _trips(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                              np.ndarray]:
+        """
+        Return the trips between known CBGs from CBGs with trips leaving them
+        in coordinate format.
+        :return: Origin CBG codes, destination CBG codes, trip counts and
+            transition probabilities count(trips between i and j) /
+            count(all trips leaving CBG i).
+        """
+        n = len(self.ordered_cbgs)
+
+        if self._stored('comb_counts') and self._stored('trip_counts'):
+            # use the stored arrays of `load`
+            label_codes = self._label_codes()
+            codes = label_codes[self._arrays['comb_codes']].reshape(-1, 2)
+            counts = np.asarray(self._arrays['comb_counts'], dtype=float)
+            trip_codes = label_codes[self._arrays['trip_codes']]
+            trip_values = np.asarray(self._arrays['trip_counts'],
+                                     dtype=float)
+        else:
+            # CBG codes of the trip combinations (-1 if unknown)
+            codes = self.codes(
+                cbg for comb in self.comb_counts for cbg in comb
+            ).reshape(-1, 2)
+            counts = np.array(list(self.comb_counts.values()), dtype=float)
 
-        for i in self.ordered_cbgs:
-            self.adjacency_list[i] = []
+            trip_codes = self.codes(self.trip_counts.keys())
+            trip_values = np.array(list(self.trip_counts.values()),
+                                   dtype=float)
 
-            for j in self.ordered_cbgs:
-                # count of trips between
-                comb = (i, j)
+        # total trips leaving each CBG
+        trips = np.zeros(n)
+        known = trip_codes >= 0
+        trips[trip_codes[known]] = trip_values[known]
 
-                if comb in self.comb_counts:
-                    trips_between = self.comb_counts[comb]
-                else:
-                    trips_between = 0
+        # keep trips between known CBGs with trips leaving the origin
+        keep = (codes >= 0).all(axis=1)
+        keep[keep] = trips[codes[keep, 0]] > 0
+        rows, cols = codes[keep, 0], codes[keep, 1]
 
-                # ratio of all trips from i
-                if i in self.trip_counts:
-                    p = trips_between / self.trip_counts[i]
-                else:
-                    p = 0
+        return rows, cols, counts[keep], counts[keep] / trips[rows]
+
+    def create_adjacency_list(self) -> None:
+        """
+        Create the adjacency list of the CBGs. The keys are the CGBs and the
+        values are ordered lists of transition probabilities to other CBGs.
+        The probabilities are in the same order as `ordered_cbgs`.
+        This is a dense view of the (sparse) transition matrix, which is
+        created if necessary.
+        """
 
-                self.adjacency_list[i].append(p)
+        if not hasattr(self, 'transition'):
+            self.create_transition_matrix()
+
+        self.adjacency_list = {}
+
+        for i, cbg in enumerate(self.ordered_cbgs):
+            row = self.transition.getrow(i).toarray().ravel()
+            self.adjacency_list[cbg] = row.tolist()
 
     def create_cum_prob(self) -> None:
         """
@@ -75,14 +263,313 @@ class NetworkData:
 
         # make sure the adjacency list has been initialised
         if not hasattr(self, 'adjacency_list'):
-            raise AttributeError('Attribute adjacency_list not found. Make sure'
-                                 'to run create_adjacency_list first.')
+            raise AttributeError('Attribute adjacency_list not found. Make '
+                                 'sure to run create_adjacency_list first.')
 
         self.cum_prob = {}
 
         for key in self.adjacency_list:
             self.cum_prob[key] = np.array(self.adjacency_list[key]).cumsum()
 
+    def create_alias_table(self) -> None:
+        """
+        Create an alias table of the transition probabilities from the
+        transition matrix, which allows drawing target CBGs in constant time.
+        The table is aligned with `transition.data`: for the entries of row i,
+        `alias_prob` holds the acceptance probabilities and `alias_idx` the
+        codes of the alias CBGs.
+        The probabilities of each CBG are normalised over the CBGs in the data.
+        A CBG without any recorded trips only transitions to itself.
+        """
+
+        # make sure the transition matrix has been initialised
+        if not hasattr(self, 'transition'):
+            raise AttributeError('Attribute transition not found. Make sure '
+                                 'to run create_transition_matrix first.')
+
+        self.alias_prob, self.alias_idx = _row_alias_tables(
+            self.transition.indptr, self.transition.indices,
+            self.transition.data
+        )
+
+    def create_group_alias_table(
+            self, group_key: Callable[[str], str] = county) -> None:
+        """
+        Create the tables for drawing target CBGs in two steps, first the
+        group (e.g. county) of the target CBG and then the CBG within the
+        group (see `draw_cbgs_hierarchical`). The group is drawn from the
+        trips from the origin CBG aggregated per group, which is exact. The
+        CBG within the group is drawn proportional to the trips into the CBG
+        from all origins, i.e. independently of the origin. This approximates
+        the per-origin distribution of `create_alias_table`, which is only
+        exact if all origins split their trips into a group in the same
+        proportions. In return, memory scales with the number of (origin CBG,
+        target group) combinations and the number of CBGs rather than the
+        number of CBG combinations.
+        :param group_key: (optional) Function that returns the group of a
+            CBG. Defaults to the county (first five digits of the CBG).
+        """
+        n = len(self.ordered_cbgs)
+        rows, cols, counts, prob = self._trips()
+
+        # group code of each CBG
+        self.groups, self.cbg_groups = np.unique(
+            np.array([group_key(cbg) for cbg in self.ordered_cbgs], dtype=str),
+            return_inverse=True
+        )
+        n_groups = len(self.groups)
+
+        # transition probabilities from CBGs to groups
+        self.group_transition = csr_matrix(
+            (prob, (rows, self.cbg_groups[cols])), shape=(n, n_groups)
+        )
+        self.group_transition.sum_duplicates()
+        self.group_transition.eliminate_zeros()
+        self.group_transition.sort_indices()
+
+        self.group_alias_prob, self.group_alias_idx = _row_alias_tables(
+            self.group_transition.indptr, self.group_transition.indices,
+            self.group_transition.data
+        )
+
+        # CBGs of each group, weighted by the trips into the CBG (uniform if
+        #  there are no trips into the group)
+        weights = np.bincount(cols, weights=counts, minlength=n)
+        group_weights = np.bincount(
+            self.cbg_groups, weights=weights, minlength=n_groups
+        )
+        weights[group_weights[self.cbg_groups] == 0] = 1
+
+        self.group_members = np.argsort(self.cbg_groups, kind='stable')
+        self.group_indptr = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.cbg_groups, minlength=n_groups),
+                  out=self.group_indptr[1:])
+
+        self.member_alias_prob, self.member_alias_idx = _row_alias_tables(
+            self.group_indptr, self.group_members,
+            weights[self.group_members]
+        )
+
+    def demographics_array(self, name: str) -> np.ndarray:
+        """
+        Return a demographics field of all CBGs as array indexed by the CBG
+        codes.
+        :param name: Name of the field, e.g. `household_size`.
+        :return: Array of the field values in the order of `ordered_cbgs`.
+        """
+        if self._stored('demographics'):
+            fields = self._arrays['demographics_fields'].tolist()
+            if name not in fields:
+                raise KeyError(name)
+            return np.array(self._arrays[f'demographics_{fields.index(name)}'],
+                            dtype=float)
+
+        return np.array(
+            [self.demographics[cbg][name] for cbg in self.ordered_cbgs],
+            dtype=float
+        )
+
+    def trip_count_change_array(self) -> np.ndarray:
+        """
+        Return the trip count change as array indexed by the CBG codes. CBGs
+        without a trip count change are unchanged (1).
+        :return: Array of the trip count change in the order of
+            `ordered_cbgs`.
+        """
+        if self._stored('trip_count_change'):
+            codes = self._label_codes()[self._arrays['change_codes']]
+            known = codes >= 0
+            change = np.ones(len(self.ordered_cbgs))
+            change[codes[known]] = self._arrays['trip_count_change'][known]
+            return change
+
+        if not hasattr(self, 'trip_count_change'):
+            raise AttributeError('Attribute trip_count_change not found. Make '
+                                 'sure to run calc_trip_count_change first.')
+
+        return self.cbg_array(self.trip_count_change, 1)
+
+    def codes(self, cbgs: Iterable[str]) -> np.ndarray:
+        """
+        Return the CBG codes (index in `ordered_cbgs`) of CBG labels.
+        :param cbgs: CBG labels.
+        :return: int32 array of CBG codes, -1 for CBGs not in the data.
+        """
+        return np.fromiter((self.cbg_codes.get(cbg, -1) for cbg in cbgs),
+                           dtype=np.int32)
+
+    def cbg_array(self, values: Dict[str, float],
+                  default: float) -> np.ndarray:
+        """
+        Return values given per CBG label as array indexed by the CBG codes.
+        Values of CBGs not in the data are ignored.
+        :param values: Value per CBG label.
+        :param default: Value of CBGs without a value.
+        :return: Array of the values in the order of `ordered_cbgs`.
+        """
+        codes = self.codes(values.keys())
+        known = codes >= 0
+
+        array = np.full(len(self.ordered_cbgs), default, dtype=float)
+        array[codes[known]] = np.fromiter(values.values(), dtype=float,
+                                          count=len(values))[known]
+        return array
+
+    def digest(self) -> str:
+        """
+        Return a hash of the contents of the network data (demographics, trip
+        counts and, if set, the trip count change). Equal data gives an equal
+        hash across processes.
+        :return: hex digest.
+        """
+        h = hashlib.sha256()
+
+        demographics = sorted(
+            (cbg, sorted(d.items())) for cbg, d in self.demographics.items()
+        )
+        h.update(repr(demographics).encode())
+        h.update(repr(sorted(self.comb_counts.items())).encode())
+        h.update(repr(sorted(self.trip_counts.items())).encode())
+
+        if hasattr(self, 'trip_count_change'):
+            h.update(repr(sorted(self.trip_count_change.items())).encode())
+
+        return h.hexdigest()
+
+    def save(self, file: Union[str, BinaryIO]) -> None:
+        """
+        Save the network data as a single uncompressed NumPy `.npz` archive.
+        The CBG labels are stored once and all other data as columns of CBG
+        codes into the labels: the demographics as one column per field, the
+        trip counts in coordinate format and, if they have been created, the
+        trip count change, the transition matrix with its alias table and the
+        tables for hierarchical sampling.
+        :param file: File name (`.npz` is appended if missing) or file object.
+        """
+        labels = set(self.demographics) | set(self.trip_counts)
+        for origin, destination in self.comb_counts:
+            labels.update((origin, destination))
+        labels = np.array(sorted(labels), dtype=str)
+
+        def codes(keys):
+            return np.searchsorted(labels, np.array(keys, dtype=str))
+
+        arrays = dict(
+            version=np.array(self.FORMAT_VERSION),
+            labels=labels,
+            cbgs=codes(self.ordered_cbgs)
+        )
+
+        # one column per demographics field (NaN if missing)
+        fields = sorted({f for d in self.demographics.values() for f in d})
+        arrays['demographics_fields'] = np.array(fields, dtype=str)
+        for i, f in enumerate(fields):
+            column = [self.demographics[cbg].get(f) for cbg in self.ordered_cbgs]
+            if None in column:
+                column = [np.nan if v is None else v for v in column]
+            arrays[f'demographics_{i}'] = np.array(column)
+
+        combs = list(self.comb_counts.keys())
+        arrays['comb_codes'] = codes(combs).reshape(-1, 2)
+        arrays['comb_counts'] = np.array(list(self.comb_counts.values()))
+
+        arrays['trip_codes'] = codes(list(self.trip_counts.keys()))
+        arrays['trip_counts'] = np.array(list(self.trip_counts.values()))
+
+        if hasattr(self, 'trip_count_change'):
+            arrays['change_codes'] = codes(list(self.trip_count_change.keys()))
+            arrays['trip_count_change'] = np.array(
+                list(self.trip_count_change.values()), dtype=float
+            )
+
+        if hasattr(self, 'transition'):
+            arrays.update(
+                transition_data=self.transition.data,
+                transition_indices=self.transition.indices,
+                transition_indptr=self.transition.indptr,
+                transition_cum=self.transition_cum
+            )
+
+        if hasattr(self, 'alias_prob'):
+            arrays.update(alias_prob=self.alias_prob, alias_idx=self.alias_idx)
+
+        if hasattr(self, 'group_transition'):
+            arrays.update(
+                groups=self.groups,
+                cbg_groups=self.cbg_groups,
+                group_transition_data=self.group_transition.data,
+                group_transition_indices=self.group_transition.indices,
+                group_transition_indptr=self.group_transition.indptr,
+                group_alias_prob=self.group_alias_prob,
+                group_alias_idx=self.group_alias_idx,
+                group_members=self.group_members,
+                group_indptr=self.group_indptr,
+                member_alias_prob=self.member_alias_prob,
+                member_alias_idx=self.member_alias_idx
+            )
+
+        np.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, file: str, mmap: bool = True) -> 'NetworkData':
+        """
+        Load network data saved with `save`. The transition matrix and the
+        alias table are used as stored, so there is no need to create them
+        again. The dictionaries (`demographics`, `comb_counts`, `trip_counts`
+        and `trip_count_change`) are only built from the arrays when they are
+        first accessed, so loading doesn't depend on the number of CBG
+        combinations. The dense adjacency list and cumulative probabilities
+        are not stored, they are built from the transition matrix when first
+        accessed.
+        :param file: File name.
+        :param mmap: (optional) Memory-map the arrays instead of reading them
+            into memory, so that processes loading the same file share the
+            pages. Defaults to True.
+        :return: NetworkData
+        """
+        arrays = load_npz(file, mmap)
+
+        version = int(arrays['version'])
+        if version != cls.FORMAT_VERSION:
+            raise ValueError(f'Unsupported NetworkData format version '
+                             f'{version}, expected {cls.FORMAT_VERSION}.')
+
+        # the lazy fields are built from the arrays (see `__getattr__`)
+        network_data = cls.__new__(cls)
+        network_data._arrays = arrays
+        network_data.ordered_cbgs = \
+            arrays['labels'][arrays['cbgs']].tolist()
+        network_data.cbg_codes = {
+            cbg: i for i, cbg in enumerate(network_data.ordered_cbgs)
+        }
+
+        if 'transition_data' in arrays:
+            n = len(network_data.ordered_cbgs)
+            network_data.transition = csr_matrix(
+                (arrays['transition_data'], arrays['transition_indices'],
+                 arrays['transition_indptr']), shape=(n, n), copy=False
+            )
+            network_data.transition_cum = arrays['transition_cum']
+
+        if 'alias_prob' in arrays:
+            network_data.alias_prob = arrays['alias_prob']
+            network_data.alias_idx = arrays['alias_idx']
+
+        if 'group_transition_data' in arrays:
+            network_data.group_transition = csr_matrix(
+                (arrays['group_transition_data'],
+                 arrays['group_transition_indices'],
+                 arrays['group_transition_indptr']),
+                shape=(len(network_data.ordered_cbgs), len(arrays['groups'])),
+                copy=False
+            )
+            for name in ('groups', 'cbg_groups', 'group_alias_prob',
+                         'group_alias_idx', 'group_members', 'group_indptr',
+                         'member_alias_prob', 'member_alias_idx'):
+                setattr(network_data, name, arrays[name])
+
+        return network_data
+
     def calc_trip_count_change(self, pre_data):
         """
         Calculate the change in trip counts compared to another NetworkData
@@ -113,3 +600,28 @@ class NetworkData:
             trip_count_change[cbg] = change
 
         self.trip_count_change = trip_count_change
+
+
+def _row_alias_tables(indptr: np.ndarray, indices: np.ndarray,
+                      data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Create one alias table per row of a sparse matrix in CSR format. The
+    tables are aligned with `data`: for the entries of row i, the acceptance
+    probabilities and the alias column indices.
+    :param indptr: Row pointers.
+    :param indices: Column indices.
+    :param data: Non-negative weights.
+    :return: Acceptance probabilities and alias column indices.
+    """
+    prob = np.ones(len(data))
+    idx = np.array(indices, copy=True)
+
+    for i in range(len(indptr) - 1):
+        start, end = indptr[i], indptr[i + 1]
+
+        if start < end:
+            p, alias = alias_table(data[start:end])
+            prob[start:end] = p
+            idx[start:end] = indices[start + alias]
+
+    return prob, idx
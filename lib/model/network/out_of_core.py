@@ -0,0 +1,170 @@
+import os
+from typing import Iterator, Tuple
+
+import numpy as np
+
+
+class ArrayFile:
+    """
+    Append-only array on disk. Rows are appended in chunks and the array is
+    read back as memory map, so it never has to fit in memory.
+    """
+
+    def __init__(self, path: str, dtype, shape: Tuple[int, ...] = ()):
+        """
+        Create an empty ArrayFile.
+        :param path: File name (overwritten if it exists).
+        :param dtype: Data type of the array.
+        :param shape: (optional) Shape of a row, e.g. (2,) for an edge list.
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self._len = 0
+
+        open(self.path, 'wb').close()
+
+    def append(self, rows: np.ndarray) -> None:
+        """
+        Append rows to the array.
+        :param rows: Array of rows.
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        rows = rows.reshape((-1,) + self.shape)
+
+        with open(self.path, 'ab') as f:
+            rows.tofile(f)
+
+        self._len += len(rows)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def array(self, mode: str = 'r') -> np.ndarray:
+        """
+        Return the array as memory map.
+        :param mode: (optional) Mode of the memory map ('r' or 'r+').
+        :return: Array
+        """
+        shape = (self._len,) + self.shape
+
+        # empty files can't be memory-mapped
+        if self._len == 0:
+            return np.empty(shape, dtype=self.dtype)
+
+        return np.memmap(self.path, dtype=self.dtype, mode=mode, shape=shape)
+
+    def chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        Iterate over the array in chunks of rows.
+        :param chunk_size: Number of rows per chunk.
+        :return: Iterator of arrays.
+        """
+        a = self.array()
+        for start in range(0, len(a), chunk_size):
+            yield np.asarray(a[start:start + chunk_size])
+
+
+def group_counts(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the distinct values of an array and how often they occur (like
+    `np.unique(values, return_counts=True)`, which is much slower on large
+    arrays).
+    :param values: Array of integers.
+    :return: Sorted distinct values and their counts.
+    """
+    values = np.sort(values, kind='stable')
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=np.int64)
+
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    counts = np.diff(np.append(starts, len(values)))
+
+    return values[starts], counts
+
+
+def write_csr(edges: ArrayFile, n: int, directory: str,
+              chunk_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build the CSR adjacency of an undirected graph from an edge list on disk
+    without loading the edge list or the adjacency into memory. Duplicate
+    edges are removed and the neighbours of each node are sorted (as in
+    `CompactGraph.from_edges`). Self-loops must not occur.
+    :param edges: ArrayFile of edges (rows of two node IDs).
+    :param n: Number of nodes.
+    :param directory: Directory for the memory-mapped arrays.
+    :param chunk_size: Number of edges (or adjacency entries) per chunk.
+    :return: Memory-mapped row pointers (int64) and column indices (int32).
+    """
+    path = os.path.join
+
+    # number of adjacency entries per node (both directions of each edge)
+    indptr = np.lib.format.open_memmap(
+        path(directory, 'indptr_all.npy'), mode='w+', dtype=np.int64,
+        shape=(n + 1,)
+    )
+    indptr[:] = 0
+
+    for chunk in edges.chunks(chunk_size):
+        nodes, counts = group_counts(chunk.ravel())
+        indptr[nodes + 1] += counts
+
+    np.cumsum(indptr, out=indptr)
+
+    # scatter the entries to the rows
+    entries = np.lib.format.open_memmap(
+        path(directory, 'indices_all.npy'), mode='w+', dtype=np.int32,
+        shape=(int(indptr[-1]),)
+    )
+    fill = np.lib.format.open_memmap(
+        path(directory, 'fill.npy'), mode='w+', dtype=np.int64, shape=(n,)
+    )
+    fill[:] = indptr[:-1]
+
+    for chunk in edges.chunks(chunk_size):
+        src = np.concatenate([chunk[:, 0], chunk[:, 1]])
+        dst = np.concatenate([chunk[:, 1], chunk[:, 0]])
+
+        order = np.argsort(src, kind='stable')
+        src, dst = src[order], dst[order]
+
+        # position of each entry among the entries of its row in the chunk
+        nodes, counts = group_counts(src)
+        rank = np.arange(len(src)) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+
+        entries[fill[src] + rank] = dst
+        fill[nodes] += counts
+
+    del fill
+
+    # sort the rows and drop duplicates, in blocks of rows
+    out_indptr = np.lib.format.open_memmap(
+        path(directory, 'indptr.npy'), mode='w+', dtype=np.int64,
+        shape=(n + 1,)
+    )
+    out_indptr[0] = 0
+    out_indices = ArrayFile(path(directory, 'indices.bin'), np.int32)
+
+    a = 0
+    while a < n:
+        # rows [a, b) with at most chunk_size entries (at least one row)
+        b = int(np.searchsorted(indptr, indptr[a] + chunk_size, side='right'))
+        b = min(max(b - 1, a + 1), n)
+
+        start, end = indptr[a], indptr[b]
+        degree = np.diff(indptr[a:b + 1])
+        rows = np.repeat(np.arange(a, b, dtype=np.int64), degree)
+
+        keys = np.sort(rows * n + entries[start:end])
+        keys = keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+        rows, cols = np.divmod(keys, max(n, 1))
+
+        out_indices.append(cols)
+        out_indptr[a + 1:b + 1] = out_indptr[a] + np.cumsum(
+            np.bincount(rows - a, minlength=b - a)
+        )
+
+        a = b
+
+    return out_indptr, out_indices.array()
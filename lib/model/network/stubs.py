@@ -0,0 +1,205 @@
+from typing import Callable, Optional, Tuple
+import warnings
+
+import numpy as np
+
+# number of target groups redrawn at once if a group has no stubs left
+RETRY_BATCH = 16
+
+# number of swap attempts allowed per conflicting pair when breaking up pairs
+MAX_ITERATIONS_PER_CONFLICT = 100
+
+
+def pair_stubs(stubs: np.ndarray, groups: np.ndarray, n_groups: int,
+               draw_targets: Callable[[np.ndarray], np.ndarray],
+               rng: np.random.Generator,
+               max_retries: int = 100) -> Tuple[np.ndarray, int]:
+    """
+    Pair stubs such that the group (e.g. CBG) of the partner of a stub is
+    drawn from a distribution depending on the group of the stub.
+
+    The unpaired stub positions are kept in one pool per group. Stubs are
+    removed from their pool by swapping them with the last stub of the pool,
+    so that drawing a partner and removing it takes constant time.
+    :param stubs: Array of stubs (node IDs), even length.
+    :param groups: Group of each stub, integers in [0, n_groups).
+    :param n_groups: Number of groups `draw_targets` draws from. Groups
+        without stubs (e.g. CBGs without nodes) are redrawn like groups that
+        have run out of stubs.
+    :param draw_targets: Function that draws a target group in
+        [0, n_groups) for each entry of an array of origin groups.
+    :param rng: Random generator.
+    :param max_retries: Maximum number of times a target group is redrawn if
+        it has no unpaired stubs left. Afterwards a random group that still
+        has unpaired stubs is used.
+    :return: Stubs ordered such that each two successive stubs form a pair;
+        total number of redrawn target groups.
+    """
+    n = len(stubs)
+    groups = np.asarray(groups)
+
+    if n and (groups.min() < 0 or groups.max() >= n_groups):
+        raise ValueError('The groups of the stubs must be in '
+                         '[0, n_groups).')
+
+    # pools: stub positions sorted by group with a start and size per group
+    order = np.argsort(groups, kind='stable')
+    pool = order.tolist()
+    size = np.bincount(groups, minlength=n_groups).tolist()
+    start = (np.cumsum(size) - size).tolist()
+
+    # index of each stub position in the pool
+    where = np.empty(n, dtype=np.int64)
+    where[order] = np.arange(n)
+    where = where.tolist()
+
+    # groups that still have unpaired stubs
+    nonempty = [g for g in range(n_groups) if size[g]]
+    where_group = [0] * n_groups
+    for k, g in enumerate(nonempty):
+        where_group[g] = k
+
+    group = groups.tolist()
+    paired = [False] * n
+
+    def remove(position):
+        g = group[position]
+        k = where[position]
+        last = start[g] + size[g] - 1
+
+        # swap with the last stub of the pool and shrink the pool
+        other = pool[last]
+        pool[k], where[other] = other, k
+        pool[last], where[position] = position, last
+        size[g] -= 1
+        paired[position] = True
+
+        if size[g] == 0:
+            # swap-remove the group from the non-empty groups
+            h = nonempty[-1]
+            nonempty[where_group[g]] = h
+            where_group[h] = where_group[g]
+            nonempty.pop()
+
+    # draw targets and partner positions for all stubs up front
+    targets = draw_targets(groups).tolist()
+    u = rng.random(n).tolist()
+
+    result = []
+    retries = 0
+
+    for p in range(n):
+
+        if paired[p]:
+            continue
+
+        remove(p)
+
+        # redraw the target group as long as it has no unpaired stubs
+        target = targets[p]
+        attempts = 0
+        while size[target] == 0:
+
+            if attempts < max_retries:
+                # redraw a batch at once and take the first usable group
+                origins = np.full(RETRY_BATCH, group[p])
+                for target in draw_targets(origins).tolist():
+                    attempts += 1
+                    if size[target]:
+                        break
+            else:
+                attempts += 1
+                target = nonempty[int(rng.random() * len(nonempty))]
+
+        retries += attempts
+
+        # random unpaired stub of the target group
+        q = pool[start[target] + int(u[p] * size[target])]
+        remove(q)
+
+        result.append(stubs[p])
+        result.append(stubs[q])
+
+    return np.array(result, dtype=np.asarray(stubs).dtype), retries
+
+
+def break_up_pairs(stubs: np.ndarray, household: np.ndarray,
+                   rng: np.random.Generator,
+                   max_iterations: Optional[int] = None) \
+        -> Tuple[np.ndarray, int]:
+    """
+    Break up pairs of successive stubs of the same household by swapping the
+    second stub with a random other stub.
+
+    Only the conflicting pairs are kept in a work list. A swap is only made if
+    neither of the two pairs it changes is intra-household afterwards, so
+    every swap reduces the number of conflicts. Pairs that are still
+    conflicting after `max_iterations` swap attempts are dropped with a
+    `RuntimeWarning`, since dropping them lowers the degrees of their nodes.
+    This only happens if the stubs can't be paired between households (e.g.
+    if most stubs belong to one household) or the budget is too small.
+    :param stubs: Array of stubs (node IDs) where successive stubs form pairs.
+    :param household: Household of each node.
+    :param rng: Random generator.
+    :param max_iterations: (optional) Maximum number of swap attempts;
+        defaults to `MAX_ITERATIONS_PER_CONFLICT` per conflicting pair.
+    :return: Stubs without intra-household pairs; number of swap attempts.
+    """
+    stubs = np.array(stubs)
+    n = len(stubs)
+
+    h = np.asarray(household)[stubs]
+    conflicting = h[0::2] == h[1::2]
+    work = np.flatnonzero(conflicting).tolist()
+
+    if max_iterations is None:
+        max_iterations = MAX_ITERATIONS_PER_CONFLICT * len(work)
+
+    s = stubs.tolist()
+    h = h.tolist()
+    conflicting = conflicting.tolist()
+
+    iterations = 0
+
+    while work and iterations < max_iterations:
+
+        # random swap partners for the next attempts
+        for j in rng.integers(n, size=len(work)).tolist():
+
+            if not work or iterations == max_iterations:
+                break
+
+            k = work.pop()
+            iterations += 1
+
+            a = 2 * k
+            b = a + 1
+            m = j // 2
+            partner = j ^ 1
+
+            # swap `b` and `j` only if both resulting pairs are fine
+            if m != k and h[a] != h[j] and h[partner] != h[b]:
+                s[b], s[j] = s[j], s[b]
+                h[b], h[j] = h[j], h[b]
+
+                conflicting[k] = False
+                conflicting[m] = False
+
+            else:
+                work.append(k)
+
+            # skip pairs that were resolved as swap partner
+            while work and not conflicting[work[-1]]:
+                work.pop()
+
+    stubs = np.array(s, dtype=stubs.dtype)
+
+    # drop the pairs that could not be broken up
+    if work:
+        keep = ~np.repeat(conflicting, 2)
+        warnings.warn(f'Dropped {n - keep.sum()} stubs of intra-household '
+                      f'pairs after {iterations} swap attempts, the degree '
+                      f'sequence is not preserved.', RuntimeWarning)
+        stubs = stubs[keep]
+
+    return stubs, iterations
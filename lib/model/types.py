@@ -1,8 +1,8 @@
 from typing import Dict, Union, Tuple, List
-from numpy.random import Generator
+from numpy.random import Generator, SeedSequence
 from numpy import array
 
-RANDOM_SEED = Union[Generator, int]
+RANDOM_SEED = Union[Generator, SeedSequence, int]
 TRIP_COUNT_CHANGE = Dict[str, float]
 COMB_COUNTS = Dict[Tuple[str, str], int]
 TRIP_COUNTS = Dict[str, int]
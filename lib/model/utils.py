@@ -1,5 +1,7 @@
 # Model utils
-from typing import Callable, Union, Optional
+from typing import Callable, Union, Optional, Tuple, Dict
+import struct
+import zipfile
 import numpy as np
 
 from lib.model.types import RANDOM_SEED
@@ -28,6 +30,56 @@ def discrete_rejection_sample(p: Callable[[int], Union[float, int]],
             return x
 
 
+def tabulate_cdf(p: Callable[[int], Union[float, int]],
+                 a: int, b: int) -> np.ndarray:
+    """
+    Tabulate the cumulative distribution of the discrete probability
+    distribution function `p` restricted to the range [a; b).
+    :param p: Probability distribution function.
+    :param a: Lower bound of the values.
+    :param b: Upper bound of the values.
+    :return: Array with the cumulative probabilities of a, ..., b - 1.
+    """
+    cdf = np.cumsum([float(p(x)) for x in range(a, b)])
+    cdf /= cdf[-1]
+    return cdf
+
+
+def discrete_inverse_sample(p: Callable[[int], Union[float, int]],
+                            a: int, b: int,
+                            size: Union[int, Tuple[int, ...]],
+                            seed: Optional[RANDOM_SEED] = None) -> np.ndarray:
+    """
+    Draw samples from the discrete probability distribution function `p`
+    restricted to the range [a; b). This draws from the same distribution as
+    `discrete_rejection_sample` but evaluates `p` only once per value and
+    draws all samples in one go by inverting the cumulative distribution.
+    :param p: Probability distribution function.
+    :param a: Lower bound of the sample values.
+    :param b: Upper bound of the sample values.
+    :param size: Output shape.
+    :param seed: Random seed.
+    :return: Array of sampled integers.
+    """
+    rng = np.random.default_rng(seed=seed)
+    cdf = tabulate_cdf(p, a, b)
+    return np.searchsorted(cdf, rng.random(size), side='right') + a
+
+
+def seed_sequence(seed: Optional[RANDOM_SEED] = None) -> np.random.SeedSequence:
+    """
+    Return a SeedSequence for a random seed, e.g. to spawn independent
+    random streams from it. A Generator seed is used to draw the entropy.
+    :param seed: (optional) Random seed.
+    :return: SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(int(seed.integers(2 ** 63)))
+    return np.random.SeedSequence(seed)
+
+
 def binary_search_lowest_idx(arr, left, right, x) -> int:
     """
     Generic binary search function that finds an element in an array. If the
@@ -47,3 +99,90 @@ def binary_search_lowest_idx(arr, left, right, x) -> int:
         else:
             right = mid
     return left
+
+
+def alias_table(p) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build the table for Walker's alias method (Vose's variant) for a discrete
+    distribution. A sample is drawn by picking an index k uniformly and
+    returning k with probability `prob[k]` and `alias[k]` otherwise.
+    :param p: Array like object of non-negative weights (not all zero).
+    :return: Acceptance probabilities and alias indices.
+    """
+    p = np.asarray(p, dtype=float)
+    n = len(p)
+
+    scaled = p * n / p.sum()
+    prob = np.ones(n)
+    alias = np.arange(n)
+
+    small = list(np.flatnonzero(scaled < 1))
+    large = list(np.flatnonzero(scaled >= 1))
+
+    # fill each underfull column with mass from an overfull one
+    while small and large:
+        s = small.pop()
+        g = large.pop()
+
+        prob[s] = scaled[s]
+        alias[s] = g
+
+        scaled[g] = scaled[g] + scaled[s] - 1
+        if scaled[g] < 1:
+            small.append(g)
+        else:
+            large.append(g)
+
+    # leftovers are full columns up to rounding errors
+    return prob, alias
+
+
+def load_npz(file: str, mmap: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Load all arrays of a NumPy `.npz` archive. With `mmap`, the arrays are
+    memory-mapped read-only directly from the archive instead of being read
+    into memory, which requires the archive to be uncompressed (as written
+    by `np.savez`).
+    :param file: File name.
+    :param mmap: (optional) Memory-map the arrays.
+    :return: Dictionary of arrays.
+    """
+    if not mmap:
+        with np.load(file) as arrays:
+            return {k: arrays[k] for k in arrays.files}
+
+    arrays = {}
+
+    with zipfile.ZipFile(file) as z, open(file, 'rb') as f:
+        for info in z.infolist():
+
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('Only uncompressed .npz files can be '
+                                 'memory-mapped.')
+
+            # skip the local file header (30 bytes, file name, extra field)
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+
+            # read the header of the .npy file
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+
+            name = info.filename[:-len('.npy')]
+
+            # empty arrays can't be memory-mapped
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+
+            arrays[name] = np.memmap(
+                file, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                order='F' if fortran_order else 'C'
+            )
+
+    return arrays
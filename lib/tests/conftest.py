@@ -1,6 +1,7 @@
 import pytest
 from lib.tests.factory import create_network_graph
 from networkx import write_graphml
+from lib.model.network.compact_graph import convert_graphml
 
 
 @pytest.fixture(scope="session")
@@ -9,3 +10,10 @@ def network_graph_file(tmpdir_factory):
     fn = tmpdir_factory.mktemp("graphs").join("graph.graphml")
     write_graphml(g, str(fn))
     return fn
+
+
+@pytest.fixture(scope="session")
+def network_binary_file(tmpdir_factory, network_graph_file):
+    fn = tmpdir_factory.mktemp("graphs").join("graph.npz")
+    convert_graphml(str(network_graph_file), str(fn))
+    return fn
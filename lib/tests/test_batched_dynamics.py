@@ -0,0 +1,138 @@
+import networkx as nx
+import numpy as np
+import pytest
+from epydemic import Monitor, Dynamics
+from epyc import Experiment, LabNotebook, RepeatedExperiment
+from scipy.sparse import csr_matrix
+
+from lib.model.compartmental_model.seivr import SEIVR
+from lib.model.dynamics.batched import BatchedSynchronousDynamics, \
+    batched_step
+from lib.model.dynamics.common import Rates, EXPOSED, VACCINATED, \
+    bernoulli_positions, csr_adjacency
+from lib.model.dynamics.synchronous import VectorisedSynchronousDynamics
+
+N = 300
+G = nx.fast_gnp_random_graph(N, 5 / N, seed=1)
+REPLICAS = 50
+MAX_TIME = 500
+
+PARAMS = dict()
+PARAMS[SEIVR.P_EXPOSED] = 0.05
+PARAMS[SEIVR.P_INFECT_ASYMPTOMATIC] = 0.01
+PARAMS[SEIVR.P_INFECT_SYMPTOMATIC] = 0.03
+PARAMS[SEIVR.P_SYMPTOMS] = 0.05
+PARAMS[SEIVR.P_REMOVE] = 0.05
+PARAMS[SEIVR.P_VACCINATED_INITIAL] = 0.1
+PARAMS[SEIVR.P_VACCINATED] = 0.005
+PARAMS[SEIVR.VACCINE_RRR] = 0.75
+PARAMS[Monitor.DELTA] = 10
+
+COMPARTMENTS = [SEIVR.SUSCEPTIBLE, SEIVR.EXPOSED, SEIVR.INFECTED,
+                SEIVR.VACCINATED, SEIVR.REMOVED]
+
+
+def test_batched_dynamics():
+    e = BatchedSynchronousDynamics(SEIVR(), G, REPLICAS, MAX_TIME, seed=1)
+    e.set(params=PARAMS)
+    rcs = e.run(fatal=True)
+    assert len(rcs) == REPLICAS
+
+    for i, replica in enumerate(rcs):
+        assert replica[Experiment.METADATA][Experiment.STATUS]
+        assert replica[Experiment.METADATA][RepeatedExperiment.I] == i
+        assert replica[Experiment.METADATA][Dynamics.TIME] == MAX_TIME
+        assert replica[Experiment.PARAMETERS] == PARAMS
+
+        results = replica[Experiment.RESULTS]
+        observations = results[Monitor.OBSERVATIONS]
+        assert observations == list(range(0, MAX_TIME, 10))
+
+        # Monitor-style time series of all compartments
+        series = np.array([results[Monitor.timeSeriesForLocus(c)]
+                           for c in COMPARTMENTS])
+        assert series.shape == (len(COMPARTMENTS), len(observations))
+        assert np.all(series.sum(axis=0) == N)
+
+        # removed nodes never leave
+        removed = series[COMPARTMENTS.index(SEIVR.REMOVED)]
+        assert np.all(np.diff(removed) >= 0)
+
+        assert sum(results[c] for c in COMPARTMENTS) == N
+
+    # replicas are independent
+    removed = [r[Experiment.RESULTS][SEIVR.REMOVED] for r in rcs]
+    assert len(set(removed)) > 1
+
+
+def test_batched_dynamics_matches_single():
+    """
+    Test the replicas follow the same dynamics as separate runs.
+    """
+    e = BatchedSynchronousDynamics(SEIVR(), G, REPLICAS, MAX_TIME, seed=1)
+    e.set(params=PARAMS)
+    rcs = e.run(fatal=True)
+    removed_is = [rc[Experiment.RESULTS][SEIVR.REMOVED] for rc in rcs]
+
+    e = VectorisedSynchronousDynamics(SEIVR(), G, MAX_TIME, seed=2)
+    e.set(params=PARAMS)
+    removed_should = [e.run(fatal=True)[Experiment.RESULTS][SEIVR.REMOVED]
+                      for _ in range(REPLICAS)]
+
+    assert abs(np.mean(removed_is) - np.mean(removed_should)) < 0.05 * N
+
+
+def test_batched_dynamics_repeated():
+    e = BatchedSynchronousDynamics(SEIVR(), G, 5, 50, seed=1)
+    rc = RepeatedExperiment(e, 3).set(PARAMS).run(fatal=True)
+    assert len(rc[Experiment.RESULTS]) == 15
+
+    nb = LabNotebook()
+    nb.addResult(rc)
+    assert len(nb.current().results()) == 15
+
+
+def test_batched_dynamics_requires_delta():
+    params = {k: v for k, v in PARAMS.items() if k != Monitor.DELTA}
+    e = BatchedSynchronousDynamics(SEIVR(), G, 5, 50, seed=1)
+    e.set(params=params)
+
+    with pytest.raises(ValueError, match=Monitor.DELTA):
+        e.run(fatal=True)
+
+
+def test_batched_step_vaccine():
+    indptr, indices = csr_adjacency(nx.star_graph(10))
+    adjacency = csr_matrix((np.ones(len(indices)), indices, indptr))
+    rng = np.random.default_rng(1)
+
+    rates = Rates(p_exposed=0, p_infect_a=1, p_infect_s=1, p_symptoms=0,
+                  p_remove=0, vac_rrr=1)
+
+    # a perfect vaccine protects from infection (in every replica)
+    states = np.full((11, 3), VACCINATED, dtype=np.int8)
+    states[0] = EXPOSED
+    assert batched_step(states, adjacency, rates, rng).tolist() == [0] * 3
+    assert np.all(states[1:] == VACCINATED)
+
+    # without risk reduction, all neighbours are infected
+    rates.vac_rrr = 0
+    states[0, 1] = VACCINATED
+    assert batched_step(states, adjacency, rates, rng).tolist() == [10, 0, 10]
+    assert np.all(states[:, [0, 2]] == EXPOSED)
+    assert np.all(states[:, 1] == VACCINATED)
+
+
+def test_bernoulli_positions():
+    rng = np.random.default_rng(1)
+    size = 100000
+
+    for p in [0.001, 0.05, 0.5]:
+        positions = bernoulli_positions(size, p, rng)
+        assert np.all(np.diff(positions) > 0)
+        assert positions.min() >= 0
+        assert positions.max() < size
+        assert abs(len(positions) / size - p) < 0.01
+
+    assert len(bernoulli_positions(size, 0, rng)) == 0
+    assert len(bernoulli_positions(size, 1, rng)) == size
@@ -0,0 +1,73 @@
+import networkx as nx
+import numpy as np
+
+from lib.model.network.compact_graph import CompactGraph
+
+# two households {0, 1, 2} and {3, 4} connected by the edge (2, 3)
+HOUSEHOLD = np.array([1, 1, 1, 2, 2])
+HOUSEHOLD_SIZE = np.array([3, 3, 3, 2, 2])
+CBG = np.array([0, 0, 0, 1, 1])
+CBG_LABELS = np.array(['cbg1', 'cbg2'])
+EDGES = np.array([[0, 1], [0, 2], [1, 2], [3, 4], [2, 3]])
+
+
+def create_compact_graph():
+    return CompactGraph.from_edges(EDGES, HOUSEHOLD, HOUSEHOLD_SIZE, CBG,
+                                   CBG_LABELS)
+
+
+def test_from_edges():
+    # duplicates and self-loops are dropped
+    edges = np.concatenate([EDGES, [[3, 2], [4, 4]]])
+    g = CompactGraph.from_edges(edges, HOUSEHOLD, HOUSEHOLD_SIZE)
+
+    assert g.order == 5
+    assert g.size == 5
+    assert (g.degree == [2, 2, 3, 2, 1]).all()
+    assert sorted(g.neighbors(2).tolist()) == [0, 1, 3]
+
+    assert g.indices.dtype == np.int32
+    assert g.household.dtype == np.int32
+    assert g.household_size.dtype == np.int16
+
+
+def test_to_networkx():
+    g = create_compact_graph().to_networkx()
+
+    assert isinstance(g, nx.Graph)
+    assert g.order() == 5
+    assert g.size() == 5
+
+    assert g.nodes[0] == dict(household=1, household_size=3, cbg='cbg1')
+    assert g.edges[3, 4] == dict(household=2, household_size=2, cbg='cbg2')
+    assert g.edges[2, 3] == dict(household=0, household_size=0)
+
+
+def test_to_networkx_cached():
+    compact = create_compact_graph()
+    assert compact.to_networkx() is compact.to_networkx()
+
+
+def test_from_networkx():
+    g = create_compact_graph().to_networkx()
+    compact = CompactGraph.from_networkx(g)
+
+    assert compact.order == g.order()
+    assert compact.size == g.size()
+    assert (compact.household == HOUSEHOLD).all()
+    assert (compact.cbg_labels[compact.cbg] == CBG_LABELS[CBG]).all()
+    assert nx.is_isomorphic(compact.to_networkx(), g)
+
+
+def test_save_load(tmpdir):
+    fn = str(tmpdir.join('graph.npz'))
+    g = create_compact_graph()
+    g.save(fn)
+
+    for mmap in [False, True]:
+        loaded = CompactGraph.load(fn, mmap=mmap)
+        assert (loaded.indptr == g.indptr).all()
+        assert (loaded.indices == g.indices).all()
+        assert (loaded.household == g.household).all()
+        assert (loaded.cbg_labels == g.cbg_labels).all()
+        assert nx.is_isomorphic(loaded.to_networkx(), g.to_networkx())
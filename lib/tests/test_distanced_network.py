@@ -3,8 +3,11 @@ from networkx import Graph
 import numpy as np
 
 from lib.model.network.distanced_network import DistancedNetwork, DNGenerator
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.network.households import household_starts
 from lib.model.distributions import discrete_trunc_exponential, \
-    discrete_trunc_normal, num_contact_dist
+    discrete_trunc_normal, num_contact_dist, discrete_trunc_normal_batch, \
+    num_contact_dist_batch, discrete_trunc_exponential_batch
 
 
 EXPONENT = 2
@@ -16,6 +19,14 @@ average_family = partial(discrete_trunc_normal, mu=HOUSEHOLD_SIZE, std=2)
 intra_family_contacts = partial(num_contact_dist, std=1)
 inter_family_contacts = partial(discrete_trunc_exponential, exponent=EXPONENT)
 
+average_family_batch = partial(
+    discrete_trunc_normal_batch, mu=HOUSEHOLD_SIZE, std=2
+)
+intra_family_contacts_batch = partial(num_contact_dist_batch, std=1)
+inter_family_contacts_batch = partial(
+    discrete_trunc_exponential_batch, exponent=EXPONENT
+)
+
 
 def test_create_network():
     network = DistancedNetwork(N, average_family, intra_family_contacts,
@@ -26,6 +37,58 @@ def test_create_network():
     assert N * 0.9 <= network.g.order() <= N * 1.1
 
 
+def test_create_network_batched():
+    network = DistancedNetwork(
+        N, average_family_batch, intra_family_contacts_batch,
+        inter_family_contacts_batch, batched=True
+    )
+
+    network.create()
+    assert isinstance(network.g, Graph)
+    assert N <= network.g.order() <= N * 1.1
+
+    # household sizes are consistent with the household IDs
+    sizes = {}
+    for _, h in network.g.nodes(data='household'):
+        sizes[h] = sizes.get(h, 0) + 1
+    for _, data in network.g.nodes(data=True):
+        assert sizes[data['household']] == data['household_size']
+
+
+def test_create_stubs_batched():
+    network = DistancedNetwork(
+        N, average_family_batch, intra_family_contacts_batch,
+        inter_family_contacts_batch, batched=True
+    )
+
+    households = network._create_households()
+    stubs = network._create_stubs(households)
+
+    assert len(stubs) % 2 == 0
+
+    # only the first nodes of a household have outside connections
+    outside = np.zeros(households.order, dtype=bool)
+    outside[stubs] = True
+    for start, size in zip(household_starts(households.household),
+                           households.sizes):
+        n_outside = outside[start:start + size].sum()
+        assert outside[start:start + n_outside].all()
+
+
+def test_create_network_seed():
+    networks = []
+    for _ in range(2):
+        network = DistancedNetwork(
+            N, average_family_batch, intra_family_contacts_batch,
+            inter_family_contacts_batch, batched=True, seed=SEED
+        )
+        network.create()
+        networks.append(network.compact)
+
+    assert (networks[0].indptr == networks[1].indptr).all()
+    assert (networks[0].indices == networks[1].indices).all()
+
+
 def test_create_households():
     # setup
     network = DistancedNetwork(
@@ -36,19 +99,14 @@ def test_create_households():
     households = network._create_households()
 
     # number of nodes
-    assert len(network.g.nodes) < N * 1.1
-
-    num_exceeds_std = 0
-    for household in households:
-
-        size_is = household.order()
+    assert N <= households.order < N * 1.1
 
-        if abs(size_is - HOUSEHOLD_SIZE) > HOUSEHOLD_SIZE / 2:
-            num_exceeds_std += 1
+    sizes = households.sizes
+    num_exceeds_std = np.sum(np.abs(sizes - HOUSEHOLD_SIZE) > HOUSEHOLD_SIZE / 2)
 
     # normal distribution should exceed std in only 32% of cases, ... but
     #  with some levy it is allowed in 45% of cases
-    assert num_exceeds_std < 0.45 * len(households)
+    assert num_exceeds_std < 0.45 * len(sizes)
 
 
 def test_create_stubs():
@@ -66,8 +124,9 @@ def test_create_stubs():
     assert len(stubs) % 2 == 0
 
     # expected number of outside nodes
-    avg_contacts = np.mean([num_contact_dist(h.order()) for h in households])
-    exp_c_nodes = len(households) * avg_contacts
+    sizes = households.sizes
+    avg_contacts = np.mean([num_contact_dist(size) for size in sizes])
+    exp_c_nodes = len(sizes) * avg_contacts
     is_c_nodes = len(set(stubs))
 
     # high threshold necessary cause it varies a lot...
@@ -92,12 +151,10 @@ def test_break_up_pairs():
     stubs = network._create_stubs(households)
 
     # test
-    network._break_up_pairs(stubs)
+    stubs = network._break_up_pairs(stubs)
 
-    for i in range(0, len(stubs), 2):
-        h1 = network.g.nodes[stubs[i]]['household']
-        h2 = network.g.nodes[stubs[i + 1]]['household']
-        assert h1 != h2
+    household = households.household[stubs]
+    assert (household[0::2] != household[1::2]).all()
 
 
 def test_connect_stubs():
@@ -128,3 +185,23 @@ def test_distanced_generator():
     mng = DNGenerator(params=params)
     g = mng.generate()
     assert isinstance(g, Graph)
+
+    params[DNGenerator.COMPACT] = True
+    mng = DNGenerator(params=params)
+    g = mng.generate()
+    assert isinstance(g, CompactGraph)
+
+
+def test_distanced_generator_batched():
+    params = {
+        DNGenerator.N: N,
+        DNGenerator.HOUSEHOLD_SIZE_DIST: average_family_batch,
+        DNGenerator.NUM_CONTACT_DIST: intra_family_contacts_batch,
+        DNGenerator.NUM_OUTSIDE_EDGE_DIST: inter_family_contacts_batch,
+        DNGenerator.BATCHED: True
+    }
+
+    mng = DNGenerator(params=params)
+    g = mng.generate()
+    assert isinstance(g, Graph)
+    assert g.order() >= N
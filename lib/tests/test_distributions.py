@@ -1,7 +1,11 @@
 import pytest
 from lib.model.distributions import discrete_trunc_normal, \
-    discrete_trunc_exponential, draw_cbg, num_contact_dist, PowerLawCutoffDist
+    discrete_trunc_exponential, draw_cbg, draw_cbgs, num_contact_dist, \
+    PowerLawCutoffDist, _plc_cdf, discrete_trunc_normal_batch, \
+    discrete_trunc_exponential_batch, num_contact_dist_batch, \
+    draw_cbgs_hierarchical
 from lib.tests.factory import create_network_data
+from lib.model.network.network_data import NetworkData
 import numpy as np
 from mpmath import polylog
 
@@ -12,6 +16,8 @@ POST = create_network_data(True)
 
 PRE.create_adjacency_list()
 PRE.create_cum_prob()
+PRE.create_transition_matrix()
+PRE.create_alias_table()
 
 POST.create_adjacency_list()
 POST.create_cum_prob()
@@ -84,6 +90,47 @@ def test_discrete_trunc_exponential():
     assert abs(np.std(nums) - BASELINE * m) < 0.5
 
 
+def test_discrete_trunc_normal_batch():
+    mu_should = PRE.demographics['cbg1']['household_size']
+    sigma_should = mu_should / 2
+
+    nums = discrete_trunc_normal_batch(mu_should, size=10000, seed=SEED)
+    assert nums.shape == (10000,)
+    assert nums.dtype == np.int64
+    assert (nums >= 1).all()
+
+    # margin of error is needed since it's a truncated normal dist...
+    assert abs(np.mean(nums) - mu_should) < 0.5
+    assert abs(np.std(nums) - sigma_should) < 0.25
+
+    # one value per mean
+    mu = np.array([1, 5, 20])
+    assert discrete_trunc_normal_batch(mu, seed=SEED).shape == mu.shape
+
+
+def test_num_contact_dist_batch():
+    size = 10
+    std = 2
+    mu_should = min(size / 2, 2)
+
+    nums = num_contact_dist_batch(np.full(10000, size), std=std, seed=SEED)
+    assert nums.shape == (10000,)
+    assert (nums >= 1).all()
+
+    # margin of error is needed since it's a truncated normal dist...
+    assert abs(np.mean(nums) - mu_should) < size / 10
+    assert abs(np.std(nums) - std) < std / 2
+
+
+def test_discrete_trunc_exponential_batch():
+    nums = discrete_trunc_exponential_batch(BASELINE, size=10000, seed=SEED)
+    assert nums.shape == (10000,)
+    assert (nums >= 1).all()
+
+    assert abs(np.mean(nums) - BASELINE) < 0.5
+    assert abs(np.std(nums) - BASELINE) < 0.5
+
+
 def test_draw_cbg():
     n = 10000
 
@@ -109,6 +156,23 @@ def test_draw_cbg():
         assert pytest.approx(prop_is, 0.1) == prop_should
 
 
+def test_draw_cbgs():
+    n = 100000
+
+    results = draw_cbgs(PRE, 0, n, SEED)
+    assert results.shape == (n,)
+
+    prop_is = np.bincount(results, minlength=len(PRE.ordered_cbgs)) / n
+    prop_should = PRE.adjacency_list[PRE.ordered_cbgs[0]]
+
+    assert np.allclose(prop_is, prop_should, atol=0.01)
+
+    # one target per origin
+    origins = np.arange(len(PRE.ordered_cbgs))
+    results = draw_cbgs(PRE, origins, seed=SEED)
+    assert results.shape == origins.shape
+
+
 def test_plc_distribution_smaller_one():
     """
     Test the PLC distribution returns only probabilities between 0 and 1.
@@ -161,3 +225,108 @@ def test_plc_variance():
     g = (polylog(TAU-2, x) - polylog(TAU-1, x)) / polylog(TAU, x)
 
     assert PLC_DIST.var == g + (n/m) - (n/m) * (n/m)
+
+
+def test_plc_pmf():
+    """
+    Test the vectorised PLC pmf matches the probability distribution function.
+    """
+    k = np.arange(1, 51)
+    pmf = PLC_DIST.pmf(k)
+
+    assert pmf.dtype == np.float64
+    assert np.allclose(pmf, [float(PLC(x)) for x in k])
+
+    # zero outside the support
+    assert np.all(PLC_DIST.pmf(np.array([0, -1, 1.5])) == 0)
+
+
+def test_plc_moments_cached():
+    """
+    Test the PLC moments are computed once per (tau, kappa).
+    """
+    other = PowerLawCutoffDist(tau=TAU, kappa=KAPPA)
+    assert other.mean is PLC_DIST.mean
+    assert other.var is PLC_DIST.var
+
+
+def test_plc_sample():
+    """
+    Test PLC distribution samples follow the truncated distribution.
+    """
+    max_deg = 20
+    n = 100000
+
+    samples = PLC_DIST.sample(n, SEED, max_deg)
+    assert samples.shape == (n,)
+    assert samples.min() >= 1
+    assert samples.max() <= max_deg
+
+    p = np.array([float(PLC(x)) for x in range(1, max_deg + 1)])
+    p /= p.sum()
+
+    prop_is = np.bincount(samples, minlength=max_deg + 1)[1:] / n
+    assert np.allclose(prop_is, p, atol=0.01)
+
+
+def test_plc_sample_table_cached():
+    """
+    Test the PLC distribution tabulates the cdf only once.
+    """
+    cdf = _plc_cdf(TAU, KAPPA, 50)
+    assert _plc_cdf(TAU, KAPPA, 50) is cdf
+    assert pytest.approx(cdf[-1]) == 1
+
+
+def test_draw_cbgs_hierarchical():
+    n = 100000
+    network_data = create_network_data()
+    network_data.create_transition_matrix()
+
+    # with one group per CBG, this is the same as drawing CBGs directly
+    network_data.create_group_alias_table(lambda cbg: cbg)
+
+    results = draw_cbgs_hierarchical(network_data, 0, n, SEED)
+    assert results.shape == (n,)
+
+    prop_is = np.bincount(results, minlength=len(PRE.ordered_cbgs)) / n
+    prop_should = PRE.adjacency_list[PRE.ordered_cbgs[0]]
+
+    assert np.allclose(prop_is, prop_should, atol=0.01)
+
+
+def test_draw_cbgs_hierarchical_within_group():
+    n = 100000
+    network_data = create_network_data()
+
+    # with a single group, the CBGs are drawn proportional to their trips in
+    network_data.create_group_alias_table(lambda cbg: 'group')
+    results = draw_cbgs_hierarchical(network_data, 0, n, SEED)
+
+    # trips into each CBG (not the sum of the origins' probabilities)
+    codes = network_data.cbg_codes
+    inflow = np.zeros(len(codes))
+    for (_, destination), count in network_data.comb_counts.items():
+        inflow[codes[destination]] += count
+
+    prop_is = np.bincount(results, minlength=len(inflow)) / n
+    assert np.allclose(prop_is, inflow / inflow.sum(), atol=0.01)
+
+
+def test_draw_cbgs_hierarchical_trip_weights():
+    n = 10000
+    demographics = {cbg: {} for cbg in ['a', 'b', 'x', 'y']}
+
+    # one trip from a to x, 99 trips from b to y
+    comb_counts = {('a', 'x'): 1, ('b', 'y'): 99}
+    trip_counts = {'a': 1, 'b': 99}
+    network_data = NetworkData(demographics, comb_counts, trip_counts)
+
+    # x and y form one group, which is drawn by trips rather than origins
+    network_data.create_group_alias_table(
+        lambda cbg: 'g' if cbg in 'xy' else cbg
+    )
+    results = draw_cbgs_hierarchical(network_data, 0, n, SEED)
+
+    prop_is = np.bincount(results, minlength=4) / n
+    assert np.allclose(prop_is, [0, 0, 0.01, 0.99], atol=0.01)
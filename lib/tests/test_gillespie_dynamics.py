@@ -0,0 +1,202 @@
+import networkx as nx
+import numpy as np
+import pytest
+from epydemic import SEIR, StochasticDynamics, NetworkExperiment, Dynamics, \
+    Monitor
+
+from lib.model.compartmental_model.seir import SEIRWithQuarantine
+from lib.model.compartmental_model.seivr import SEIVR, MonitoredSEIVR
+from lib.model.dynamics.gillespie import GillespieDynamics, FenwickTree, \
+    DynamicAdjacency
+from lib.model.dynamics.common import csr_adjacency
+
+N = 300
+G = nx.fast_gnp_random_graph(N, 5 / N, seed=1)
+
+PARAMS = dict()
+PARAMS[SEIVR.P_EXPOSED] = 0.05
+PARAMS[SEIVR.P_INFECT_ASYMPTOMATIC] = 0.01
+PARAMS[SEIVR.P_INFECT_SYMPTOMATIC] = 0.03
+PARAMS[SEIVR.P_SYMPTOMS] = 0.05
+PARAMS[SEIVR.P_REMOVE] = 0.05
+PARAMS[SEIVR.P_VACCINATED_INITIAL] = 0.1
+PARAMS[SEIVR.P_VACCINATED] = 0.005
+PARAMS[SEIVR.VACCINE_RRR] = 0.75
+
+RESULTS = NetworkExperiment.RESULTS
+METADATA = NetworkExperiment.METADATA
+
+
+def test_fenwick_tree():
+    weights = np.array([3, 0, 1, 4, 0, 2])
+    tree = FenwickTree(weights)
+    assert len(tree) == 6
+    assert tree.total == 10
+
+    # each cumulative weight maps to the element it falls into
+    found = [tree.find(x) for x in range(tree.total)]
+    assert found == np.repeat(np.arange(6), weights).tolist()
+
+    tree.add(1, 2)
+    tree.add(3, -4)
+    assert tree.total == 8
+    assert tree[1] == 2 and tree[3] == 0
+    found = [tree.find(x) for x in range(tree.total)]
+    assert found == [0, 0, 0, 1, 1, 2, 5, 5]
+
+
+def test_fenwick_tree_draw():
+    weights = np.array([1, 0, 5, 2, 0, 0, 2])
+    tree = FenwickTree(weights)
+    rng = np.random.default_rng(1)
+
+    draws = np.bincount([tree.draw(rng) for _ in range(20000)],
+                        minlength=len(weights))
+    assert np.allclose(draws / 20000, weights / weights.sum(), atol=0.01)
+
+
+def test_dynamic_adjacency():
+    indptr, indices = csr_adjacency(nx.path_graph(4))
+    adjacency = DynamicAdjacency(indptr, indices)
+    assert sorted(adjacency.neighbours(1)) == [0, 2]
+
+    adjacency.remove_edge(1, 2)
+    adjacency.add_edge(1, 3)
+    assert sorted(adjacency.neighbours(1)) == [0, 3]
+    assert sorted(adjacency.neighbours(2)) == [3]
+    assert sorted(adjacency.neighbours(3)) == [1, 2]
+    assert sorted(adjacency.neighbours(0)) == [1]
+
+
+def test_gillespie_dynamics():
+    e = GillespieDynamics(SEIVR(), G, seed=1)
+    e.set(params=PARAMS)
+    rc = e.run(fatal=True)
+    assert rc[METADATA][NetworkExperiment.STATUS]
+
+    results = rc[RESULTS]
+    assert set(results) == {SEIVR.SUSCEPTIBLE, SEIVR.EXPOSED, SEIVR.INFECTED,
+                            SEIVR.VACCINATED, SEIVR.REMOVED}
+    assert sum(results.values()) == N
+
+    # the epidemic is over and the remaining susceptibles are vaccinated
+    assert results[SEIVR.EXPOSED] == 0
+    assert results[SEIVR.INFECTED] == 0
+    assert results[SEIVR.SUSCEPTIBLE] == 0
+
+    assert rc[METADATA][Dynamics.TIME] < e.max_time
+    assert rc[METADATA][Dynamics.EVENTS] > 0
+
+
+def test_gillespie_dynamics_seed():
+    results = []
+    for _ in range(2):
+        e = GillespieDynamics(SEIVR(), G, max_time=50, seed=3)
+        e.set(params=PARAMS)
+        results.append(e.run(fatal=True)[RESULTS])
+
+    assert results[0] == results[1]
+
+
+def test_gillespie_dynamics_monitor():
+    params = {**PARAMS, Monitor.DELTA: 10}
+    e = GillespieDynamics(MonitoredSEIVR(), G, max_time=100, seed=1)
+    e.set(params=params)
+    results = e.run(fatal=True)[RESULTS]
+
+    assert results[Monitor.OBSERVATIONS] == list(range(0, 101, 10))
+
+    names = [SEIVR.SUSCEPTIBLE, SEIVR.EXPOSED, SEIVR.INFECTED,
+             SEIVR.VACCINATED, SEIVR.REMOVED]
+    series = np.array([results[Monitor.timeSeriesForLocus(name)]
+                       for name in names])
+    assert np.all(series.sum(axis=0) == N)
+    assert np.all(np.diff(series[names.index(SEIVR.REMOVED)]) >= 0)
+
+
+@pytest.mark.parametrize('model', [SEIR, SEIVR, SEIRWithQuarantine])
+def test_gillespie_dynamics_matches_epydemic(model):
+    """
+    Test the final epidemic size matches epydemic's dynamics. The vaccine is
+    perfect, so the EV and IV events of `SEIVR` (which act on the exposed
+    or infected node) never fire, see
+    `test_gillespie_dynamics_vaccine_matches_epydemic`.
+    """
+    params = {model.P_EXPOSED: 0.05, model.P_INFECT_ASYMPTOMATIC: 0.01,
+              model.P_INFECT_SYMPTOMATIC: 0.03, model.P_SYMPTOMS: 0.05,
+              model.P_REMOVE: 0.05}
+    if model is SEIVR:
+        params.update({SEIVR.P_VACCINATED_INITIAL: 0.1,
+                       SEIVR.P_VACCINATED: 0.005, SEIVR.VACCINE_RRR: 1.0})
+    if model is SEIRWithQuarantine:
+        params[SEIRWithQuarantine.P_QUARANTINE] = 0.5
+
+    n = 20
+    max_time = 1000
+
+    removed_should = []
+    for _ in range(n):
+        e = StochasticDynamics(model(), G.copy())
+        e.process().setMaximumTime(max_time)
+        e.set(params=params)
+        removed_should.append(e.run(fatal=True)[RESULTS][model.REMOVED])
+
+    removed_is = []
+    e = GillespieDynamics(model(), G, max_time, seed=1)
+    e.set(params=params)
+    for _ in range(n):
+        removed_is.append(e.run(fatal=True)[RESULTS][model.REMOVED])
+
+    assert abs(np.mean(removed_is) - np.mean(removed_should)) < 0.05 * N
+
+
+class SEIVRInfectingVaccinated(SEIVR):
+    """
+    SEIVR whose EV and IV events infect the vaccinated node of the edge,
+    as `GillespieDynamics` does.
+    """
+
+    def infect_vac_asymptomatic(self, t, e):
+        self.infect_vaccinated(t, e)
+
+    def infect_vac_symptomatic(self, t, e):
+        self.infect_vaccinated(t, e)
+
+    def infect_vaccinated(self, t, e):
+        _, n = e
+        self.changeCompartment(n, self.EXPOSED)
+        self.markOccupied(e, t)
+
+
+def test_gillespie_dynamics_vaccine_matches_epydemic():
+    """
+    Test the final epidemic size with an imperfect vaccine matches
+    epydemic's dynamics if vaccinated nodes are infected, and differs from
+    `SEIVR`, where vaccinated nodes are never infected.
+    """
+    params = {**PARAMS, SEIVR.P_INFECT_ASYMPTOMATIC: 0.05,
+              SEIVR.P_INFECT_SYMPTOMATIC: 0.1, SEIVR.P_SYMPTOMS: 0.1,
+              SEIVR.P_REMOVE: 0.1, SEIVR.P_VACCINATED_INITIAL: 0.3}
+
+    n = 30
+    max_time = 1000
+
+    removed_should = {}
+    for model in [SEIVRInfectingVaccinated, SEIVR]:
+        removed_should[model] = []
+        for _ in range(n):
+            e = StochasticDynamics(model(), G.copy())
+            e.process().setMaximumTime(max_time)
+            e.set(params=params)
+            removed_should[model].append(
+                e.run(fatal=True)[RESULTS][SEIVR.REMOVED]
+            )
+
+    e = GillespieDynamics(SEIVR(), G, max_time, seed=1)
+    e.set(params=params)
+    removed_is = [e.run(fatal=True)[RESULTS][SEIVR.REMOVED]
+                  for _ in range(n)]
+
+    assert abs(np.mean(removed_is) -
+               np.mean(removed_should[SEIVRInfectingVaccinated])) < 0.03 * N
+    assert np.mean(removed_is) - np.mean(removed_should[SEIVR]) > 0.1 * N
@@ -0,0 +1,39 @@
+import numpy as np
+
+from lib.model.network.households import Households, draw_household_sizes, \
+    household_edges, household_starts
+
+MU = 3
+SEED = 1
+
+
+def test_draw_household_sizes():
+    rng = np.random.default_rng(SEED)
+
+    sizes = draw_household_sizes(MU, 1000, rng)
+
+    # stop at the first household that reaches the target
+    assert sizes.sum() >= 1000
+    assert sizes[:-1].sum() < 1000
+    assert sizes.min() >= 1
+
+    # no households for an empty CBG
+    assert len(draw_household_sizes(MU, 0, rng)) == 0
+
+
+def test_household_edges():
+    edges = household_edges(np.array([3, 1, 2]))
+
+    assert sorted(map(tuple, edges.tolist())) == [(0, 1), (0, 2), (1, 2), (4, 5)]
+
+
+def test_households_sizes():
+    sizes = np.array([2, 1, 3])
+    households = Households(
+        household=np.repeat([1, 2, 3], sizes),
+        household_size=np.repeat(sizes, sizes)
+    )
+
+    assert households.order == 6
+    assert (household_starts(households.household) == [0, 2, 3]).all()
+    assert (households.sizes == sizes).all()
@@ -0,0 +1,85 @@
+import tracemalloc
+
+import epyc
+import pytest
+
+from lib.model.network.instrumentation import StageStats, flatten_stats, \
+    add_stats_to_metadata
+
+
+def test_stage_stats():
+    recorder = StageStats()
+
+    with recorder.stage('first') as stats:
+        _ = [0] * 100000
+        stats.update(count=3)
+
+    stats = recorder.stats['first']
+    assert stats[StageStats.TIME] >= 0
+    assert stats[StageStats.PEAK_MEMORY] >= 100000 * 8
+    assert stats['count'] == 3
+
+
+def test_stage_stats_without_reset_peak(monkeypatch):
+    # as before Python 3.9, where the peak can't be reset
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+
+    recorder = StageStats()
+    tracemalloc.start()
+    try:
+        # an earlier peak far above the peak of the first stage
+        data = [0] * 1000000
+        del data
+
+        with recorder.stage('first'):
+            small = [0] * 1000
+
+        with recorder.stage('second'):
+            large = [0] * 2000000
+            del large
+    finally:
+        tracemalloc.stop()
+
+    assert 1000 * 8 <= recorder.stats['first'][StageStats.PEAK_MEMORY] < \
+        1000000 * 8
+    assert recorder.stats['second'][StageStats.PEAK_MEMORY] >= 2000000 * 8
+    assert len(small) == 1000
+
+
+def test_stage_stats_disabled():
+    recorder = StageStats(enabled=False)
+
+    with recorder.stage('first') as stats:
+        stats.update(count=3)
+
+    assert recorder.stats == {}
+
+
+def test_stage_stats_exception():
+    recorder = StageStats()
+
+    with pytest.raises(ValueError):
+        with recorder.stage('first'):
+            raise ValueError()
+
+    assert StageStats.TIME in recorder.stats['first']
+
+
+def test_flatten_stats():
+    stats = {'a': {'time': 1, 'count': 2}, 'b': {'time': 3}}
+
+    assert flatten_stats(stats, 'MN.stats') == {
+        'MN.stats.a.time': 1, 'MN.stats.a.count': 2, 'MN.stats.b.time': 3
+    }
+
+
+def test_add_stats_to_metadata():
+    stats = {'a': {'time': 1}}
+
+    class StatsExperiment(epyc.Experiment):
+        def do(self, params):
+            add_stats_to_metadata(self, stats)
+            return dict()
+
+    rc = StatsExperiment().run(fatal=True)
+    assert rc[epyc.Experiment.METADATA]['MN.stats.a.time'] == 1
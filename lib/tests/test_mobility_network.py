@@ -1,9 +1,15 @@
 from networkx import Graph
+import numpy as np
 import pytest
-from lib.model.distributions import PowerLawCutoffDist, discrete_trunc_normal
+from lib.model.distributions import PowerLawCutoffDist
 from lib.model.network.mobility_network import MobilityNetwork, \
-    MNGeneratorFromFile, MNGeneratorFromNetworkData
-from lib.tests.factory import create_network_data
+    MNGeneratorFromFile, MNGeneratorFromNetworkData, MNGeneratorFromBinary, \
+    create_mobility_network_pair
+from lib.model.network.households import household_starts
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.network.network_data import NetworkData
+from lib.tests.factory import create_network_data, create_demographics, \
+    create_counts
 
 EXPONENT = 2
 CUTOFF = 10
@@ -41,6 +47,104 @@ def test_network_create_post():
     assert isinstance(g, Graph)
 
 
+def test_network_create_empty_cbg():
+    demographics = create_demographics()
+    comb_counts, trip_counts = create_counts()
+
+    # the CBG with the highest code gets no nodes, but is still drawn as
+    #  target CBG
+    last = sorted(demographics)[-1]
+    demographics[last]['population_prop'] = 0.
+    network_data = NetworkData(demographics, comb_counts, trip_counts)
+    assert network_data.ordered_cbgs[-1] == last
+
+    network = MobilityNetwork(network_data, DEGREE_DIST, N, False, seed=1)
+    network.create()
+
+    codes = network.compact.cbg
+    assert codes.max() < len(network_data.ordered_cbgs) - 1
+    assert network.pairing_retries > 0
+
+
+def test_network_seed():
+    g1 = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    g2 = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    g1.create()
+    g2.create()
+
+    assert (g1.compact.indptr == g2.compact.indptr).all()
+    assert (g1.compact.indices == g2.compact.indices).all()
+
+
+def test_network_seed_workers():
+    g1 = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1, workers=1)
+    g2 = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1, workers=3)
+    g1.create()
+    g2.create()
+
+    # same network regardless of the number of workers
+    assert (g1.compact.household == g2.compact.household).all()
+    assert (g1.compact.indptr == g2.compact.indptr).all()
+    assert (g1.compact.indices == g2.compact.indices).all()
+
+
+def test_household_size_dist():
+    # every household has exactly the mean size of its CBG
+    def fixed(mu, size, seed):
+        return np.full(size, int(mu))
+
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False,
+                              household_size_dist=fixed)
+    households = network._create_households()
+
+    assert (households.household_size == 3).all()
+    assert (households.sizes == 3).all()
+
+
+def test_network_create_hierarchical():
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False, hierarchical=True)
+    assert hasattr(PRE, 'group_alias_prob')
+
+    network.create()
+    assert 0.9 * N <= network.g.order() <= N * 1.1
+
+    # used automatically above the threshold
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+    assert not network.hierarchical
+
+    threshold = MobilityNetwork.HIERARCHICAL_THRESHOLD
+    try:
+        MobilityNetwork.HIERARCHICAL_THRESHOLD = len(PRE.ordered_cbgs) - 1
+        network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+        assert network.hierarchical
+    finally:
+        MobilityNetwork.HIERARCHICAL_THRESHOLD = threshold
+
+
+def test_network_instrument():
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False, instrument=True)
+    network.create()
+
+    stats = network.stats
+    assert list(stats) == ['households', 'stubs', 'stub_pairs',
+                           'break_up_pairs', 'connect']
+
+    for stage in stats.values():
+        assert stage['time'] >= 0
+        assert stage['peak_memory'] >= 0
+
+    assert stats['households']['nodes'] == network.households.order
+    assert stats['stub_pairs']['retries'] == network.pairing_retries
+    assert stats['break_up_pairs']['iterations'] == \
+        network.break_up_iterations
+    assert stats['connect']['edges'] == network.compact.size
+
+    # nothing recorded by default
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+    network.create()
+    assert network.stats == {}
+
+
 def test_raises_value_error():
     with pytest.raises(ValueError):
         _ = MobilityNetwork(PRE, DEGREE_DIST, N, True)
@@ -54,14 +158,17 @@ def test_create_households():
     households = network._create_households()
 
     # number of nodes
-    assert len(network.g.nodes) < N * 1.1
+    assert households.order < N * 1.1
+
+    # the graph is only built at the end
+    assert network.g.order() == 0
+
+    starts = household_starts(households.household)
+    cbgs = households.cbg_labels[households.cbg[starts]]
 
     num_exceeds_std = 0
-    for household in households:
+    for size_is, cbg in zip(households.sizes, cbgs):
 
-        nodes = list(household.nodes)
-        cbg = network.g.nodes[nodes[0]]['cbg']
-        size_is = household.order()
         size_should = PRE.demographics[cbg]['household_size']
 
         if abs(size_is - size_should) > size_should / 2:
@@ -69,7 +176,42 @@ def test_create_households():
 
     # normal distribution should exceed std in only 32% of cases, ... but
     #  with some levy it is allowed in 45% of cases
-    assert num_exceeds_std < 0.45 * len(households)
+    assert num_exceeds_std < 0.45 * len(starts)
+
+
+def test_household_edges():
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+    households = network._create_households()
+
+    edges = households.edges
+
+    # complete graph per household
+    sizes = households.sizes
+    assert len(edges) == (sizes * (sizes - 1) // 2).sum()
+
+    # no edges between households
+    h = households.household
+    assert (h[edges[:, 0]] == h[edges[:, 1]]).all()
+
+    # materialised graph carries the household attributes
+    network._connect_stubs([])
+    u, v = edges[0]
+    assert network.g.edges[u, v]['household'] == h[u]
+    cbg = households.cbg_labels[households.cbg[u]]
+    assert network.g.nodes[u]['cbg'] == cbg
+
+
+def test_households_cbg_codes():
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+    households = network._create_households()
+
+    assert households.cbg.dtype == np.int32
+    assert list(households.cbg_labels) == PRE.ordered_cbgs
+
+    # nodes per CBG proportional to the population
+    counts = np.bincount(households.cbg, minlength=len(PRE.ordered_cbgs))
+    expected = PRE.demographics_array('population_prop') * N
+    assert (counts >= expected.astype(int)).all()
 
 
 def test_create_stubs():
@@ -78,7 +220,7 @@ def test_create_stubs():
     households = network._create_households()
 
     # test
-    stubs, cbg_degree_map = network._create_stubs(households)
+    stubs, stub_cbgs = network._create_stubs(households)
 
     # number of stubs
     assert len(stubs) % 2 == 0
@@ -87,10 +229,10 @@ def test_create_stubs():
 def test_create_stub_pairs():
     network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
     households = network._create_households()
-    stubs, cbg_degree_map = network._create_stubs(households)
+    stubs, stub_cbgs = network._create_stubs(households)
 
     # test
-    stubs = network._create_stub_pairs(stubs, cbg_degree_map)
+    stubs = network._create_stub_pairs(stubs, stub_cbgs)
 
     assert len(stubs) % 2 == 0
 
@@ -99,15 +241,16 @@ def test_break_up_pairs():
     # setup
     network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
     households = network._create_households()
-    stubs, cbg_degree_map = network._create_stubs(households)
-    stubs = network._create_stub_pairs(stubs, cbg_degree_map)
+    stubs, stub_cbgs = network._create_stubs(households)
+    stubs = network._create_stub_pairs(stubs, stub_cbgs)
 
     # test
-    network._break_up_pairs(stubs)
+    stubs = network._break_up_pairs(stubs)
 
+    household = network.households.household
     for i in range(0, len(stubs), 2):
-        h1 = network.g.nodes[stubs[i]]['household']
-        h2 = network.g.nodes[stubs[i + 1]]['household']
+        h1 = household[stubs[i]]
+        h2 = household[stubs[i + 1]]
         assert h1 != h2
 
 
@@ -115,8 +258,8 @@ def test_connect_stubs():
     # setup
     network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
     households = network._create_households()
-    stubs, cbg_degree_map = network._create_stubs(households)
-    stubs = network._create_stub_pairs(stubs, cbg_degree_map)
+    stubs, stub_cbgs = network._create_stubs(households)
+    stubs = network._create_stub_pairs(stubs, stub_cbgs)
     stubs = network._break_up_pairs(stubs)
 
     # test
@@ -126,6 +269,156 @@ def test_connect_stubs():
         assert (stubs[i], stubs[i+1]) in network.g.edges
 
 
+def test_create_mobility_network_pair():
+    pre, post = create_mobility_network_pair(PRE, POST, DEGREE_DIST, N, seed=1)
+
+    # same household layer
+    assert pre.households is post.households
+    assert (pre.compact.household == post.compact.household).all()
+    assert (pre.compact.cbg == post.compact.cbg).all()
+
+    # post trips are halved, so there are fewer outside edges
+    assert post.compact.size < pre.compact.size
+
+    # reproducible
+    pre2, post2 = create_mobility_network_pair(
+        PRE, POST, DEGREE_DIST, N, seed=1
+    )
+    assert (pre.compact.indices == pre2.compact.indices).all()
+    assert (post.compact.indices == post2.compact.indices).all()
+
+
+def test_create_with_households_raises_value_error():
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+    households = network._create_households()
+    households.cbg_labels = households.cbg_labels[::-1]
+
+    with pytest.raises(ValueError):
+        MobilityNetwork(PRE, DEGREE_DIST, N, False).create(households)
+
+
+def test_rewire():
+    pre = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    pre.create()
+    post = pre.rewire(POST, seed=2)
+
+    # same household layer and household edges
+    assert post.households is pre.households
+    household = pre.compact.household
+
+    def split(edges):
+        intra = household[edges[:, 0]] == household[edges[:, 1]]
+        return set(map(tuple, edges[intra])), set(map(tuple, edges[~intra]))
+
+    intra_pre, inter_pre = split(pre.compact.edges)
+    intra_post, inter_post = split(post.compact.edges)
+    assert intra_pre == intra_post
+
+    # trips are halved, so edges are removed
+    assert len(inter_post) < len(inter_pre)
+    assert len(inter_pre & inter_post) > 0
+
+
+def test_rewire_unchanged():
+    pre = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    pre.create()
+
+    # without a change in mobility, no edge is touched
+    change = {cbg: 1 for cbg in PRE.ordered_cbgs}
+    post = pre.rewire(POST, trip_count_change=change, seed=2)
+
+    assert (post.compact.indptr == pre.compact.indptr).all()
+    assert (post.compact.indices == pre.compact.indices).all()
+
+
+def test_rewire_single_cbg():
+    pre = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    pre.create()
+
+    # only the trips of the CBG with the lowest code change, so only its
+    #  stubs (and their orphaned partners) are paired again
+    cbg = PRE.ordered_cbgs[0]
+    post = pre.rewire(POST, trip_count_change={cbg: 0.5}, seed=2)
+
+    def inter_degree(compact):
+        edges = compact.edges
+        household = compact.household
+        inter = edges[household[edges[:, 0]] != household[edges[:, 1]]]
+        return np.bincount(inter.ravel(), minlength=compact.order)
+
+    changed = pre.compact.cbg == 0
+    degree_pre = inter_degree(pre.compact)
+    degree_post = inter_degree(post.compact)
+
+    assert degree_post[changed].sum() < degree_pre[changed].sum()
+    assert np.mean(degree_post[~changed] == degree_pre[~changed]) > 0.95
+
+
+def test_rewire_raises_value_error():
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False)
+
+    with pytest.raises(ValueError):
+        network.rewire(POST)
+
+    network.create()
+
+    with pytest.raises(ValueError):
+        network.rewire(PRE)
+
+
+def test_create_to_file(tmp_path):
+    file = str(tmp_path / 'network.npz')
+
+    network = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    g = network.create_to_file(file, chunk_size=100)
+    assert isinstance(g, CompactGraph)
+    assert g.order == network.households.order
+
+    # same household layer as created in memory
+    in_memory = MobilityNetwork(PRE, DEGREE_DIST, N, False, seed=1)
+    in_memory.create()
+    assert (g.household == in_memory.compact.household).all()
+    assert (g.cbg == in_memory.compact.cbg).all()
+
+    # household edges and no intra-household stub pairs
+    household = g.household
+    edges = g.edges
+    intra = household[edges[:, 0]] == household[edges[:, 1]]
+    sizes = network.households.sizes
+    assert intra.sum() == (sizes * (sizes - 1) // 2).sum()
+    assert (~intra).sum() > 0
+
+    # can be loaded by the binary generator
+    params = {MNGeneratorFromBinary.PATH: file,
+              MNGeneratorFromBinary.COMPACT: True}
+    loaded = MNGeneratorFromBinary(params=params).generate()
+    assert (loaded.indices == g.indices).all()
+
+
+def test_create_to_file_buckets_without_cbg(tmp_path):
+    file = str(tmp_path / 'network.npz')
+
+    # few nodes in the CBG with the highest code, so most buckets have no
+    #  stubs of it, but it is still drawn as target CBG
+    demographics = create_demographics()
+    comb_counts, trip_counts = create_counts()
+    last = sorted(demographics)[-1]
+    demographics[last]['population_prop'] = 3 / N
+    network_data = NetworkData(demographics, comb_counts, trip_counts)
+
+    chunk_size = 10
+    network = MobilityNetwork(network_data, DEGREE_DIST, N, False, seed=1)
+    g = network.create_to_file(file, chunk_size=chunk_size)
+
+    edges = g.edges
+    inter = edges[g.household[edges[:, 0]] != g.household[edges[:, 1]]]
+    degree = np.bincount(inter.ravel(), minlength=g.order)
+
+    code = len(network_data.ordered_cbgs) - 1
+    assert 0 < (g.cbg == code).sum()
+    assert degree[g.cbg == code].sum() < degree.sum() / chunk_size / 2
+
+
 def test_mobility_network_generator_from_network_data():
     params = {
         MNGeneratorFromNetworkData.NETWORK_DATA: PRE,
@@ -139,6 +432,22 @@ def test_mobility_network_generator_from_network_data():
     g = mng.generate()
     assert isinstance(g, Graph)
 
+    params[MNGeneratorFromNetworkData.COMPACT] = True
+    mng = MNGeneratorFromNetworkData(params=params)
+    g = mng.generate()
+    assert isinstance(g, CompactGraph)
+    assert mng.stats == {}
+
+    params[MNGeneratorFromNetworkData.INSTRUMENT] = True
+    mng = MNGeneratorFromNetworkData(params=params)
+    mng.generate()
+    assert 'connect' in mng.stats
+
+    # the degree distribution is reused across generations
+    degree_dist = mng._degree_dist
+    mng.generate()
+    assert mng._degree_dist is degree_dist
+
 
 def test_mobility_network_generator_from_graph(network_graph_file):
     params = {
@@ -148,3 +457,29 @@ def test_mobility_network_generator_from_graph(network_graph_file):
     mng = MNGeneratorFromFile(params=params)
     g = mng.generate()
     assert isinstance(g, Graph)
+
+
+def test_mobility_network_generator_from_binary(network_graph_file,
+                                                network_binary_file):
+    params = {
+        MNGeneratorFromBinary.PATH: str(network_binary_file),
+    }
+
+    mng = MNGeneratorFromBinary(params=params)
+    g = mng.generate()
+    assert isinstance(g, Graph)
+
+    # same network as the GraphML file
+    params = {
+        MNGeneratorFromFile.PATH: str(network_graph_file),
+    }
+    g_graphml = MNGeneratorFromFile(params=params).generate()
+    assert g.order() == g_graphml.order()
+    assert g.size() == g_graphml.size()
+
+    params = {
+        MNGeneratorFromBinary.PATH: str(network_binary_file),
+        MNGeneratorFromBinary.COMPACT: True,
+    }
+    g = MNGeneratorFromBinary(params=params).generate()
+    assert isinstance(g, CompactGraph)
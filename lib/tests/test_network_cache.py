@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+
+from lib.model.network.network_cache import NetworkCache
+from lib.model.network.mobility_network import MNGeneratorFromNetworkData
+from lib.tests.factory import create_network_data
+from lib.tests.test_compact_graph import create_compact_graph
+
+PRE = create_network_data()
+PRE.create_adjacency_list()
+
+PARAMS = dict(n=1000, exponent=2.0, cutoff=10.0, multiplier=False)
+
+
+def test_key():
+    key = NetworkCache.key(PRE, PARAMS, 1)
+
+    # same content, same key
+    assert NetworkCache.key(create_network_data(), PARAMS, 1) == key
+
+    # different data, params or seed
+    assert NetworkCache.key(create_network_data(True), PARAMS, 1) != key
+    assert NetworkCache.key(PRE, dict(PARAMS, n=2000), 1) != key
+    assert NetworkCache.key(PRE, PARAMS, 2) != key
+
+
+def test_get_put(tmpdir):
+    cache = NetworkCache(str(tmpdir))
+    g = create_compact_graph()
+
+    assert cache.get('a') is None
+    cache.put('a', g)
+    assert 'a' in cache
+
+    cached = cache.get('a')
+    assert (cached.indptr == g.indptr).all()
+    assert (cached.indices == g.indices).all()
+    assert (cached.cbg_labels == g.cbg_labels).all()
+
+
+def test_evict_least_recently_used(tmpdir):
+    g = create_compact_graph()
+
+    cache = NetworkCache(str(tmpdir))
+    cache.put('a', g)
+    size = cache.size
+
+    # room for two networks
+    cache.max_bytes = 2 * size
+    cache.put('b', g)
+
+    # use `a` so that `b` is the least recently used network
+    os.utime(os.path.join(str(tmpdir), 'b.npz'), (0, 0))
+    cache.get('a')
+
+    cache.put('c', g)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.size <= cache.max_bytes
+
+
+def test_generator_uses_cache(tmpdir):
+    cache = NetworkCache(str(tmpdir))
+
+    params = {
+        MNGeneratorFromNetworkData.NETWORK_DATA: PRE,
+        MNGeneratorFromNetworkData.N: 1000,
+        MNGeneratorFromNetworkData.EXPONENT: 2,
+        MNGeneratorFromNetworkData.CUTOFF: 10,
+        MNGeneratorFromNetworkData.MULTIPLIER: False,
+        MNGeneratorFromNetworkData.SEED: 1,
+        MNGeneratorFromNetworkData.ENSEMBLE: 2,
+        MNGeneratorFromNetworkData.COMPACT: True,
+    }
+
+    mng = MNGeneratorFromNetworkData(params=params, cache=cache)
+    g1, g2, g3 = mng.generate(), mng.generate(), mng.generate()
+
+    # two distinct networks, the third one is the first one again
+    assert len(os.listdir(str(tmpdir))) == 2
+    assert not np.array_equal(g1.indices, g2.indices)
+    assert np.array_equal(g1.indices, g3.indices)
+
+    # a new generator is served from the cache
+    mng = MNGeneratorFromNetworkData(params=params, cache=cache)
+    assert np.array_equal(mng.generate().indices, g1.indices)
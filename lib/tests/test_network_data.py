@@ -1,5 +1,8 @@
+import numpy as np
 import pytest
 from lib.tests.factory import *
+from lib.experiments.utils.network_data_utils import make_network_data
+from lib.model.network.network_data import county
 
 
 def test_create_network_data_instance():
@@ -36,6 +39,156 @@ def test_create_cum_prob_requires_adjacency_list():
         network_data.create_cum_prob()
 
 
+def test_dense_views_lazy():
+    network_data = create_network_data()
+
+    # without transition matrix there are no dense views
+    with pytest.raises(AttributeError):
+        network_data.cum_prob
+
+    network_data.create_transition_matrix()
+    for name in NetworkData.DENSE_FIELDS:
+        assert name not in vars(network_data)
+
+    # built on first access
+    should = create_network_data()
+    should.create_adjacency_list()
+    should.create_cum_prob()
+
+    cbg = network_data.ordered_cbgs[0]
+    assert np.allclose(network_data.cum_prob[cbg], should.cum_prob[cbg])
+    assert network_data.adjacency_list == should.adjacency_list
+
+
+def test_make_network_data_dense_views_lazy():
+    comb_pre, trip_pre = create_counts()
+    comb_post, trip_post = create_counts(post=True)
+    network_data = make_network_data(create_demographics(), comb_pre,
+                                     comb_post, trip_pre, trip_post)
+
+    for data in network_data.values():
+        assert hasattr(data, 'transition')
+        assert hasattr(data, 'alias_prob')
+        for name in NetworkData.DENSE_FIELDS:
+            assert name not in vars(data)
+
+
+def test_create_transition_matrix():
+    network_data = create_network_data()
+    network_data.create_transition_matrix()
+
+    n = len(network_data.ordered_cbgs)
+    transition = network_data.transition
+    assert transition.shape == (n, n)
+
+    # same probabilities as computed from the trip counts
+    comb_counts, trip_counts = create_counts()
+    for (i, j), count in comb_counts.items():
+        p = transition[network_data.cbg_codes[i], network_data.cbg_codes[j]]
+        assert pytest.approx(p) == count / trip_counts[i]
+
+    # row-wise cumulative probabilities
+    end = transition.indptr[1:] - 1
+    assert np.allclose(network_data.transition_cum[end],
+                       np.asarray(transition.sum(axis=1)).ravel())
+
+
+def test_create_transition_matrix_unknown_cbgs():
+    demographics = create_demographics()
+    comb_counts, trip_counts = create_counts()
+
+    # trips to a CBG without demographics and from a CBG without trip counts
+    comb_counts[('cbg1', 'unknown')] = 5
+    del trip_counts['cbg2']
+
+    network_data = NetworkData(demographics, comb_counts, trip_counts)
+    network_data.create_transition_matrix()
+
+    assert network_data.transition.shape == (10, 10)
+    assert network_data.transition.getrow(
+        network_data.cbg_codes['cbg2']).nnz == 0
+
+
+def test_create_alias_table():
+    network_data = create_network_data()
+    network_data.create_transition_matrix()
+    network_data.create_alias_table()
+
+    nnz = network_data.transition.nnz
+    assert network_data.alias_prob.shape == (nnz,)
+    assert network_data.alias_idx.shape == (nnz,)
+    assert (network_data.alias_prob <= 1).all()
+
+
+def test_create_alias_table_requires_transition_matrix():
+    network_data = create_network_data()
+
+    with pytest.raises(AttributeError):
+        network_data.create_alias_table()
+
+
+def test_create_group_alias_table():
+    network_data = create_network_data()
+    network_data.create_group_alias_table(lambda cbg: cbg[-1])
+
+    n = len(network_data.ordered_cbgs)
+    n_groups = len(network_data.groups)
+    assert n_groups == 10
+    assert network_data.cbg_groups.shape == (n,)
+    assert network_data.group_transition.shape == (n, n_groups)
+
+    # probabilities to the groups sum to one
+    assert np.allclose(network_data.group_transition.sum(axis=1), 1)
+
+    # every CBG is in exactly one group
+    assert sorted(network_data.group_members) == list(range(n))
+    assert network_data.group_indptr[-1] == n
+
+    nnz = network_data.group_transition.nnz
+    assert network_data.group_alias_prob.shape == (nnz,)
+    assert network_data.member_alias_prob.shape == (n,)
+
+
+def test_county():
+    assert county('060750201001') == '06075'
+
+
+def test_demographics_array():
+    network_data = create_network_data()
+    household_size = network_data.demographics_array('household_size')
+
+    assert household_size.shape == (len(network_data.ordered_cbgs),)
+    for i, cbg in enumerate(network_data.ordered_cbgs):
+        assert household_size[i] == \
+            network_data.demographics[cbg]['household_size']
+
+
+def test_trip_count_change_array():
+    pre = create_network_data()
+    post = create_network_data(post=True)
+
+    with pytest.raises(AttributeError):
+        post.trip_count_change_array()
+
+    post.calc_trip_count_change(pre)
+    change = post.trip_count_change_array()
+
+    for i, cbg in enumerate(post.ordered_cbgs):
+        assert change[i] == post.trip_count_change[cbg]
+
+
+def test_codes():
+    network_data = create_network_data()
+    cbgs = network_data.ordered_cbgs
+
+    codes = network_data.codes([cbgs[2], 'unknown', cbgs[0]])
+    assert codes.dtype == np.int32
+    assert codes.tolist() == [2, -1, 0]
+
+    values = network_data.cbg_array({cbgs[1]: 0.5, 'unknown': 2.}, 1)
+    assert values.tolist() == [1.] + [0.5] + [1.] * (len(cbgs) - 2)
+
+
 def test_calc_trip_count_change():
     pre = create_network_data()
     post = create_network_data(True)
@@ -45,3 +198,85 @@ def test_calc_trip_count_change():
 
     for k, v in trip_count_change.items():
         assert pytest.approx(v, 0.1) == 0.5
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_load(tmp_path, mmap):
+    pre = create_network_data()
+    post = create_network_data(post=True)
+    post.calc_trip_count_change(pre)
+    post.create_transition_matrix()
+    post.create_alias_table()
+    post.create_group_alias_table()
+
+    file = str(tmp_path / 'post.npz')
+    post.save(file)
+    loaded = NetworkData.load(file, mmap=mmap)
+
+    assert loaded.demographics == post.demographics
+    assert loaded.comb_counts == post.comb_counts
+    assert loaded.trip_counts == post.trip_counts
+    assert loaded.trip_count_change == post.trip_count_change
+    assert loaded.ordered_cbgs == post.ordered_cbgs
+    assert loaded.digest() == post.digest()
+
+    assert (loaded.transition != post.transition).nnz == 0
+    assert np.array_equal(loaded.transition_cum, post.transition_cum)
+    assert np.array_equal(loaded.alias_prob, post.alias_prob)
+    assert np.array_equal(loaded.alias_idx, post.alias_idx)
+
+    assert (loaded.group_transition != post.group_transition).nnz == 0
+    assert np.array_equal(loaded.groups, post.groups)
+    assert np.array_equal(loaded.member_alias_idx, post.member_alias_idx)
+
+
+def test_load_lazy(tmp_path):
+    pre = create_network_data()
+    post = create_network_data(post=True)
+    post.calc_trip_count_change(pre)
+
+    file = str(tmp_path / 'post.npz')
+    post.save(file)
+    loaded = NetworkData.load(file)
+
+    # loading doesn't build the dictionaries ...
+    for name in NetworkData.LAZY_FIELDS:
+        assert name not in vars(loaded)
+
+    # ... which aren't needed for the arrays and the transition matrix
+    for name in ['population_prop', 'household_size']:
+        assert np.array_equal(loaded.demographics_array(name),
+                              post.demographics_array(name))
+    assert np.array_equal(loaded.trip_count_change_array(),
+                          post.trip_count_change_array())
+
+    loaded.create_transition_matrix()
+    post.create_transition_matrix()
+    assert (loaded.transition != post.transition).nnz == 0
+
+    for name in NetworkData.LAZY_FIELDS:
+        assert name not in vars(loaded)
+
+    # legacy callers get the dictionaries on first access
+    assert loaded.comb_counts == post.comb_counts
+    assert 'comb_counts' in vars(loaded)
+
+
+def test_save_load_without_transition_matrix(tmp_path):
+    network_data = create_network_data()
+
+    file = str(tmp_path / 'pre.npz')
+    network_data.save(file)
+    loaded = NetworkData.load(file)
+
+    assert loaded.digest() == network_data.digest()
+    assert not hasattr(loaded, 'transition')
+    assert not hasattr(loaded, 'trip_count_change')
+
+
+def test_load_unsupported_version(tmp_path):
+    file = str(tmp_path / 'pre.npz')
+    np.savez(file, version=np.array(NetworkData.FORMAT_VERSION + 1))
+
+    with pytest.raises(ValueError):
+        NetworkData.load(file)
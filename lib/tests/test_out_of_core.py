@@ -0,0 +1,49 @@
+import numpy as np
+
+from lib.model.network.compact_graph import CompactGraph
+from lib.model.network.out_of_core import ArrayFile, group_counts, write_csr
+
+
+def test_array_file(tmp_path):
+    f = ArrayFile(str(tmp_path / 'edges'), np.int32, (2,))
+    assert len(f) == 0
+    assert f.array().shape == (0, 2)
+
+    f.append(np.array([[0, 1], [1, 2]]))
+    f.append(np.array([[2, 3]]))
+
+    assert len(f) == 3
+    assert f.array().dtype == np.int32
+    assert f.array().tolist() == [[0, 1], [1, 2], [2, 3]]
+
+    chunks = list(f.chunks(2))
+    assert [len(c) for c in chunks] == [2, 1]
+
+
+def test_group_counts():
+    values, counts = group_counts(np.array([3, 1, 3, 3, 0]))
+    assert values.tolist() == [0, 1, 3]
+    assert counts.tolist() == [1, 1, 3]
+
+    values, counts = group_counts(np.zeros(0, dtype=np.int64))
+    assert len(values) == len(counts) == 0
+
+
+def test_write_csr(tmp_path):
+    rng = np.random.default_rng(1)
+    n = 100
+
+    # random edges with duplicates, without self-loops
+    edges = rng.integers(n, size=(1000, 2))
+    edges = edges[edges[:, 0] != edges[:, 1]]
+
+    f = ArrayFile(str(tmp_path / 'edges'), np.int32, (2,))
+    for chunk in np.array_split(edges, 7):
+        f.append(chunk)
+
+    indptr, indices = write_csr(f, n, str(tmp_path), chunk_size=50)
+
+    # same adjacency as built in memory
+    g = CompactGraph.from_edges(edges, np.arange(n), np.ones(n))
+    assert (indptr == g.indptr).all()
+    assert (indices == g.indices).all()
@@ -0,0 +1,104 @@
+import networkx as nx
+import numpy as np
+import pytest
+from epydemic import SEIR, NetworkExperiment
+
+from lib.experiments.utils.percolation_sweep import epidemic_size_per_param
+from lib.model.compartmental_model.seir import SEIRWithQuarantine
+from lib.model.compartmental_model.seivr import SEIVR
+from lib.model.dynamics.common import Rates, csr_adjacency
+from lib.model.dynamics.gillespie import GillespieDynamics
+from lib.model.dynamics.percolation import BondPercolation, \
+    percolation_final_sizes, transmissibility
+
+N = 300
+G = nx.fast_gnp_random_graph(N, 5 / N, seed=1)
+
+PARAMS = dict()
+PARAMS[SEIR.P_EXPOSED] = 0.01
+PARAMS[SEIR.P_INFECT_ASYMPTOMATIC] = 0.01
+PARAMS[SEIR.P_INFECT_SYMPTOMATIC] = 0.03
+PARAMS[SEIR.P_SYMPTOMS] = 0.1
+PARAMS[SEIR.P_REMOVE] = 0.1
+
+
+def test_transmissibility():
+    rates = Rates.from_params(SEIR, PARAMS)
+    assert transmissibility(rates) == pytest.approx(
+        1 - 0.1 / 0.11 * 0.1 / 0.13
+    )
+
+    rates.p_infect_a = rates.p_infect_s = 0
+    assert transmissibility(rates) == 0
+
+
+def test_percolation_final_sizes():
+    # two components: a path of 5 nodes and a path of 3 nodes
+    g = nx.disjoint_union(nx.path_graph(5), nx.path_graph(3))
+    indptr, indices = csr_adjacency(g)
+    rng = np.random.default_rng(1)
+
+    seeds = np.zeros(8, dtype=bool)
+    seeds[0] = True
+    sizes = percolation_final_sizes(indptr, indices, [1., 0., 0.5], seeds,
+                                    rng)
+    assert sizes[0] == 5
+    assert sizes[1] == 1
+    assert 1 <= sizes[2] <= 5
+
+    seeds[7] = True
+    assert percolation_final_sizes(indptr, indices, [1.], seeds,
+                                   rng).tolist() == [8]
+
+    # the final size grows with the transmissibility
+    indptr, indices = csr_adjacency(G)
+    seeds = rng.random(N) < 0.01
+    sizes = percolation_final_sizes(indptr, indices, np.linspace(0, 1, 11),
+                                    seeds, rng)
+    assert np.all(np.diff(sizes) >= 0)
+    assert sizes[0] == seeds.sum()
+
+
+def test_bond_percolation_matches_gillespie():
+    """
+    Test the final sizes match the simulated dynamics. A larger network is
+    used, since small networks deviate close to the epidemic threshold.
+    """
+    n = 1000
+    g = nx.fast_gnp_random_graph(n, 5 / n, seed=1)
+    values = [0.01, 0.03, 0.08]
+    rates = [Rates.from_params(SEIR, {**PARAMS,
+                                      SEIR.P_INFECT_SYMPTOMATIC: value})
+             for value in values]
+
+    sizes = BondPercolation(SEIR(), g, seed=1).final_sizes(rates, 100)
+    assert sizes.shape == (100, len(values))
+
+    e = GillespieDynamics(SEIR(), g, seed=1)
+    for value, size in zip(values, sizes.mean(axis=0)):
+        e.set(params={**PARAMS, SEIR.P_INFECT_SYMPTOMATIC: value})
+        results = [e.run(fatal=True)[NetworkExperiment.RESULTS]
+                   for _ in range(40)]
+        size_should = np.mean([r[SEIR.REMOVED] + r[SEIR.EXPOSED]
+                               for r in results]) / n
+        assert abs(size - size_should) < 0.05
+
+
+def test_bond_percolation_models():
+    for model in [SEIRWithQuarantine(), SEIVR()]:
+        with pytest.raises(ValueError):
+            BondPercolation(model, G)
+
+
+def test_epidemic_size_per_param():
+    values = [0.03, 0.01, 0.02]
+    df = epidemic_size_per_param(G, PARAMS, SEIR.P_INFECT_SYMPTOMATIC,
+                                 values, repetitions=4, column='param',
+                                 seed=1)
+
+    assert list(df.columns) == ['param', 'epidemic_size']
+    assert len(df) == 4 * len(values)
+
+    # ordered by experiment and parameter
+    assert df['param'].tolist() == [0.01, 0.02, 0.03] * 4
+    assert np.all((df['epidemic_size'] >= 0) & (df['epidemic_size'] <= 1))
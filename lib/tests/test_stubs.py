@@ -0,0 +1,119 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from lib.model.network.stubs import pair_stubs, break_up_pairs
+
+SEED = 1
+
+
+def test_pair_stubs_permutation():
+    rng = np.random.default_rng(SEED)
+    stubs = np.repeat(np.arange(100), 3)[:-2]
+    groups = stubs % 4
+
+    def draw_targets(origins):
+        return rng.integers(4, size=len(origins))
+
+    paired, _ = pair_stubs(stubs, groups, 4, draw_targets, rng)
+
+    # same stubs, different order
+    assert len(paired) == len(stubs)
+    assert (np.sort(paired) == np.sort(stubs)).all()
+
+
+def test_pair_stubs_targets():
+    rng = np.random.default_rng(SEED)
+    stubs = np.arange(1000)
+    groups = stubs % 2
+
+    # stubs of group 0 want to pair with group 1 and vice versa
+    def draw_targets(origins):
+        return 1 - origins
+
+    paired, retries = pair_stubs(stubs, groups, 2, draw_targets, rng)
+
+    pairs = paired.reshape(-1, 2) % 2
+    assert (pairs[:, 0] != pairs[:, 1]).all()
+    assert retries == 0
+
+
+def test_pair_stubs_retries():
+    rng = np.random.default_rng(SEED)
+    stubs = np.arange(10)
+    groups = np.array([0] * 8 + [1] * 2)
+
+    # all stubs want group 1, which runs out of stubs
+    def draw_targets(origins):
+        return np.ones(len(origins), dtype=np.int64)
+
+    paired, retries = pair_stubs(stubs, groups, 2, draw_targets, rng,
+                                 max_retries=5)
+
+    assert (np.sort(paired) == stubs).all()
+    assert retries > 0
+
+
+def test_pair_stubs_groups_without_stubs():
+    rng = np.random.default_rng(SEED)
+    stubs = np.arange(10)
+    groups = stubs % 2
+
+    # targets include groups 2 and 3, which have no stubs
+    def draw_targets(origins):
+        return rng.integers(4, size=len(origins))
+
+    paired, retries = pair_stubs(stubs, groups, 4, draw_targets, rng)
+
+    assert (np.sort(paired) == stubs).all()
+    assert retries > 0
+
+    with pytest.raises(ValueError):
+        pair_stubs(stubs, groups, 1, draw_targets, rng)
+
+
+def test_break_up_pairs():
+    rng = np.random.default_rng(SEED)
+    household = np.repeat(np.arange(50), 4)
+
+    # every pair starts out within one household
+    stubs = np.arange(200)
+    stubs, iterations = break_up_pairs(stubs, household, rng)
+
+    assert len(stubs) == 200
+    assert iterations >= 50
+    pairs = household[stubs].reshape(-1, 2)
+    assert (pairs[:, 0] != pairs[:, 1]).all()
+
+
+def test_break_up_pairs_bounded():
+    rng = np.random.default_rng(SEED)
+    household = np.array([1, 1, 1, 2])
+
+    # the pair (0, 1) can't be broken up without a conflict elsewhere
+    stubs = np.array([0, 1, 2, 2, 1, 3])
+    with pytest.warns(RuntimeWarning):
+        stubs, iterations = break_up_pairs(stubs, household, rng,
+                                           max_iterations=10)
+
+    assert iterations <= 10
+    pairs = household[stubs].reshape(-1, 2)
+    assert (pairs[:, 0] != pairs[:, 1]).all()
+
+
+def test_break_up_pairs_budget():
+    rng = np.random.default_rng(SEED)
+    household = np.repeat(np.arange(50), 4)
+    stubs = np.arange(200)
+
+    # a tiny budget leaves conflicts, which are dropped with a warning
+    with pytest.warns(RuntimeWarning, match='degree sequence'):
+        dropped, _ = break_up_pairs(stubs, household, rng, max_iterations=5)
+    assert len(dropped) < len(stubs)
+
+    # the default budget keeps the degree sequence
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        kept, _ = break_up_pairs(stubs, household, rng)
+    assert (np.sort(kept) == stubs).all()
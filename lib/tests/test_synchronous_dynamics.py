@@ -0,0 +1,175 @@
+import networkx as nx
+import numpy as np
+import pytest
+from epydemic import SEIR, SynchronousDynamics, NetworkExperiment, Dynamics
+
+from lib.model.compartmental_model.seivr import SEIVR
+from lib.model.dynamics.common import Rates, EXPOSED, VACCINATED, \
+    csr_adjacency, neighbours
+from lib.model.dynamics.synchronous import VectorisedSynchronousDynamics, \
+    synchronous_step
+from lib.model.network.compact_graph import CompactGraph
+
+N = 300
+G = nx.fast_gnp_random_graph(N, 5 / N, seed=1)
+
+PARAMS = dict()
+PARAMS[SEIVR.P_EXPOSED] = 0.05
+PARAMS[SEIVR.P_INFECT_ASYMPTOMATIC] = 0.01
+PARAMS[SEIVR.P_INFECT_SYMPTOMATIC] = 0.03
+PARAMS[SEIVR.P_SYMPTOMS] = 0.05
+PARAMS[SEIVR.P_REMOVE] = 0.05
+PARAMS[SEIVR.P_VACCINATED_INITIAL] = 0.0
+PARAMS[SEIVR.P_VACCINATED] = 0.005
+PARAMS[SEIVR.VACCINE_RRR] = 0.75
+
+RESULTS = NetworkExperiment.RESULTS
+
+
+def test_vectorised_synchronous_dynamics():
+    e = VectorisedSynchronousDynamics(SEIVR(), G, seed=1)
+    e.set(params=PARAMS)
+    rc = e.run(fatal=True)
+    assert rc[NetworkExperiment.METADATA][NetworkExperiment.STATUS]
+
+    results = rc[RESULTS]
+    assert set(results) == {SEIVR.SUSCEPTIBLE, SEIVR.EXPOSED, SEIVR.INFECTED,
+                            SEIVR.VACCINATED, SEIVR.REMOVED}
+    assert sum(results.values()) == N
+
+    # the epidemic is over and the remaining susceptibles are vaccinated
+    assert results[SEIVR.EXPOSED] == 0
+    assert results[SEIVR.INFECTED] == 0
+    assert results[SEIVR.SUSCEPTIBLE] == 0
+    assert results[SEIVR.VACCINATED] > 0
+
+    metadata = rc[NetworkExperiment.METADATA]
+    assert metadata[Dynamics.TIME] == VectorisedSynchronousDynamics(
+        SEIVR()).max_time
+    assert metadata[Dynamics.EVENTS] >= N - results[SEIVR.SUSCEPTIBLE]
+
+
+def test_vectorised_synchronous_dynamics_seir():
+    params = {SEIR.P_EXPOSED: 0.05, SEIR.P_INFECT_ASYMPTOMATIC: 0.01,
+              SEIR.P_INFECT_SYMPTOMATIC: 0.03, SEIR.P_SYMPTOMS: 0.05,
+              SEIR.P_REMOVE: 0.05}
+
+    e = VectorisedSynchronousDynamics(SEIR(), CompactGraph.from_edges(
+        np.array(G.edges), np.ones(N), np.ones(N)
+    ), max_time=100, seed=1)
+    e.set(params=params)
+    results = e.run(fatal=True)[RESULTS]
+
+    assert set(results) == {SEIR.SUSCEPTIBLE, SEIR.EXPOSED, SEIR.INFECTED,
+                            SEIR.REMOVED}
+    assert sum(results.values()) == N
+
+
+def test_vectorised_synchronous_dynamics_seed():
+    results = []
+    for _ in range(2):
+        e = VectorisedSynchronousDynamics(SEIVR(), G, max_time=50, seed=3)
+        e.set(params=PARAMS)
+        results.append(e.run(fatal=True)[RESULTS])
+
+    assert results[0] == results[1]
+
+
+def test_vectorised_synchronous_dynamics_initial_occupancy():
+    params = PARAMS.copy()
+    params[SEIVR.P_EXPOSED] = 0.6
+    params[SEIVR.P_VACCINATED_INITIAL] = 0.6
+
+    with pytest.raises(ValueError):
+        Rates.from_params(SEIVR, params)
+
+
+class LocusElements:
+    """
+    Locus with the `elements` method `SynchronousDynamics.do` expects.
+    """
+
+    def __init__(self, locus):
+        self._locus = locus
+
+    def __len__(self):
+        return len(self._locus)
+
+    def elements(self):
+        return list(self._locus)
+
+
+class EpydemicSynchronousDynamics(SynchronousDynamics):
+    """
+    epydemic's `SynchronousDynamics`, which (in epydemic 1.7) asks for the
+    per-element events by time instead of by process and expects loci with
+    an `elements` method, so it would fire no events.
+    """
+
+    def perElementEventDistribution(self, t):
+        dist = super().perElementEventDistribution(self.process())
+        return [(LocusElements(locus), p, ef) for locus, p, ef in dist]
+
+
+@pytest.mark.parametrize('model', [SEIR, SEIVR])
+def test_vectorised_synchronous_dynamics_matches_epydemic(model):
+    """
+    Test the final epidemic size matches epydemic's synchronous dynamics.
+    Without vaccination both have the same transitions per time step.
+    """
+    params = {model.P_EXPOSED: 0.05, model.P_INFECT_ASYMPTOMATIC: 0.1,
+              model.P_INFECT_SYMPTOMATIC: 0.2, model.P_SYMPTOMS: 0.3,
+              model.P_REMOVE: 0.3}
+    if model is SEIVR:
+        params.update({SEIVR.P_VACCINATED_INITIAL: 0.0,
+                       SEIVR.P_VACCINATED: 0.0, SEIVR.VACCINE_RRR: 0.75})
+
+    n = 50
+    max_time = 1000
+
+    removed_should = []
+    for _ in range(n):
+        process = model()
+        process.setMaximumTime(max_time)
+        e = EpydemicSynchronousDynamics(process, G)
+        e.set(params=params)
+        removed_should.append(e.run(fatal=True)[RESULTS][model.REMOVED])
+
+    removed_is = []
+    e = VectorisedSynchronousDynamics(model(), G, max_time, seed=1)
+    e.set(params=params)
+    for _ in range(n):
+        removed_is.append(e.run(fatal=True)[RESULTS][model.REMOVED])
+
+    assert abs(np.mean(removed_is) - np.mean(removed_should)) < 0.03 * N
+
+
+def test_synchronous_step_vaccine():
+    indptr, indices = csr_adjacency(nx.star_graph(10))
+    rng = np.random.default_rng(1)
+
+    rates = Rates(p_exposed=0, p_infect_a=1, p_infect_s=1, p_symptoms=0,
+                  p_remove=0, vac_rrr=1)
+
+    # a perfect vaccine protects from infection
+    states = np.full(11, VACCINATED, dtype=np.int8)
+    states[0] = EXPOSED
+    assert synchronous_step(states, indptr, indices, rates, rng) == 0
+    assert np.all(states[1:] == VACCINATED)
+
+    # without risk reduction, all neighbours are infected
+    rates.vac_rrr = 0
+    assert synchronous_step(states, indptr, indices, rates, rng) == 10
+    assert np.all(states == EXPOSED)
+
+
+def test_neighbours():
+    g = CompactGraph.from_edges(np.array([[0, 1], [0, 2], [2, 3]]),
+                                np.ones(4), np.ones(4))
+
+    src, dst = neighbours(g.indptr, g.indices, np.array([0, 3]))
+    assert src.tolist() == [0, 0, 3]
+    assert dst.tolist() == [1, 2, 2]
+
+    src, dst = neighbours(g.indptr, g.indices, np.array([], dtype=int))
+    assert len(src) == len(dst) == 0
@@ -0,0 +1,128 @@
+import math
+
+import networkx as nx
+import numpy as np
+import pytest
+from epydemic import SEIR, NetworkExperiment, Dynamics, Monitor
+
+from lib.model.compartmental_model.seir import SEIRWithQuarantine
+from lib.model.compartmental_model.seivr import SEIVR, MonitoredSEIVR
+from lib.model.dynamics.gillespie import GillespieDynamics
+from lib.model.dynamics.tau_leaping import TauLeapingDynamics, leap_size
+
+N = 300
+G = nx.fast_gnp_random_graph(N, 5 / N, seed=1)
+
+PARAMS = dict()
+PARAMS[SEIVR.P_EXPOSED] = 0.05
+PARAMS[SEIVR.P_INFECT_ASYMPTOMATIC] = 0.01
+PARAMS[SEIVR.P_INFECT_SYMPTOMATIC] = 0.03
+PARAMS[SEIVR.P_SYMPTOMS] = 0.05
+PARAMS[SEIVR.P_REMOVE] = 0.05
+PARAMS[SEIVR.P_VACCINATED_INITIAL] = 0.1
+PARAMS[SEIVR.P_VACCINATED] = 0.005
+PARAMS[SEIVR.VACCINE_RRR] = 0.75
+
+SEIR_PARAMS = {SEIR.P_EXPOSED: 0.05, SEIR.P_INFECT_ASYMPTOMATIC: 0.01,
+               SEIR.P_INFECT_SYMPTOMATIC: 0.03, SEIR.P_SYMPTOMS: 0.05,
+               SEIR.P_REMOVE: 0.05}
+
+RESULTS = NetworkExperiment.RESULTS
+METADATA = NetworkExperiment.METADATA
+
+
+def test_tau_leaping_dynamics():
+    e = TauLeapingDynamics(SEIVR(), G, seed=1)
+    e.set(params=PARAMS)
+    rc = e.run(fatal=True)
+    assert rc[METADATA][NetworkExperiment.STATUS]
+
+    results = rc[RESULTS]
+    assert set(results) == {SEIVR.SUSCEPTIBLE, SEIVR.EXPOSED, SEIVR.INFECTED,
+                            SEIVR.VACCINATED, SEIVR.REMOVED}
+    assert sum(results.values()) == N
+
+    # the epidemic is over and the remaining susceptibles are vaccinated
+    assert results[SEIVR.EXPOSED] == 0
+    assert results[SEIVR.INFECTED] == 0
+    assert results[SEIVR.SUSCEPTIBLE] == 0
+
+    # the results are labelled as approximate
+    metadata = rc[METADATA]
+    assert metadata[TauLeapingDynamics.APPROXIMATE]
+    assert metadata[TauLeapingDynamics.EPSILON] == \
+        TauLeapingDynamics.DEFAULT_EPSILON
+    assert 0 < metadata[TauLeapingDynamics.LEAPS] < \
+        metadata[Dynamics.EVENTS]
+
+
+def test_tau_leaping_dynamics_epsilon():
+    leaps = []
+    for epsilon in [0.01, 0.1]:
+        e = TauLeapingDynamics(SEIR(), G, max_time=100, seed=1)
+        e.set(params={**SEIR_PARAMS, TauLeapingDynamics.EPSILON: epsilon})
+        rc = e.run(fatal=True)
+        assert rc[METADATA][TauLeapingDynamics.EPSILON] == epsilon
+        leaps.append(rc[METADATA][TauLeapingDynamics.LEAPS])
+
+    # a smaller tolerance needs more leaps
+    assert leaps[0] > leaps[1]
+
+    e = TauLeapingDynamics(SEIR(), G)
+    e.set(params={**SEIR_PARAMS, TauLeapingDynamics.EPSILON: 0})
+    with pytest.raises(ValueError):
+        e.run(fatal=True)
+
+
+def test_tau_leaping_dynamics_quarantine():
+    with pytest.raises(ValueError):
+        TauLeapingDynamics(SEIRWithQuarantine(), G)
+
+
+def test_tau_leaping_dynamics_monitor():
+    params = {**PARAMS, Monitor.DELTA: 10}
+    e = TauLeapingDynamics(MonitoredSEIVR(), G, max_time=100, seed=1)
+    e.set(params=params)
+    results = e.run(fatal=True)[RESULTS]
+
+    assert results[Monitor.OBSERVATIONS] == list(range(0, 101, 10))
+
+    names = [SEIVR.SUSCEPTIBLE, SEIVR.EXPOSED, SEIVR.INFECTED,
+             SEIVR.VACCINATED, SEIVR.REMOVED]
+    series = np.array([results[Monitor.timeSeriesForLocus(name)]
+                       for name in names])
+    assert np.all(series.sum(axis=0) == N)
+    assert np.all(np.diff(series[names.index(SEIVR.REMOVED)]) >= 0)
+
+
+@pytest.mark.parametrize('model, params', [(SEIR, SEIR_PARAMS),
+                                           (SEIVR, PARAMS)])
+def test_tau_leaping_dynamics_matches_gillespie(model, params):
+    n = 20
+    max_time = 1000
+
+    removed = []
+    for cls in [GillespieDynamics, TauLeapingDynamics]:
+        e = cls(model(), G, max_time, seed=1)
+        e.set(params=params)
+        removed.append([e.run(fatal=True)[RESULTS][model.REMOVED]
+                        for _ in range(n)])
+
+    assert abs(np.mean(removed[0]) - np.mean(removed[1])) < 0.05 * N
+
+
+def test_leap_size():
+    counts = np.array([100, 10, 0])
+
+    # bounded by the expected change of a compartment ...
+    assert leap_size(counts, np.array([-1., 1., 0.]), np.array([1., 1., 0.]),
+                     0.1) == 1.
+    # ... or by its variance
+    assert leap_size(counts, np.array([-1., 1., 0.]),
+                     np.array([400., 1., 0.]), 0.1) == 0.25
+
+    # at least one node may change
+    assert leap_size(counts, np.array([0., -2., 2.]), np.array([0., 2., 2.]),
+                     0.01) == 0.5
+
+    assert leap_size(counts, np.zeros(3), np.zeros(3), 0.1) == math.inf
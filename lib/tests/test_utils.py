@@ -1,6 +1,8 @@
 # Unit tests for model utils
-from lib.model.utils import discrete_rejection_sample, binary_search_lowest_idx
+from lib.model.utils import discrete_rejection_sample, \
+    discrete_inverse_sample, binary_search_lowest_idx, alias_table, load_npz
 import numpy as np
+import pytest
 
 
 def test_discrete_rejection_sample_expected():
@@ -17,6 +19,19 @@ def test_discrete_rejection_sample_range():
         assert 0 <= x < 10
 
 
+def test_discrete_inverse_sample_expected():
+    # probability distribution, 1 if x is 1 else 0
+    # must always return 1
+    x = discrete_inverse_sample(lambda y: int(y == 1), 0, 2, 100, seed=0)
+    assert (x == 1).all()
+
+
+def test_discrete_inverse_sample_range():
+    x = discrete_inverse_sample(lambda y: 0.5, 0, 5, 1000, seed=0)
+    assert x.shape == (1000,)
+    assert ((0 <= x) & (x < 5)).all()
+
+
 def test_binary_search():
     ls = np.array([0.2, 0.2, 0.2, 0.2, 0.2]).cumsum()
     assert binary_search_lowest_idx(ls, 0, len(ls) - 1, 0.1) == 0
@@ -24,3 +39,44 @@ def test_binary_search():
     assert binary_search_lowest_idx(ls, 0, len(ls) - 1, 0.3) == 1
     assert binary_search_lowest_idx(ls, 0, len(ls) - 1, 0.9) == 4
     assert binary_search_lowest_idx(ls, 0, len(ls) - 1, 1) == 4
+
+
+def test_alias_table():
+    p = np.array([0.1, 0.0, 0.5, 0.15, 0.25])
+    prob, alias = alias_table(p)
+
+    # probability of each outcome implied by the table
+    n = len(p)
+    q = prob / n
+    for k in range(n):
+        q[alias[k]] += (1 - prob[k]) / n
+
+    assert np.allclose(q, p)
+
+
+def test_load_npz_mmap(tmpdir):
+    fn = str(tmpdir.join('arrays.npz'))
+    arrays = dict(
+        a=np.arange(10, dtype=np.int32), b=np.eye(3), c=np.array(['x', 'yz']),
+        d=np.zeros(0)
+    )
+    np.savez(fn, **arrays)
+
+    loaded = load_npz(fn, mmap=True)
+    assert set(loaded) == set(arrays)
+    for k, v in arrays.items():
+        assert loaded[k].dtype == v.dtype
+        assert (loaded[k] == v).all()
+
+    # the arrays are not read into memory
+    assert isinstance(loaded['a'], np.memmap)
+
+
+def test_load_npz_mmap_compressed(tmpdir):
+    fn = str(tmpdir.join('arrays.npz'))
+    np.savez_compressed(fn, a=np.arange(10))
+
+    assert (load_npz(fn)['a'] == np.arange(10)).all()
+
+    with pytest.raises(ValueError):
+        load_npz(fn, mmap=True)